@@ -0,0 +1,230 @@
+"""벤치마크용 가짜 OpenAI 서버 (채팅, 음성 인식, 음성 합성을 지연 시간/스트리밍 설정과 함께 흉내냄)"""
+import json
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+TTS_SAMPLE_RATE = 24000
+
+
+@dataclass
+class FakeOpenAIConfig:
+    """가짜 서버의 응답 내용과 지연 시간 (초)"""
+    chat_first_token: float = 0.4  # 채팅 첫 토큰까지
+    chat_token_interval: float = 0.03  # 토큰 사이 간격
+    chat_chars_per_token: int = 2
+    replies: tuple = (
+        "그랬구나! 친구랑 블록 놀이를 했다니 정말 재미있었겠다. 어떤 걸 만들었어?",
+        "우와, 높은 탑을 만들었구나. 무너지지 않게 조심조심 쌓았겠네! 누구랑 같이 했어?",
+        "친구랑 같이 하니까 더 신났겠다. 다음에는 뭘 만들어 보고 싶어?",
+        "멋진 생각이야! 만들다가 어려운 게 있으면 천천히 다시 해 보면 돼. 오늘 기분은 어땠어?",
+    )
+    stt_latency: float = 0.5  # 업로드를 받은 뒤 인식 결과까지
+    stt_upload_bytes_per_second: float = 250_000  # 흉내낼 업로드 속도 (기본 2Mbps)
+    transcript: str = "오늘 유치원에서 친구랑 블록 놀이 했어"
+    tts_first_byte: float = 0.3  # 음성 합성 첫 바이트까지
+    tts_realtime_factor: float = 8.0  # 재생 길이 대비 합성 속도
+    tts_seconds_per_char: float = 0.08  # 글자당 음성 길이
+    moderation_latency: float = 0.2
+
+
+@dataclass
+class FakeOpenAIStats:
+    requests: dict = field(default_factory=dict)  # 경로별 요청 수
+    upload_bytes: int = 0
+    connections: int = 0  # 쓸 수 있었던 TCP 연결 수 (통계를 초기화할 때 열려 있던 연결 + 새로 맺은 연결)
+    new_connections: int = 0  # 새로 맺은 TCP 연결 수
+
+    def count(self, path):
+        self.requests[path] = self.requests.get(path, 0) + 1
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # 벤치마크가 끝나면서 끊긴 연결은 조용히 무시
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive와 chunked 응답 사용
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.open_connections += 1
+            self.server.stats.connections += 1
+            self.server.stats.new_connections += 1
+
+    def finish(self):
+        try:
+            super().finish()
+        finally:
+            with self.server.lock:
+                self.server.open_connections -= 1
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def config(self):
+        return self.server.config
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return self.rfile.read(length) if length else b""
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _start_chunked(self, content_type):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def _end_chunked(self):
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.stats.count(self.path)
+        if self.path.rstrip("/").endswith("/models"):
+            self._send_json({"object": "list", "data": [{"id": "gpt-4o-mini", "object": "model", "created": 0, "owned_by": "fake"}]})
+        else:
+            self._send_json({"error": {"message": f"unknown path {self.path}"}}, status=404)
+
+    def do_POST(self):
+        body = self._read_body()
+        with self.server.lock:
+            self.server.stats.count(self.path)
+        if self.path.endswith("/chat/completions"):
+            self._chat(json.loads(body or b"{}"))
+        elif self.path.endswith("/audio/transcriptions"):
+            self._transcription(body)
+        elif self.path.endswith("/audio/speech"):
+            self._speech(json.loads(body or b"{}"))
+        elif self.path.endswith("/moderations"):
+            time.sleep(self.config.moderation_latency)
+            self._send_json({"id": "modr-fake", "model": "omni-moderation-latest", "results": [{
+                "flagged": False, "categories": {}, "category_scores": {}, "category_applied_input_types": {}
+            }]})
+        else:
+            self._send_json({"error": {"message": f"unknown path {self.path}"}}, status=404)
+
+    def _chat(self, request):
+        config = self.config
+        with self.server.lock:
+            reply = config.replies[self.server.stats.requests.get(self.path, 1) % len(config.replies)]
+        created = int(time.time())
+        time.sleep(config.chat_first_token)
+        if not request.get("stream"):
+            time.sleep(config.chat_token_interval * len(reply) / config.chat_chars_per_token)
+            self._send_json({
+                "id": "chatcmpl-fake", "object": "chat.completion", "created": created, "model": request.get("model", ""),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": reply}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+            })
+            return
+
+        self._start_chunked("text/event-stream")
+        step = config.chat_chars_per_token
+        for i in range(0, len(reply), step):
+            chunk = {
+                "id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": created, "model": request.get("model", ""),
+                "choices": [{"index": 0, "delta": {"content": reply[i:i + step]}, "finish_reason": None}],
+            }
+            self._write_chunk(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            time.sleep(config.chat_token_interval)
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._end_chunked()
+
+    def _transcription(self, body):
+        config = self.config
+        with self.server.lock:
+            self.server.stats.upload_bytes += len(body)
+        # 업로드 속도를 흉내내서 큰 파일일수록 늦게 응답
+        time.sleep(len(body) / config.stt_upload_bytes_per_second + config.stt_latency)
+        self._send_json({"text": config.transcript})
+
+    def _speech(self, request):
+        config = self.config
+        seconds = max(0.3, len(request.get("input", "")) * config.tts_seconds_per_char)
+        t = np.arange(int(seconds * TTS_SAMPLE_RATE)) / TTS_SAMPLE_RATE
+        pcm = (0.1 * np.sin(2 * np.pi * 330 * t) * 32767).astype("<i2").tobytes()
+
+        time.sleep(config.tts_first_byte)
+        self._start_chunked("application/octet-stream")
+        chunk_bytes = TTS_SAMPLE_RATE // 5 * 2  # 0.2초 분량
+        for i in range(0, len(pcm), chunk_bytes):
+            self._write_chunk(pcm[i:i + chunk_bytes])
+            time.sleep(0.2 / config.tts_realtime_factor)
+        self._end_chunked()
+
+
+class FakeOpenAIServer:
+    """백그라운드 스레드에서 도는 가짜 OpenAI API 서버"""
+
+    def __init__(self, config=None, host="127.0.0.1", port=0):
+        self.httpd = _Server((host, port), _Handler)
+        self.httpd.config = config or FakeOpenAIConfig()
+        self.httpd.stats = FakeOpenAIStats()
+        self.httpd.lock = threading.Lock()
+        self.httpd.open_connections = 0  # 지금 열려 있는 연결 수 (keep-alive로 재사용 중인 연결 포함)
+        self.thread = None
+
+    @property
+    def config(self):
+        return self.httpd.config
+
+    @config.setter
+    def config(self, value):
+        self.httpd.config = value
+
+    @property
+    def stats(self):
+        return self.httpd.stats
+
+    def reset_stats(self):
+        """요청 통계 초기화 (미리 열어 둔 연결도 이번 측정에서 쓸 수 있는 연결로 셈)"""
+        with self.httpd.lock:
+            self.httpd.stats = FakeOpenAIStats(connections=self.httpd.open_connections)
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+if __name__ == "__main__":
+    server = FakeOpenAIServer(port=8765).start()
+    print(f"가짜 OpenAI 서버: {server.base_url} (OPENAI_BASE_URL로 지정하세요, Ctrl+C로 종료)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,197 @@
+"""벤치마크용 가짜 텔레그램 Bot API 서버 (부모님 메시지를 대본대로 보내고, 봇이 보낸 메시지를 기록)"""
+import json
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+
+def _decode_params(handler, body):
+    """python-telegram-bot이 보내는 폼/JSON 파라미터 해석"""
+    content_type = handler.headers.get("Content-Type", "")
+    if "application/json" in content_type:
+        return json.loads(body or b"{}")
+    params = {}
+    for key, values in parse_qs(body.decode("utf-8")).items():
+        try:
+            params[key] = json.loads(values[0])
+        except ValueError:
+            params[key] = values[0]
+    return params
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # 벤치마크가 끝나면서 끊긴 연결은 조용히 무시
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._handle(b"")
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self._handle(self.rfile.read(length) if length else b"")
+
+    def _handle(self, body):
+        fake = self.server.fake
+        parts = self.path.split("?")[0].strip("/").split("/")
+        if len(parts) < 2 or parts[0] != f"bot{fake.token}":
+            self._reply({"ok": False, "error_code": 404, "description": "Not Found"}, status=404)
+            return
+        method = parts[1]
+        params = _decode_params(self, body) if "multipart" not in self.headers.get("Content-Type", "") else {}
+        self._reply({"ok": True, "result": fake.call(method, params)})
+
+    def _reply(self, payload, status=200):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class FakeTelegram:
+    """백그라운드 스레드에서 도는 가짜 Bot API 서버"""
+
+    def __init__(self, token="123456:FAKE-TOKEN", chat_id=1000, host="127.0.0.1", port=0):
+        self.token = token
+        self.chat_id = chat_id
+        self.httpd = _Server((host, port), _Handler)
+        self.httpd.fake = self
+        self.thread = None
+        self.condition = threading.Condition()
+        self.updates = []  # 아직 봇이 가져가지 않은 업데이트
+        self.next_update_id = 1
+        self.next_message_id = 1
+        self.sent = []  # 봇이 보낸 메시지 (보낸 시각, chat_id, 텍스트)
+        self.calls = {}  # 메서드별 호출 수
+        self.webhook = None  # 봇이 등록한 (URL, 비밀 값), 있으면 getUpdates 대신 이 주소로 업데이트를 보냄
+        self.webhook_status = []  # 웹훅으로 보낸 업데이트의 HTTP 응답 코드 (연결 실패는 None)
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        with self.condition:
+            self.condition.notify_all()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def _message(self, text, chat_id=None):
+        chat_id = chat_id or self.chat_id
+        message = {
+            "message_id": self.next_message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private", "first_name": "Parent"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Parent"},
+            "text": text,
+        }
+        self.next_message_id += 1
+        return message
+
+    def make_update(self, text, chat_id=None):
+        """부모님이 보낸 텍스트 메시지 업데이트 생성 (명령어면 entity 포함)"""
+        with self.condition:
+            message = self._message(text, chat_id)
+            if text.startswith("/"):
+                message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+            update = {"update_id": self.next_update_id, "message": message}
+            self.next_update_id += 1
+            return update
+
+    def push_text(self, text, chat_id=None):
+        """부모님 메시지를 보내고 보낸 시각(perf_counter)을 반환 (웹훅이 등록돼 있으면 웹훅으로, 아니면 getUpdates 대기열로)"""
+        update = self.make_update(text, chat_id)
+        with self.condition:
+            webhook = self.webhook
+            if webhook is None:
+                self.updates.append(update)
+                self.condition.notify_all()
+        if webhook is not None:
+            threading.Thread(target=self.post_webhook, args=(update,), daemon=True).start()
+        return time.perf_counter()
+    
+    def post_webhook(self, update, secret=None):
+        """실제 텔레그램처럼 등록된 웹훅 주소로 업데이트를 POST (secret을 주면 그 값으로 보내서 검증을 시험)"""
+        url, registered_secret = self.webhook
+        secret = registered_secret if secret is None else secret
+        headers = {"Content-Type": "application/json"}
+        if secret:
+            headers["X-Telegram-Bot-Api-Secret-Token"] = secret
+        request = urllib.request.Request(url, data=json.dumps(update, ensure_ascii=False).encode("utf-8"), headers=headers)
+        try:
+            with urllib.request.urlopen(request, timeout=10) as response:
+                status = response.status
+        except urllib.error.HTTPError as e:
+            status = e.code
+        except OSError:
+            status = None
+        with self.condition:
+            self.webhook_status.append(status)
+        return status
+
+    def call(self, method, params):
+        with self.condition:
+            self.calls[method] = self.calls.get(method, 0) + 1
+        if method == "getMe":
+            return {"id": 123456, "is_bot": True, "first_name": "TODAK", "username": "todak_fake_bot",
+                    "can_join_groups": False, "can_read_all_group_messages": False, "supports_inline_queries": False}
+        if method == "getUpdates":
+            return self._get_updates(params)
+        if method in ("sendMessage", "editMessageText"):
+            with self.condition:
+                self.sent.append((time.perf_counter(), params.get("chat_id"), params.get("text", "")))
+                return self._message(params.get("text", ""), params.get("chat_id"))
+        if method == "setWebhook":
+            with self.condition:
+                self.webhook = (params.get("url"), params.get("secret_token"))
+            return True
+        if method == "deleteWebhook":
+            with self.condition:
+                self.webhook = None
+            return True
+        if method == "getWebhookInfo":
+            url = self.webhook[0] if self.webhook else ""
+            return {"url": url, "has_custom_certificate": False, "pending_update_count": 0}
+        return True
+
+    def _get_updates(self, params):
+        offset = int(params.get("offset") or 0)
+        timeout = min(float(params.get("timeout") or 0), 1.0)  # 종료가 늦어지지 않도록 짧게 대기
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            self.updates = [u for u in self.updates if u["update_id"] >= offset]
+            while not self.updates and time.monotonic() < deadline:
+                self.condition.wait(deadline - time.monotonic())
+            return list(self.updates)
+
+
+if __name__ == "__main__":
+    fake = FakeTelegram(port=8766).start()
+    print(f"가짜 텔레그램 서버: {fake.base_url} (TELEGRAM_BASE_URL로 지정하세요, token={fake.token}, chat_id={fake.chat_id})")
+    try:
+        while True:
+            fake.push_text(input("부모님 메시지> "))
+    except (KeyboardInterrupt, EOFError):
+        fake.stop()
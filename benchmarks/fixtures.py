@@ -0,0 +1,45 @@
+"""벤치마크용 음성 조각 (녹음한 WAV 파일 또는 합성 음성)"""
+import wave
+from pathlib import Path
+
+import numpy as np
+
+SAMPLE_RATE = 16000
+FIXTURE_DIR = Path(__file__).resolve().parent / "fixtures"
+
+
+def load_wav(path, sample_rate=SAMPLE_RATE):
+    """16kHz 모노 16bit WAV 파일을 int16 배열로 읽기"""
+    with wave.open(str(path), 'rb') as wav_file:
+        if wav_file.getnchannels() != 1 or wav_file.getsampwidth() != 2:
+            raise ValueError(f"{path}: 모노 16bit WAV만 지원합니다.")
+        if wav_file.getframerate() != sample_rate:
+            raise ValueError(f"{path}: {sample_rate}Hz WAV만 지원합니다.")
+        return np.frombuffer(wav_file.readframes(wav_file.getnframes()), dtype=np.int16)
+
+
+def synthetic_speech(seconds=5.0, sample_rate=SAMPLE_RATE, seed=0):
+    """말소리처럼 음절 단위로 세기가 바뀌는 합성 신호"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    pitch = 260 + 40 * np.sin(2 * np.pi * 0.7 * t)
+    phase = 2 * np.pi * np.cumsum(pitch) / sample_rate
+    voice = sum(np.sin(k * phase) / k for k in range(1, 8))
+    syllables = np.clip(np.sin(2 * np.pi * 4 * t), 0, None)
+    signal = 0.3 * voice * syllables + rng.normal(0, 0.003, len(t))
+    return (np.clip(signal, -1, 1) * 32767).astype(np.int16)
+
+
+def utterance(seconds=3.0, lead_silence=0.5, sample_rate=SAMPLE_RATE, seed=0):
+    """앞에 짧은 무음이 붙은 아이 발화 하나 (끝의 무음은 재생기가 계속 채워 줌)"""
+    rng = np.random.default_rng(seed + 1)
+    silence = (rng.normal(0, 0.003, int(lead_silence * sample_rate)) * 32767).astype(np.int16)
+    return np.concatenate((silence, synthetic_speech(seconds, sample_rate, seed)))
+
+
+def load_fixtures(directory=FIXTURE_DIR):
+    """fixtures 폴더의 WAV 파일들 (없으면 합성 발화 3개)"""
+    paths = sorted(Path(directory).glob("*.wav")) if Path(directory).exists() else []
+    if paths:
+        return [(path.name, load_wav(path)) for path in paths]
+    return [(f"synthetic-{i}", utterance(seconds=2.0 + i, seed=i)) for i in range(3)]
@@ -0,0 +1,363 @@
+"""main.py 대화 파이프라인 오프라인 벤치마크
+
+실제 API 키나 마이크 없이, 가짜 OpenAI 서버와 가짜 텔레그램 Bot API를 띄우고
+녹음 WAV를 audio_callback으로 흘려보내며 부모님 메시지를 대본대로 보내서
+시나리오별 턴 지연 시간, 이벤트 루프 지연, 메모리를 측정합니다.
+
+사용법:
+    python benchmarks/run_benchmarks.py [--scenario 이름 ...] [--speed 1.0] [--webhook] [--json 결과.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import types
+from pathlib import Path
+
+import numpy as np
+
+from fake_openai import FakeOpenAIConfig, FakeOpenAIServer
+from fake_telegram import FakeTelegram
+from fixtures import load_fixtures
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# 시나리오: 턴 수, (턴 시작 후 초, 부모님 메시지) 목록, 가짜 OpenAI 설정, 남은 사용시간 (초)
+SCENARIOS = {
+    "single_turn": {"turns": 1},
+    "conversation": {"turns": 4},
+    "parent_messages": {"turns": 2, "parent_messages": [(0.5, "저녁 먹자!"), (1.5, "양치하고 자자")]},
+    "slow_network": {"turns": 2, "config": {
+        "chat_first_token": 1.2, "stt_latency": 1.5, "tts_first_byte": 0.8,
+        "stt_upload_bytes_per_second": 32_000, "tts_realtime_factor": 3.0,
+    }},
+    # main()처럼 사용시간이 끝날 때까지 턴을 이어감 (마지막 턴은 녹음 도중 시간이 끝남)
+    "time_limit": {"turns": 10, "usage_left_seconds": 8.0, "until_limit": True},
+}
+
+
+class FakeMicrophone:
+    """다음 턴에 흘려보낼 음성 조각을 들고 있는 가짜 마이크"""
+
+    def __init__(self, speed=1.0):
+        self.speed = speed
+        self.clip = np.zeros(0, dtype=np.int16)
+        self.noise = np.random.default_rng(0)
+
+    def load(self, clip):
+        self.clip = clip
+
+
+class FakeInputStream:
+    """마이크 대신 음성 조각을 실제 시간 간격으로 audio_callback에 넣어주는 입력 스트림"""
+
+    microphone = FakeMicrophone()
+
+    def __init__(self, samplerate=16000, channels=1, dtype=None, callback=None, blocksize=1024, **kwargs):
+        self.samplerate = samplerate
+        self.blocksize = blocksize
+        self.callback = callback
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        mic = self.microphone
+        clip = mic.clip.astype(np.float32) / 32767
+        interval = self.blocksize / self.samplerate / mic.speed
+        position = 0
+        next_tick = time.perf_counter()
+        while not self.stopped.is_set():
+            block = clip[position:position + self.blocksize]
+            if len(block) < self.blocksize:
+                # 조각이 끝나면 조용한 방 소음을 계속 흘려보냄
+                filler = mic.noise.normal(0, 0.003, self.blocksize - len(block)).astype(np.float32)
+                block = np.concatenate((block, filler))
+            position += self.blocksize
+            self.callback(block.reshape(-1, 1), self.blocksize, None, None)
+            next_tick += interval
+            time.sleep(max(0.0, next_tick - time.perf_counter()))
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join(timeout=1)
+
+    def close(self):
+        self.stop()
+
+
+class FakeOutputStream:
+    """스피커 대신 실제 시간 간격으로 재생 콜백을 불러서 재생한 길이만 세는 출력 스트림"""
+
+    speed = 1.0
+    played_seconds = 0.0
+
+    def __init__(self, samplerate=24000, channels=1, dtype=None, callback=None, blocksize=1024, **kwargs):
+        self.samplerate = samplerate
+        self.blocksize = blocksize
+        self.callback = callback
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        outdata = np.zeros((self.blocksize, 1), dtype=np.int16)
+        interval = self.blocksize / self.samplerate / self.speed
+        next_tick = time.perf_counter()
+        while not self.stopped.is_set():
+            self.callback(outdata, self.blocksize, None, None)
+            if outdata.any():
+                FakeOutputStream.played_seconds += self.blocksize / self.samplerate
+            next_tick += interval
+            time.sleep(max(0.0, next_tick - time.perf_counter()))
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join(timeout=1)
+
+    def close(self):
+        self.stop()
+
+
+def install_audio_stand_ins():
+    """sounddevice(마이크/스피커)는 가짜로, pynput은 쓸 수 없으면 빈 모듈로 대체"""
+    fake_sd = types.ModuleType("sounddevice")
+    fake_sd.InputStream = FakeInputStream
+    fake_sd.OutputStream = FakeOutputStream
+    fake_sd.query_devices = lambda *args, **kwargs: [{"name": "fake microphone", "max_input_channels": 1}]
+    fake_sd.default = types.SimpleNamespace(device=(0, 0))
+    sys.modules["sounddevice"] = fake_sd
+    try:
+        import pynput.keyboard  # noqa: F401
+    except Exception:
+        fake_pynput = types.ModuleType("pynput")
+        fake_pynput.keyboard = types.ModuleType("pynput.keyboard")
+        sys.modules["pynput"] = fake_pynput
+        sys.modules["pynput.keyboard"] = fake_pynput.keyboard
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(fraction * (len(ordered) - 1)))]
+
+
+async def monitor_loop_lag(samples, interval=0.01):
+    """이벤트 루프가 얼마나 늦게 깨어나는지 계속 측정 (ms)"""
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append((time.perf_counter() - started - interval) * 1000)
+
+
+async def run_scenario(main, name, scenario, openai_server, telegram, clips):
+    """시나리오 하나 실행 후 측정 결과 반환"""
+    openai_server.config = FakeOpenAIConfig(**scenario.get("config", {}))
+    openai_server.reset_stats()
+    session = main.local_session
+    session.reset_daily_usage()
+    session.daily_usage_seconds = session.daily_time_limit * 60 - scenario.get("usage_left_seconds", session.daily_time_limit * 60)
+    main.usage_meter.collect()
+    session.memory = main.ConversationMemory()
+    loop = asyncio.get_running_loop()
+
+    parent_sent = {}  # 메시지 -> 가짜 텔레그램에 넣은 시각
+    parent_spoken = {}  # 메시지 -> 토닥이 읽기 시작한 시각
+    original_speak_texts = main.speak_texts
+
+    async def speak_texts(texts, *args):
+        texts = list(texts)
+        if texts and texts[0] == main.PARENT_MESSAGE_PREFIX:
+            parent_spoken.setdefault(texts[1], time.perf_counter())
+        return await original_speak_texts(texts, *args)
+
+    main.speak_texts = speak_texts
+    lag_samples = []
+    lag_task = asyncio.create_task(monitor_loop_lag(lag_samples))
+    tracemalloc.start()
+    turn_durations = []
+    limit_reached = False
+    started = time.perf_counter()
+
+    try:
+        for turn in range(scenario.get("turns", 1)):
+            if scenario.get("until_limit"):
+                session.add_usage_seconds(main.usage_meter.collect())
+                if not session.check_time_limit()[0]:
+                    limit_reached = True
+                    await main.text_to_speech(main.FAREWELL_MESSAGE)
+                    break
+            clip_name, clip = clips[turn % len(clips)]
+            FakeInputStream.microphone.load(clip)
+            if turn == 0:
+                for delay, text in scenario.get("parent_messages", []):
+                    loop.call_later(delay, lambda text=text: parent_sent.setdefault(text, telegram.push_text(text)))
+            trace = await main.run_child_turn(session)
+            if trace is not None:
+                durations = trace.durations()
+                marks = trace.marks
+                if "capture_start" in marks and "playback_end" in marks:
+                    durations["turn_total"] = round(marks["playback_end"] - marks["capture_start"], 1)
+                turn_durations.append(durations)
+
+        # 아직 읽지 못한 부모님 메시지 기다리기
+        deadline = time.perf_counter() + 10
+        while len(parent_spoken) < len(scenario.get("parent_messages", [])) and time.perf_counter() < deadline:
+            await asyncio.sleep(0.1)
+    finally:
+        main.speak_texts = original_speak_texts
+        lag_task.cancel()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        session.memory.close()
+
+    stages = sorted({stage for durations in turn_durations for stage in durations})
+    parent_latencies = [(parent_spoken[text] - sent) * 1000 for text, sent in parent_sent.items() if text in parent_spoken]
+    return {
+        "scenario": name,
+        "turns": len(turn_durations),
+        "elapsed_s": round(time.perf_counter() - started, 2),
+        "stages_ms": {
+            stage: {
+                "p50": percentile([d[stage] for d in turn_durations if stage in d], 0.5),
+                "p95": percentile([d[stage] for d in turn_durations if stage in d], 0.95),
+            }
+            for stage in stages
+        },
+        "loop_lag_ms": {
+            "p50": round(percentile(lag_samples, 0.5) or 0, 2),
+            "p95": round(percentile(lag_samples, 0.95) or 0, 2),
+            "max": round(max(lag_samples, default=0), 2),
+        },
+        "parent_delivery_ms": [round(value, 1) for value in parent_latencies],
+        "python_peak_mb": round(peak / 1024 / 1024, 2),
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "openai_requests": dict(openai_server.stats.requests),
+        "openai_upload_bytes": openai_server.stats.upload_bytes,
+        "openai_connections": openai_server.stats.connections,
+        "openai_new_connections": openai_server.stats.new_connections,
+        "time_limit_reached": limit_reached,
+    }
+
+
+def print_result(result):
+    print(f"\n=== {result['scenario']} ({result['turns']}턴, {result['elapsed_s']}초) ===")
+    print(f"{'단계':<16}{'p50(ms)':>10}{'p95(ms)':>10}")
+    for stage, values in result["stages_ms"].items():
+        print(f"{stage:<16}{values['p50']:>10.0f}{values['p95']:>10.0f}")
+    lag = result["loop_lag_ms"]
+    print(f"이벤트 루프 지연: p50 {lag['p50']}ms / p95 {lag['p95']}ms / 최대 {lag['max']}ms")
+    if result["parent_delivery_ms"]:
+        print(f"부모님 메시지 전달: {result['parent_delivery_ms']} ms")
+    print(f"메모리: 파이썬 최대 {result['python_peak_mb']}MB, 프로세스 최대 RSS {result['max_rss_mb']}MB")
+    print(f"OpenAI 요청: {result['openai_requests']} (업로드 {result['openai_upload_bytes']}바이트, 연결 {result['openai_connections']}개 중 새 연결 {result['openai_new_connections']}개)")
+    if result["time_limit_reached"]:
+        print("사용시간이 끝나서 작별 인사 후 종료했습니다.")
+
+
+async def run(args):
+    openai_server = FakeOpenAIServer().start()
+    telegram = FakeTelegram().start()
+    work_dir = Path(tempfile.mkdtemp(prefix="todak-bench-"))
+
+    # main.py는 가져올 때 환경 변수를 읽으므로 먼저 설정
+    os.environ.update({
+        "OPENAI_API_KEY": "sk-fake",
+        "OPENAI_BASE_URL": openai_server.base_url,
+        "TELEGRAM_BOT_TOKEN": telegram.token,
+        "TELEGRAM_BASE_URL": telegram.base_url,
+        "PARENT_CHAT_ID": str(telegram.chat_id),
+        "TODAK_TTS_CACHE_DIR": str(work_dir / "tts_cache"),
+        "TODAK_TRACE_FILE": str(work_dir / "turn_traces.jsonl"),
+        "TODAK_STARTUP_TRACE_FILE": str(work_dir / "startup_traces.jsonl"),
+        "TODAK_STATE_DB": str(work_dir / "todak_state.db"),
+    })
+    if args.webhook:
+        # 부모님 메시지를 getUpdates 대신 가짜 텔레그램이 봇의 웹훅 서버로 바로 POST
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            port = probe.getsockname()[1]
+        os.environ.update({
+            "TELEGRAM_WEBHOOK_URL": f"http://127.0.0.1:{port}/todak",
+            "TELEGRAM_WEBHOOK_LISTEN": "127.0.0.1",
+            "TELEGRAM_WEBHOOK_PORT": str(port),
+        })
+    if shutil.which("ffmpeg") is None:
+        os.environ.setdefault("STT_UPLOAD_FORMAT", "wav")
+    install_audio_stand_ins()
+    FakeInputStream.microphone.speed = args.speed
+    FakeOutputStream.speed = args.speed
+    sys.path.insert(0, str(ROOT))
+    import main
+
+    main.main_loop = asyncio.get_running_loop()
+    main.startup_trace.mark("main_start")
+    main.startup_trace.mark("state_start")
+    main.open_state()
+    main.startup_trace.mark("state_ready")
+    main.local_session = main.session_registry.for_device(main.DEVICE_ID)
+    main.local_session.attached = True
+    # main()처럼 오디오 준비와 OpenAI/TTS 캐시/텔레그램 준비를 동시에 진행 (시나리오는 모두 준비된 뒤에 시작)
+    services_task = asyncio.create_task(main.attach_services(main.startup_trace))
+    await main.timed_phase(main.startup_trace, "audio", asyncio.to_thread(main.prepare_audio))
+    main.startup_trace.mark("capture_ready")
+    await services_task
+    clips = load_fixtures(args.fixtures) if args.fixtures else load_fixtures()
+    parent_task = asyncio.create_task(main.local_session.scheduler.run())
+    outbox_task = asyncio.create_task(main.telegram_outbox.run())
+
+    results = []
+    try:
+        for name in args.scenario or list(SCENARIOS):
+            results.append(await run_scenario(main, name, SCENARIOS[name], openai_server, telegram, clips))
+    finally:
+        parent_task.cancel()
+        outbox_task.cancel()
+        main.session_registry.close()  # 요약/모더레이션 같은 백그라운드 작업 정리
+        main.audio_player.close()
+        if main.state_store is not None:
+            main.state_store.close()
+        if main.telegram_app:
+            if main.telegram_app.updater.running:
+                await main.telegram_app.updater.stop()
+            await main.telegram_app.stop()
+            await main.telegram_app.shutdown()
+        await main.client.close()
+        openai_server.stop()
+        telegram.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    for result in results:
+        print_result(result)
+    if telegram.webhook_status:
+        print(f"\n웹훅 전송: {len(telegram.webhook_status)}건, 응답 코드 {sorted(set(telegram.webhook_status), key=str)}")
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"\n결과를 {args.json}에 저장했습니다.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="main.py 대화 파이프라인 오프라인 벤치마크")
+    parser.add_argument("--scenario", action="append", choices=list(SCENARIOS), help="실행할 시나리오 (여러 번 지정 가능, 기본: 전부)")
+    parser.add_argument("--speed", type=float, default=1.0, help="녹음/재생 시간 배속 (네트워크 지연은 그대로)")
+    parser.add_argument("--fixtures", help="16kHz 모노 WAV가 들어 있는 폴더 (기본: benchmarks/fixtures, 없으면 합성 음성)")
+    parser.add_argument("--webhook", action="store_true", help="텔레그램 봇을 폴링 대신 웹훅 모드로 실행 (python-telegram-bot[webhooks] 필요)")
+    parser.add_argument("--json", help="결과를 JSON으로 저장할 경로")
+    asyncio.run(run(parser.parse_args()))
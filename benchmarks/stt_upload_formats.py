@@ -0,0 +1,66 @@
+"""STT 업로드 형식별 크기와 지연 시간 비교
+
+사용법:
+    python benchmarks/stt_upload_formats.py [녹음.wav ...] [--live] [--repeat 3]
+
+WAV 파일은 16kHz 모노 16bit여야 합니다. 파일을 주지 않으면 5초짜리 합성 음성을 사용합니다.
+--live를 주면 실제 whisper-1에 업로드해서 압축 + 전송 + 인식까지의 지연 시간을 잽니다 (유료 호출).
+"""
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import main  # noqa: E402
+from fixtures import load_wav, synthetic_speech  # noqa: E402
+
+
+async def measure(audio, upload_format, live, repeat):
+    """형식 하나에 대해 (바이트 수, 압축 시간, STT 지연 시간 목록) 측정"""
+    encode_times = []
+    stt_times = []
+    size = 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        upload = await main.encode_audio_for_upload(audio, main.sample_rate, upload_format)
+        encoded = time.perf_counter()
+        encode_times.append(encoded - started)
+        size = len(upload[1])
+        if upload[0] != f"audio.{upload_format}":
+            return None  # 압축 실패로 WAV가 대신 나옴
+        if live:
+            async with main.openai_semaphore:
+                await main.client.audio.transcriptions.create(model="whisper-1", file=upload)
+            stt_times.append(time.perf_counter() - started)
+    return size, statistics.median(encode_times), stt_times
+
+
+async def run(args):
+    clips = [(Path(path).name, load_wav(path)) for path in args.files] or [("synthetic", synthetic_speech())]
+    formats = ["wav"] + list(main.UPLOAD_FORMATS)
+    
+    for name, audio in clips:
+        seconds = len(audio) / main.sample_rate
+        print(f"\n=== {name} ({seconds:.1f}초) ===")
+        print(f"{'형식':<6} {'바이트':>9} {'WAV 대비':>8} {'압축(ms)':>9} {'STT 중앙값(ms)':>15}")
+        wav_size = None
+        for upload_format in formats:
+            result = await measure(audio, upload_format, args.live, args.repeat)
+            if result is None:
+                print(f"{upload_format:<6} {'압축 실패 (ffmpeg 확인)':>30}")
+                continue
+            size, encode_time, stt_times = result
+            wav_size = wav_size or size
+            stt = f"{statistics.median(stt_times) * 1000:.0f}" if stt_times else "-"
+            print(f"{upload_format:<6} {size:>9} {size / wav_size:>8.1%} {encode_time * 1000:>9.1f} {stt:>15}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="STT 업로드 형식별 크기/지연 시간 비교")
+    parser.add_argument("files", nargs="*", help="16kHz 모노 WAV 파일")
+    parser.add_argument("--live", action="store_true", help="실제 whisper-1로 업로드해서 지연 시간 측정")
+    parser.add_argument("--repeat", type=int, default=3, help="형식마다 반복 횟수")
+    asyncio.run(run(parser.parse_args()))
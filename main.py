@@ -1,51 +1,387 @@
+from __future__ import annotations
+import time
+STARTUP_STARTED = time.perf_counter()  # 시작 단계 시간 측정 기준
 import asyncio
 from dotenv import load_dotenv
-import numpy as np
-import sounddevice as sd
-from openai import OpenAI
 import wave
 import io
-from pathlib import Path
-import subprocess
+import re
+import sys
 import threading
+import heapq
+import random
 import queue
-from pynput import keyboard
+import sqlite3
+import itertools
+import collections
+import hashlib
+import secrets
+import json
+import contextvars
+from pathlib import Path
+from urllib.parse import urlparse
 import os
+import importlib.util
 from datetime import datetime, date
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters, ContextTypes
+from typing import TYPE_CHECKING
+
+# 무거운 모듈은 필요한 단계에서 불러옴 (불러오는 데만 수백 ms가 걸려서 인형이 늦게 깨어남)
+# numpy/sounddevice: prepare_audio(), pynput: start_keyboard_listener(),
+# openai: OpenAIClient.create(), telegram/httpx: start_telegram_bot()과 클라이언트를 만들 때
+np = None
+sd = None
+if TYPE_CHECKING:
+    from telegram import Update
+    from telegram.ext import ContextTypes
 
 # .env 파일 로드
 load_dotenv()
 
-# OpenAI 클라이언트 초기화
-client = OpenAI()
+# HTTP 연결 설정 (OpenAI와 텔레그램이 같은 설정으로 연결을 재사용)
+HTTP_MAX_CONNECTIONS = int(os.getenv('TODAK_HTTP_MAX_CONNECTIONS', '16'))  # 클라이언트별 최대 연결 수
+HTTP_MAX_KEEPALIVE = int(os.getenv('TODAK_HTTP_MAX_KEEPALIVE', '8'))  # 쉬는 동안에도 열어 둘 연결 수
+HTTP_KEEPALIVE_SECONDS = float(os.getenv('TODAK_HTTP_KEEPALIVE_SECONDS', '120'))  # 쉬는 연결을 닫기까지 (httpx 기본 5초)
+HTTP_CONNECT_TIMEOUT = float(os.getenv('TODAK_HTTP_CONNECT_TIMEOUT', '10'))
+HTTP_POOL_TIMEOUT = float(os.getenv('TODAK_HTTP_POOL_TIMEOUT', '10'))  # 빈 연결을 기다리는 시간
+# HTTP/2는 h2 패키지가 있을 때만 사용 (pip install "httpx[http2]")
+HTTP2_ENABLED = os.getenv('TODAK_HTTP2', '1') == '1' and importlib.util.find_spec('h2') is not None
+HTTP_PREWARM_CONNECTIONS = 1 if HTTP2_ENABLED else 2  # 시작할 때 미리 열어 둘 연결 수 (HTTP/2는 연결 하나로 충분)
+
+
+def http_limits(max_connections=HTTP_MAX_CONNECTIONS):
+    """OpenAI와 텔레그램 클라이언트가 함께 쓰는 연결 풀 크기와 keep-alive 설정"""
+    import httpx
+    return httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=min(HTTP_MAX_KEEPALIVE, max_connections),
+        keepalive_expiry=HTTP_KEEPALIVE_SECONDS,
+    )
+
+
+def http_timeout(read_timeout):
+    import httpx
+    return httpx.Timeout(read_timeout, connect=HTTP_CONNECT_TIMEOUT, pool=HTTP_POOL_TIMEOUT)
+
+
+# OpenAI 클라이언트 설정
+OPENAI_TIMEOUT = float(os.getenv('OPENAI_TIMEOUT', '30'))  # 요청 타임아웃 (초)
+OPENAI_REPORT_TIMEOUT = float(os.getenv('OPENAI_REPORT_TIMEOUT', '90'))  # 리포트 생성 타임아웃 (초)
+OPENAI_MAX_RETRIES = int(os.getenv('OPENAI_MAX_RETRIES', '2'))  # 실패한 요청을 다시 보낼 횟수 (call_with_retry)
+OPENAI_MAX_CONCURRENCY = int(os.getenv('OPENAI_MAX_CONCURRENCY', '4'))  # 동시에 보낼 수 있는 요청 수
+
+class OpenAIClient:
+    """처음 쓸 때 만드는 AsyncOpenAI 클라이언트 (openai는 불러오는 데 오래 걸려서 시작할 때 백그라운드 스레드에서 미리 만듦)"""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.instance = None
+    
+    def create(self):
+        with self.lock:
+            if self.instance is None:
+                from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+                # 재시도는 SDK 대신 call_with_retry가 담당 (회로 차단기와 마감 시간 적용)
+                self.instance = AsyncOpenAI(
+                    timeout=http_timeout(OPENAI_TIMEOUT),
+                    max_retries=0,
+                    http_client=DefaultAsyncHttpxClient(http2=HTTP2_ENABLED, limits=http_limits(), timeout=http_timeout(OPENAI_TIMEOUT)),
+                )
+        return self.instance
+    
+    async def prepare(self):
+        """이벤트 루프를 막지 않고 클라이언트 준비 (이미 있으면 바로 반환)"""
+        if self.instance is None:
+            await asyncio.to_thread(self.create)
+    
+    def __getattr__(self, name):
+        # prepare()가 끝나기 전에 쓰면 여기서 만들어질 때까지 기다림
+        return getattr(self.instance or self.create(), name)
+    
+    async def close(self):
+        if self.instance is not None:
+            await self.instance.close()
+
+
+# OpenAI 비동기 클라이언트 (이벤트 루프를 막지 않음)
+client = OpenAIClient()
+openai_semaphore = asyncio.Semaphore(OPENAI_MAX_CONCURRENCY)  # OpenAI 동시 요청 제한
+
+# 재시도/회로 차단 설정
+RETRY_BASE_DELAY = float(os.getenv('TODAK_RETRY_BASE_DELAY', '0.5'))  # 첫 재시도 전 최대 대기 (초, 매번 두 배)
+RETRY_MAX_DELAY = float(os.getenv('TODAK_RETRY_MAX_DELAY', '8'))
+TURN_RETRY_DEADLINE = float(os.getenv('TODAK_TURN_RETRY_DEADLINE', '15'))  # 아이가 기다리는 요청은 이 시간 안에서만 재시도
+BREAKER_FAILURES = int(os.getenv('TODAK_BREAKER_FAILURES', '4'))  # 연속으로 이만큼 실패하면 잠시 요청을 보내지 않음
+BREAKER_COOLDOWN = float(os.getenv('TODAK_BREAKER_COOLDOWN', '30'))  # 요청을 멈추는 시간 (초)
+
+# 스트리밍 응답 설정 (GPT 토큰 스트림 -> 문장 단위 TTS -> 바로 재생)
+STREAMING_RESPONSE = os.getenv('TODAK_STREAMING', '1') == '1'
+TTS_PREFETCH_SENTENCES = int(os.getenv('TODAK_TTS_PREFETCH', '2'))  # 재생 중 미리 합성해 둘 문장 수
+
+# 대화 기록 관리 설정 (시스템 프롬프트 고정 + 최근 대화 + 오래된 대화 요약)
+HISTORY_MAX_TURNS = int(os.getenv('TODAK_HISTORY_MAX_TURNS', '6'))  # 그대로 보낼 최근 대화 턴 수
+HISTORY_TOKEN_BUDGET = int(os.getenv('TODAK_HISTORY_TOKEN_BUDGET', '1200'))  # 최근 대화에 쓸 토큰 예산
+SUMMARY_MAX_TOKENS = int(os.getenv('TODAK_SUMMARY_MAX_TOKENS', '300'))  # 요약 최대 길이 (토큰)
+
+# 다음 턴 미리 준비 설정 (응답을 들려주는 동안/턴 사이의 빈 시간 활용)
+PREFETCH_ENABLED = os.getenv('TODAK_PREFETCH', '1') == '1'
+# 연결이 이만큼 쉬었으면 녹음을 시작할 때 미리 다시 열어 둠 (keep-alive가 끝났거나 서버가 닫았을 수 있음)
+CONNECTION_IDLE_SECONDS = min(HTTP_KEEPALIVE_SECONDS, 30.0)
+last_openai_activity = 0.0  # 마지막으로 OpenAI 연결을 쓴 시각 (time.monotonic)
+connection_warm_task = None
+
+# 음성 재생 설정 (OpenAI TTS의 pcm 출력: 24kHz, 16bit, 모노)
+TTS_SAMPLE_RATE = 24000
+PLAYBACK_BLOCKSIZE = 1024
+TTS_MODEL = "tts-1"
+TTS_VOICE = "nova"  # 더 따뜻하고 친근한 목소리로 변경
+TTS_INSTRUCTIONS = "Speak in a warm, gentle, and child-friendly tone. Use a caring and encouraging voice that makes children feel safe and understood."
+
+# TTS 캐시 설정 (메모리 LRU + 디스크)
+TTS_CACHE_DIR = Path(os.getenv('TODAK_TTS_CACHE_DIR', str(Path(__file__).parent / ".tts_cache")))
+TTS_CACHE_MEMORY_BYTES = int(float(os.getenv('TODAK_TTS_CACHE_MEMORY_MB', '16')) * 1024 * 1024)
+TTS_CACHE_DISK_BYTES = int(float(os.getenv('TODAK_TTS_CACHE_DISK_MB', '200')) * 1024 * 1024)
+
+# 토닥이 자주 하는 고정 문장 (시작할 때 미리 합성해서 캐시에 넣어 둠)
+FAREWELL_MESSAGE = "오늘은 여기까지야. 내일 다시 만나자!"
+REMINDER_PREAMBLE = "아, 맞다! 엄마가 말씀하신 게 있어."
+REMINDER_CLOSING = "잊지 말고 해야 해!"
+PARENT_MESSAGE_PREFIX = "엄마가 말했어."
+PARENT_FORWARD_REPLY = "엄마한테 말씀드렸어! 엄마가 곧 답장해줄 거야."  # 부모님에게 메시지를 전달했을 때
+REMINDER_ACK_REPLY = "좋아, 약속한 거야! 토닥이 응원할게."  # 리마인더에 "알았어"라고 대답했을 때
+SAFETY_ACK_MESSAGE = "말해줘서 정말 고마워. 토닥이 네 이야기 잘 들을게."  # 위험 신호가 있는 말에 응답보다 먼저
+RETRY_LATER_MESSAGE = "미안, 토닥이 잘 못 들었어. 한 번만 다시 말해줄래?"  # 인식이나 응답이 실패했을 때 (네트워크 없이 캐시에서 재생)
+FIXED_PHRASES = [FAREWELL_MESSAGE, REMINDER_PREAMBLE, REMINDER_CLOSING, PARENT_MESSAGE_PREFIX, PARENT_FORWARD_REPLY,
+                 REMINDER_ACK_REPLY, SAFETY_ACK_MESSAGE, RETRY_LATER_MESSAGE]
 
 # 전역 변수
 is_recording = False
-audio_queue = queue.Queue()
-recording_data = []
 sample_rate = 16000
+main_loop = None  # 키보드/오디오 스레드에서 이벤트를 알리기 위한 이벤트 루프
+keyboard_listener_active = False  # =키 토글 녹음 가능 여부
+auto_stopped_at = None  # 녹음이 저절로 멈춘 시각 (time.monotonic, 아이가 뒤이어 누른 =키는 끝내는 키로 봄)
+
+# 녹음 관련 변수
+CAPTURE_BLOCKSIZE = 1024
+MAX_RECORDING_SECONDS = int(os.getenv('TODAK_MAX_RECORDING_SECONDS', '120'))  # 녹음 버퍼 길이 (초)
+recording_started = asyncio.Event()  # =키로 녹음 시작
+recording_stopped = asyncio.Event()  # =키 또는 음성 구간 검출로 녹음 끝
+
+# 음성 구간 검출(VAD) 설정
+VAD_ENABLED = os.getenv('TODAK_VAD', '1') == '1'
+VAD_SILENCE_SECONDS = float(os.getenv('TODAK_VAD_SILENCE_SECONDS', '1.2'))  # 말이 끝난 뒤 이만큼 조용하면 자동 종료
+VAD_THRESHOLD_DB = float(os.getenv('TODAK_VAD_THRESHOLD_DB', '12'))  # 배경 소음보다 이만큼 크면 말소리로 판단
+VAD_MAX_SECONDS = float(os.getenv('TODAK_VAD_MAX_SECONDS', '15'))  # 키보드 없이 녹음할 때 최대 길이
+VAD_KEY_GRACE_SECONDS = float(os.getenv('TODAK_VAD_KEY_GRACE_SECONDS', '5'))  # 저절로 멈춘 뒤 이 시간 안에 누른 =키는 무시
+
+# STT 업로드 압축 설정 (wav, ogg, webm, mp3, flac)
+STT_UPLOAD_FORMAT = os.getenv('STT_UPLOAD_FORMAT', 'ogg').lower()
+STT_UPLOAD_BITRATE = os.getenv('STT_UPLOAD_BITRATE', '24k')  # 손실 압축 코덱의 비트레이트
+UPLOAD_FORMATS = {
+    # 형식: (ffmpeg 출력 형식, 코덱, MIME 타입, 비트레이트 사용 여부)
+    "ogg": ("ogg", "libopus", "audio/ogg", True),
+    "webm": ("webm", "libopus", "audio/webm", True),
+    "mp3": ("mp3", "libmp3lame", "audio/mpeg", True),
+    "flac": ("flac", "flac", "audio/flac", False),
+}
+
+# 말하는 도중 미리 인식하기 (VAD가 찾은 쉬는 구간마다 앞부분을 잘라서 백그라운드 STT)
+STREAMING_STT = os.getenv('TODAK_STREAMING_STT', '1') == '1'
+STT_CHUNK_PAUSE_SECONDS = float(os.getenv('TODAK_STT_CHUNK_PAUSE_SECONDS', '0.4'))  # 이만큼 쉬면 조각을 자름
+STT_MIN_CHUNK_SECONDS = float(os.getenv('TODAK_STT_MIN_CHUNK_SECONDS', '2.0'))  # 이보다 짧은 조각은 다음 조각과 합침
 
 # 텔레그램 봇 관련 변수
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 PARENT_CHAT_ID = os.getenv('PARENT_CHAT_ID')  # 부모님의 텔레그램 채팅 ID
+TELEGRAM_BASE_URL = os.getenv('TELEGRAM_BASE_URL')  # 자체 Bot API 서버나 벤치마크용 가짜 서버 주소 (선택)
+# 웹훅 모드: 공개 주소를 설정하면 폴링 대신 텔레그램이 업데이트를 이 프로세스로 바로 보냄
+# (python-telegram-bot[webhooks] 필요, 역방향 프록시가 TELEGRAM_WEBHOOK_URL을 LISTEN:PORT로 넘겨줘야 함)
+TELEGRAM_WEBHOOK_URL = os.getenv('TELEGRAM_WEBHOOK_URL')  # 예: https://example.com/todak
+TELEGRAM_WEBHOOK_LISTEN = os.getenv('TELEGRAM_WEBHOOK_LISTEN', '127.0.0.1')
+TELEGRAM_WEBHOOK_PORT = int(os.getenv('TELEGRAM_WEBHOOK_PORT', '8443'))
+# 텔레그램이 보낸 요청인지 확인하는 비밀 값 (없으면 시작할 때마다 새로 만들어 등록)
+TELEGRAM_WEBHOOK_SECRET = os.getenv('TELEGRAM_WEBHOOK_SECRET') or secrets.token_urlsafe(32)
+TELEGRAM_MESSAGE_LIMIT = 4096  # 메시지 하나의 최대 길이 (넘으면 나눠서 보냄)
+TELEGRAM_COALESCE_SECONDS = float(os.getenv('TODAK_TELEGRAM_COALESCE_SECONDS', '1.0'))  # 이만큼 모인 보통 메시지는 하나로 묶어서 보냄
+TELEGRAM_CHAT_INTERVAL = 1.0  # 같은 채팅에는 1초에 한 번만 (텔레그램 제한)
+TELEGRAM_GLOBAL_INTERVAL = 1 / 30  # 봇 전체로는 1초에 30개까지
 telegram_app = None
-parent_message_queue = queue.Queue()  # 부모님으로부터 온 메시지 큐
 
-# 일일 사용시간 제한 관련 변수
-daily_time_limit = 30  # 기본값: 30분
-daily_usage_time = 0  # 오늘 사용한 시간 (분)
-last_reset_date = None  # 마지막 리셋 날짜
+# 인형/아이별 세션 설정
+DEVICE_ID = os.getenv('TODAK_DEVICE_ID', 'local')  # 이 프로세스의 마이크/스피커로 대화하는 인형
+# "인형ID:아이이름:부모님채팅ID"를 쉼표로 구분 (없으면 PARENT_CHAT_ID로 세션 하나)
+SESSIONS_CONFIG = os.getenv('TODAK_SESSIONS', '')
+DEFAULT_DAILY_TIME_LIMIT = 30  # 기본 일일 사용시간 (분)
+local_session = None  # 이 인형의 마이크/스피커를 쓰고 있는 세션
+
+# 성장 리포트 설정
+REPORT_MIN_CONVERSATIONS = 3  # 리포트를 만들 수 있는 최소 대화 수
+TURN_SUMMARY_MAX_TOKENS = int(os.getenv('TODAK_TURN_SUMMARY_MAX_TOKENS', '80'))  # 대화 한 번의 요약 길이
+
+# 상태 저장 설정 (사용시간, 대화 기록, 리마인더를 재시작해도 유지)
+STATE_DB = os.getenv('TODAK_STATE_DB', str(Path(__file__).parent / "todak_state.db"))  # 빈 값이면 저장하지 않음
+
+# 안전 신호 설정 (자해/학대 신호는 리포트를 기다리지 않고 바로 부모님께 알림)
+SAFETY_MODERATION = os.getenv('TODAK_SAFETY_MODERATION', '1') == '1'  # 단어 사전 외에 OpenAI 모더레이션으로도 확인
+MODERATION_MODEL = "omni-moderation-latest"
+SAFETY_ALERT_COOLDOWN = float(os.getenv('TODAK_SAFETY_ALERT_COOLDOWN', '300'))  # 같은 종류의 알림을 다시 보내기까지 (초)
+
+# 스피커 우선순위 (숫자가 작을수록 먼저 말함)
+SPEAK_SAFETY = 0  # 안전 안내: 재생 중인 말을 끊고 바로, =키로도 끊기지 않음
+SPEAK_PARENT = 1  # 부모님 메시지: 대화 턴 사이, 스피커가 비어 있으면 바로
+SPEAK_REMINDER = 2  # 리마인더: 아이가 말을 건 다음 응답하기 전에
+SPEAK_REPLY = 3  # 토닥의 대답
+
+# 턴 단계별 지연 시간 기록 설정
+TRACE_FILE = Path(os.getenv('TODAK_TRACE_FILE', str(Path(__file__).parent / "turn_traces.jsonl")))
+STARTUP_TRACE_FILE = Path(os.getenv('TODAK_STARTUP_TRACE_FILE', str(Path(__file__).parent / "startup_traces.jsonl")))  # 턴 기록과 섞이지 않게 따로 저장
+TRACE_WINDOW = int(os.getenv('TODAK_TRACE_WINDOW', '50'))  # p50/p95 계산에 쓸 최근 턴 수
+# 단계 이름: (시작 표시, 끝 표시)
+TRACE_STAGES = {
+    "capture": ("capture_start", "capture_stop"),
+    "encode": ("encode_start", "encode_end"),
+    "stt": ("stt_start", "stt_end"),
+    "llm_first_token": ("llm_start", "llm_first_token"),
+    "llm": ("llm_start", "llm_end"),
+    "tts_first_byte": ("tts_start", "tts_first_byte"),
+    "tts": ("tts_start", "tts_end"),
+    "playback": ("playback_start", "playback_end"),
+    "response": ("capture_stop", "playback_start"),  # 아이가 말을 끝낸 뒤 첫 소리가 나올 때까지
+}
+# 시작 단계 이름: (시작 표시, 끝 표시), main.py를 불러오기 시작한 시각 기준
+STARTUP_STAGES = {
+    "module": ("module_start", "main_start"),  # 설정 읽기
+    "state": ("state_start", "state_ready"),  # 상태 저장소 열기, 세션/메시지함 복원
+    "audio": ("audio_start", "audio_ready"),  # numpy/sounddevice 불러오기, 장치 확인
+    "keyboard": ("keyboard_start", "keyboard_ready"),  # pynput 불러오기, 리스너 시작
+    "capture_ready": ("module_start", "capture_ready"),  # 아이가 =키로 말을 걸 수 있을 때까지
+    "openai": ("openai_start", "openai_ready"),  # openai 불러오기, 클라이언트 생성
+    "connection": ("connection_start", "connection_ready"),  # OpenAI 연결 예열
+    "tts_cache": ("tts_cache_start", "tts_cache_ready"),  # 고정 문장 TTS 캐시
+    "telegram": ("telegram_start", "telegram_ready"),  # 부모님 연결 (telegram 불러오기, 봇 시작)
+    "total": ("module_start", "startup_done"),
+}
+
+
+class TurnTrace:
+    """대화 한 턴의 단계별 시각 기록 (턴 시작 기준 ms)"""
+    
+    stages = TRACE_STAGES
+    
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.timestamp = datetime.now().isoformat(timespec="seconds")
+        self.marks = {}
+    
+    def mark(self, name, last=False):
+        """시각 표시 (기본은 처음 한 번만, last=True면 마지막 값으로 갱신)"""
+        if last or name not in self.marks:
+            self.marks[name] = (time.perf_counter() - self.started) * 1000
+    
+    def durations(self):
+        """단계별 소요 시간 (ms)"""
+        result = {}
+        for stage, (start, end) in self.stages.items():
+            if start in self.marks and end in self.marks:
+                result[stage] = round(self.marks[end] - self.marks[start], 1)
+        return result
+    
+    def to_record(self):
+        return {
+            "timestamp": self.timestamp,
+            "marks": {name: round(value, 1) for name, value in self.marks.items()},
+            "durations": self.durations(),
+        }
+
+
+class StartupTrace(TurnTrace):
+    """프로그램 시작 단계별 시각 기록 (main.py를 불러오기 시작한 때 기준 ms)"""
+    
+    stages = STARTUP_STAGES
+    
+    def __init__(self):
+        super().__init__()
+        self.started = STARTUP_STARTED
+        self.marks["module_start"] = 0.0
+    
+    def format(self):
+        return ", ".join(f"{stage} {value:.0f}ms" for stage, value in self.durations().items())
+
+
+class TraceStats:
+    """최근 턴들의 단계별 p50/p95 집계"""
+    
+    def __init__(self, window=TRACE_WINDOW):
+        self.samples = collections.defaultdict(lambda: collections.deque(maxlen=window))
+    
+    def add(self, durations):
+        for stage, value in durations.items():
+            self.samples[stage].append(value)
+    
+    @staticmethod
+    def percentile(values, fraction):
+        ordered = sorted(values)
+        index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+        return ordered[index]
+    
+    def summary(self):
+        """단계별 (p50, p95, 표본 수)"""
+        return {
+            stage: (self.percentile(values, 0.5), self.percentile(values, 0.95), len(values))
+            for stage in TRACE_STAGES
+            if (values := self.samples.get(stage))
+        }
+    
+    def format(self):
+        lines = [f"{'단계':<16}{'p50(ms)':>9}{'p95(ms)':>9}{'턴':>5}"]
+        for stage, (p50, p95, count) in self.summary().items():
+            lines.append(f"{stage:<16}{p50:>9.0f}{p95:>9.0f}{count:>5}")
+        return "\n".join(lines)
+
+
+current_trace = contextvars.ContextVar("current_trace", default=None)  # 진행 중인 턴의 기록
+trace_stats = TraceStats()
+startup_trace = StartupTrace()
+
+
+def trace_mark(name, last=False):
+    """진행 중인 턴이 있으면 단계 시각 표시"""
+    trace = current_trace.get()
+    if trace is not None:
+        trace.mark(name, last)
+
+
+def start_turn_trace():
+    """새 턴 기록 시작 (이후 만든 태스크에도 이어짐)"""
+    trace = TurnTrace()
+    current_trace.set(trace)
+    return trace
 
-# 성장 리포트 관련 변수
-conversation_count = 0  # 오늘 대화 횟수
-daily_conversations = []  # 오늘의 대화 기록
-report_generated = False  # 오늘 리포트 생성 여부
 
-# 리마인더 관련 변수
-reminder_queue = queue.Queue()  # 부모님으로부터 온 리마인더 큐
-current_reminder = None  # 현재 전달할 리마인더
+async def timed_phase(trace, name, awaitable):
+    """시작 단계 하나를 실행하면서 시작/끝 시각 표시 (실패해도 끝 시각은 남김)"""
+    trace.mark(f"{name}_start")
+    try:
+        return await awaitable
+    finally:
+        trace.mark(f"{name}_ready")
+
+
+def append_trace_record(record, path=TRACE_FILE):
+    try:
+        with open(path, "a", encoding="utf-8") as trace_file:
+            trace_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+    except OSError as e:
+        print(f"턴 기록 저장 실패: {e}")
+
+
+async def finish_turn_trace(trace):
+    """턴 기록을 JSONL로 저장하고 최근 p50/p95 출력"""
+    current_trace.set(None)
+    record = trace.to_record()
+    trace_stats.add(record["durations"])
+    await asyncio.to_thread(append_trace_record, record)
+    print("⏱️ 단계별 지연 시간 (최근 턴 기준)")
+    print(trace_stats.format())
 
 
 def save_audio_to_wav(audio_data, sample_rate=16000):
@@ -59,31 +395,587 @@ def save_audio_to_wav(audio_data, sample_rate=16000):
     return buffer.getvalue()
 
 
-def reset_daily_usage():
-    """일일 사용시간 리셋"""
-    global daily_usage_time, last_reset_date, conversation_count, daily_conversations, report_generated
-    today = date.today()
-    if last_reset_date != today:
-        daily_usage_time = 0
-        last_reset_date = today
-        conversation_count = 0
-        daily_conversations = []
-        report_generated = False
-        print(f"일일 사용시간이 리셋되었습니다. ({today})")
+async def encode_audio_for_upload(audio_data, sample_rate=16000, upload_format=None):
+    """STT 업로드용으로 음성을 압축해서 (파일 이름, 바이트, MIME 타입)으로 반환 (실패하면 WAV)"""
+    upload_format = upload_format or STT_UPLOAD_FORMAT
+    trace_mark("encode_start")
+    try:
+        return await _encode_audio(audio_data, sample_rate, upload_format)
+    finally:
+        trace_mark("encode_end", last=True)
+
+
+async def _encode_audio(audio_data, sample_rate, upload_format):
+    if upload_format in UPLOAD_FORMATS:
+        # 임시 파일 없이 ffmpeg 표준입력/출력 파이프로 메모리 안에서만 변환
+        output_format, codec, mime, use_bitrate = UPLOAD_FORMATS[upload_format]
+        command = [
+            "ffmpeg", "-hide_banner", "-loglevel", "error",
+            "-f", "s16le", "-ar", str(sample_rate), "-ac", "1", "-i", "pipe:0",
+            "-c:a", codec
+        ]
+        if use_bitrate:
+            command += ["-b:a", STT_UPLOAD_BITRATE]
+        if codec == "libopus":
+            command += ["-application", "voip"]
+        command += ["-f", output_format, "pipe:1"]
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *command,
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
+            )
+            encoded, error = await process.communicate(audio_data.tobytes())
+            if process.returncode == 0 and encoded:
+                return f"audio.{upload_format}", encoded, mime
+            print(f"음성 압축 실패 ({upload_format}), WAV로 보냅니다: {error.decode(errors='ignore').strip()}")
+        except Exception as e:
+            print(f"음성 압축 실패 ({upload_format}), WAV로 보냅니다: {e}")
+    elif upload_format != "wav":
+        print(f"지원하지 않는 업로드 형식입니다: {upload_format} (WAV로 보냅니다)")
+    
+    return "audio.wav", save_audio_to_wav(audio_data, sample_rate), "audio/wav"
+
+
+def format_duration(seconds):
+    """초를 'N분 M초'로 표시"""
+    minutes, seconds = divmod(max(0, int(round(seconds))), 60)
+    if minutes and seconds:
+        return f"{minutes}분 {seconds}초"
+    return f"{minutes}분" if minutes else f"{seconds}초"
+
+
+class CircuitOpen(Exception):
+    """회로 차단기가 열려 있어서 요청을 보내지 않음"""
+
+
+class CircuitBreaker:
+    """연속으로 실패한 엔드포인트에는 잠시 요청을 보내지 않음 (쉬는 시간이 끝나면 한 번 시험해 봄)"""
+    
+    def __init__(self, name, failures=BREAKER_FAILURES, cooldown=BREAKER_COOLDOWN):
+        self.name = name
+        self.max_failures = failures
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None  # 열린 시각 (닫혀 있으면 None)
+        self.probing = False  # 쉬는 시간이 끝난 뒤 보낸 시험 요청이 아직 끝나지 않음 (반쯤 열림)
+    
+    def retry_in(self):
+        """요청을 다시 보낼 수 있을 때까지 남은 시간 (초)"""
+        if self.opened_at is None:
+            return 0.0
+        remaining = max(0.0, self.opened_at + self.cooldown - time.monotonic())
+        if self.probing:
+            # 시험 요청의 결과가 나올 때까지는 1초씩 기다렸다가 다시 확인
+            return max(remaining, 1.0)
+        return remaining
+    
+    def allow(self):
+        """요청을 보내도 되는지 (쉬는 시간이 끝나면 시험 요청 하나만 보내고, 결과가 나올 때까지 나머지는 막음)"""
+        if self.opened_at is None:
+            return True
+        if self.probing or self.retry_in() > 0:
+            return False
+        self.probing = True
+        return True
+    
+    def release_probe(self):
+        """시험 요청이 엔드포인트 상태를 알려주지 못하고 끝남 (취소, 잘못된 요청, 속도 제한): 다음 요청이 다시 시험"""
+        self.probing = False
+    
+    def record_success(self):
+        if self.opened_at is not None:
+            print(f"{self.name} 연결이 회복되었습니다.")
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+    
+    def record_failure(self):
+        self.probing = False  # 시험 요청이 실패하면 바로 다시 열림
+        self.failures += 1
+        if self.failures >= self.max_failures:
+            if self.opened_at is None:
+                print(f"{self.name} 요청이 계속 실패해서 {self.cooldown:.0f}초 동안 보내지 않습니다.")
+            self.opened_at = time.monotonic()
+
+
+circuit_breakers = {name: CircuitBreaker(name) for name in ("stt", "chat", "tts", "moderation", "telegram")}
+
+
+def is_retryable(error):
+    """다시 보내면 성공할 수 있는 오류인지 (연결 끊김, 타임아웃, 속도 제한, 서버 오류)"""
+    # 라이브러리는 필요할 때 불러오므로 이미 불러온 쪽의 오류만 확인 (오류를 낸 라이브러리는 항상 불러와져 있음)
+    if "openai" in sys.modules:
+        from openai import APIConnectionError, APIStatusError
+        if isinstance(error, APIStatusError):
+            return error.status_code in (408, 409, 429) or error.status_code >= 500
+        if isinstance(error, APIConnectionError):
+            return True
+    if "telegram" in sys.modules:
+        from telegram.error import NetworkError, BadRequest, RetryAfter
+        if isinstance(error, BadRequest):
+            return False  # 텔레그램의 잘못된 요청은 NetworkError의 하위 클래스
+        if isinstance(error, (NetworkError, RetryAfter)):
+            return True
+    if "httpx" in sys.modules:
+        import httpx
+        if isinstance(error, httpx.TransportError):
+            return True
+    return isinstance(error, (ConnectionError, asyncio.TimeoutError))
+
+
+def retry_delay(attempt, error=None):
+    """지수 백오프에 전체 지터 적용 (서버가 기다리라고 한 시간이 있으면 그만큼)"""
+    retry_after = getattr(error, "retry_after", None)
+    if retry_after is not None:
+        return retry_after.total_seconds() if hasattr(retry_after, "total_seconds") else float(retry_after)
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+
+
+async def call_with_retry(endpoint, make_call, attempts=OPENAI_MAX_RETRIES + 1, deadline=None, should_retry=is_retryable):
+    """make_call()을 재시도하며 실행 (엔드포인트별 회로 차단기, deadline초 안에 끝나지 않을 재시도는 하지 않음)"""
+    breaker = circuit_breakers[endpoint]
+    give_up_at = time.monotonic() + deadline if deadline is not None else None
+    for attempt in range(attempts):
+        probe = breaker.opened_at is not None  # 열려 있는데 통과했으면 이번 요청이 시험 요청
+        if not breaker.allow():
+            raise CircuitOpen(f"{endpoint} 요청 일시 중단 ({breaker.retry_in():.0f}초 남음)")
+        try:
+            result = await make_call()
+        except asyncio.CancelledError:
+            if probe:
+                breaker.release_probe()
+            raise
+        except Exception as e:
+            if not should_retry(e):
+                if probe:
+                    breaker.release_probe()
+                raise
+            if getattr(e, "retry_after", None) is None:
+                breaker.record_failure()
+            elif probe:
+                breaker.release_probe()  # 속도 제한(RetryAfter)은 서버가 멀쩡하다는 뜻
+            delay = retry_delay(attempt, e)
+            if attempt == attempts - 1 or breaker.retry_in() > 0 or (give_up_at is not None and time.monotonic() + delay > give_up_at):
+                raise
+            print(f"{endpoint} 요청 실패, {delay:.1f}초 후 다시 시도합니다 ({attempt + 1}/{attempts - 1}): {e}")
+            await asyncio.sleep(delay)
+        else:
+            breaker.record_success()
+            return result
+
+
+class StateStore:
+    """SQLite(WAL) 상태 저장소: 시작할 때 한 번 읽고, 쓰기는 백그라운드 스레드가 모아서 한 번에 커밋"""
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS sessions (
+            device_id TEXT NOT NULL,
+            child_id TEXT NOT NULL,
+            daily_time_limit INTEGER NOT NULL,
+            daily_usage_time INTEGER NOT NULL,
+            last_reset_date TEXT,
+            report_generated INTEGER NOT NULL DEFAULT 0,
+            reminder TEXT,
+            report_count INTEGER,
+            report_text TEXT,
+            daily_usage_seconds REAL,
+            PRIMARY KEY (device_id, child_id)
+        );
+        CREATE TABLE IF NOT EXISTS conversations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            device_id TEXT NOT NULL,
+            child_id TEXT NOT NULL,
+            day TEXT NOT NULL,
+            timestamp TEXT NOT NULL,
+            user_text TEXT NOT NULL,
+            ai_text TEXT NOT NULL,
+            seq INTEGER,
+            summary TEXT
+        );
+        CREATE INDEX IF NOT EXISTS conversations_by_day ON conversations (device_id, child_id, day);
+        CREATE TABLE IF NOT EXISTS outbox (
+            key TEXT PRIMARY KEY,
+            chat_id TEXT NOT NULL,
+            text TEXT NOT NULL,
+            note TEXT,
+            urgent INTEGER NOT NULL DEFAULT 0,
+            created TEXT NOT NULL
+        );
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        self.writes = queue.Queue()  # (SQL, 파라미터), None이면 종료
+        self.thread = None
+    
+    # 예전 파일에 없던 열 (테이블, 열, 타입)
+    MIGRATIONS = [
+        ("sessions", "report_count", "INTEGER"),
+        ("sessions", "report_text", "TEXT"),
+        ("sessions", "daily_usage_seconds", "REAL"),
+        ("conversations", "seq", "INTEGER"),
+        ("conversations", "summary", "TEXT"),
+        ("outbox", "urgent", "INTEGER NOT NULL DEFAULT 0"),
+    ]
+    
+    def open(self):
+        """스키마 준비 후 쓰기 스레드 시작"""
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as connection:
+            connection.executescript(self.SCHEMA)
+            for table, column, column_type in self.MIGRATIONS:
+                columns = {row[1] for row in connection.execute(f"PRAGMA table_info({table})")}
+                if column not in columns:
+                    connection.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+        self.thread = threading.Thread(target=self._write_loop, daemon=True)
+        self.thread.start()
+    
+    def _connect(self):
+        connection = sqlite3.connect(self.path)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")  # WAL에서는 프로그램이 죽어도 커밋한 내용은 남음
+        return connection
+    
+    def load(self, session):
+        """저장된 세션 상태와 그날의 대화 기록을 세션에 복원"""
+        connection = self._connect()
+        try:
+            row = connection.execute(
+                "SELECT daily_time_limit, daily_usage_time, last_reset_date, report_generated, reminder, "
+                "report_count, report_text, daily_usage_seconds FROM sessions WHERE device_id = ? AND child_id = ?",
+                session.key
+            ).fetchone()
+            if row is None:
+                return False
+            session.daily_time_limit = row[0]
+            # 예전 파일은 분 단위만 있음
+            session.daily_usage_seconds = row[7] if row[7] is not None else row[1] * 60
+            session.last_reset_date = date.fromisoformat(row[2]) if row[2] else None
+            session.report_generated = bool(row[3])
+            if row[4]:
+                session.scheduler.announce(row[4], SPEAK_REMINDER)
+            if row[6]:
+                session.report_cache = (row[5], row[6])
+            if session.last_reset_date:
+                session.daily_conversations = [
+                    {"timestamp": timestamp, "user": user_text, "ai": ai_text, "summary": summary}
+                    for timestamp, user_text, ai_text, summary in connection.execute(
+                        "SELECT timestamp, user_text, ai_text, summary FROM conversations "
+                        "WHERE device_id = ? AND child_id = ? AND day = ? ORDER BY id",
+                        (*session.key, session.last_reset_date.isoformat())
+                    )
+                ]
+                session.conversation_count = len(session.daily_conversations)
+            return True
+        finally:
+            connection.close()
+    
+    def save_session(self, session):
+        """세션의 사용시간/리포트 상태 저장 (리마인더는 그대로)"""
+        self.writes.put((
+            "INSERT INTO sessions (device_id, child_id, daily_time_limit, daily_usage_time, daily_usage_seconds, "
+            "last_reset_date, report_generated) VALUES (?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (device_id, child_id) DO UPDATE SET daily_time_limit = excluded.daily_time_limit, "
+            "daily_usage_time = excluded.daily_usage_time, daily_usage_seconds = excluded.daily_usage_seconds, "
+            "last_reset_date = excluded.last_reset_date, report_generated = excluded.report_generated",
+            (*session.key, session.daily_time_limit, int(session.daily_usage_seconds // 60), session.daily_usage_seconds,
+             session.last_reset_date.isoformat() if session.last_reset_date else None, int(session.report_generated))
+        ))
+    
+    def save_reminder(self, session, reminder_text):
+        self.save_session(session)  # 세션 행이 없을 수도 있으므로 먼저 저장
+        self.writes.put((
+            "UPDATE sessions SET reminder = ? WHERE device_id = ? AND child_id = ?",
+            (reminder_text, *session.key)
+        ))
+    
+    def add_conversation(self, session, conversation, seq):
+        self.writes.put((
+            "INSERT INTO conversations (device_id, child_id, day, timestamp, user_text, ai_text, seq) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (*session.key, self._day(session), conversation["timestamp"], conversation["user"], conversation["ai"], seq)
+        ))
+    
+    def save_summary(self, session, seq, summary):
+        self.writes.put((
+            "UPDATE conversations SET summary = ? WHERE device_id = ? AND child_id = ? AND day = ? AND seq = ?",
+            (summary, *session.key, self._day(session), seq)
+        ))
+    
+    def save_report(self, session):
+        count, text = session.report_cache or (None, None)
+        self.writes.put((
+            "UPDATE sessions SET report_count = ?, report_text = ? WHERE device_id = ? AND child_id = ?",
+            (count, text, *session.key)
+        ))
+    
+    def load_outbox(self):
+        """아직 보내지 못한 텔레그램 메시지 (급한 메시지 먼저, 그다음 넣은 순서대로)"""
+        connection = self._connect()
+        try:
+            return connection.execute(
+                "SELECT key, chat_id, text, note, urgent FROM outbox ORDER BY urgent DESC, created, rowid"
+            ).fetchall()
+        finally:
+            connection.close()
+    
+    def add_outbox(self, key, chat_id, text, note, urgent=False):
+        self.writes.put((
+            "INSERT OR REPLACE INTO outbox (key, chat_id, text, note, urgent, created) VALUES (?, ?, ?, ?, ?, ?)",
+            (key, chat_id, text, note, int(urgent), datetime.now().isoformat())
+        ))
+    
+    def remove_outbox(self, key):
+        self.writes.put(("DELETE FROM outbox WHERE key = ?", (key,)))
+    
+    @staticmethod
+    def _day(session):
+        return (session.last_reset_date or date.today()).isoformat()
+    
+    def _write_loop(self):
+        """쌓인 쓰기를 한 트랜잭션으로 모아서 커밋 (대화 루프는 디스크를 기다리지 않음)"""
+        connection = self._connect()
+        running = True
+        while running:
+            batch = [self.writes.get()]
+            while True:
+                try:
+                    batch.append(self.writes.get_nowait())
+                except queue.Empty:
+                    break
+            if None in batch:
+                running = False
+                batch = batch[:batch.index(None)]
+            try:
+                with connection:
+                    for sql, params in batch:
+                        connection.execute(sql, params)
+            except Exception as e:
+                print(f"상태 저장 실패: {e}")
+        connection.close()
+    
+    def close(self):
+        """남은 쓰기를 모두 커밋하고 종료"""
+        if self.thread is not None:
+            self.writes.put(None)
+            self.thread.join(timeout=5)
+            self.thread = None
 
 
-def add_usage_time(minutes):
-    """사용시간 추가"""
-    global daily_usage_time
-    daily_usage_time += minutes
-    print(f"사용시간 추가: {minutes}분 (총 사용: {daily_usage_time}분/{daily_time_limit}분)")
+class ChildSession:
+    """인형 하나와 아이 한 명의 상태 (사용시간, 대화 기록, 리마인더, 부모님 메시지, 대화 맥락)"""
+    
+    def __init__(self, device_id, child_id, parent_chat_id=None, store=None):
+        self.device_id = device_id
+        self.child_id = child_id
+        self.parent_chat_id = str(parent_chat_id) if parent_chat_id else None
+        self.store = store  # 없으면 메모리에만 보관
+        
+        # 일일 사용시간 제한
+        self.daily_time_limit = DEFAULT_DAILY_TIME_LIMIT
+        self.daily_usage_seconds = 0.0  # 오늘 실제로 녹음/재생한 시간 (초)
+        self.last_reset_date = None  # 마지막 리셋 날짜
+        
+        # 성장 리포트
+        self.conversation_count = 0  # 오늘 대화 횟수
+        self.daily_conversations = []  # 오늘의 대화 기록
+        self.report_generated = False  # 오늘 리포트 생성 여부
+        self.report_cache = None  # (리포트에 반영한 대화 수, 리포트)
+        self.report_task = None  # 만들고 있는 리포트 (같은 대화 수면 함께 기다림)
+        self.report_task_count = 0
+        self.summary_tasks = set()  # 대화별 요약을 만드는 백그라운드 작업
+        self.reminder_ack_turn = None  # 리마인더를 전한 다음 턴의 번호 (그 턴의 "알았어"는 리마인더에 대한 대답)
+        self.safety_alerted = {}  # 안전 신호 종류 -> 마지막으로 알린 시각 (time.monotonic)
+        self.safety_alerted_texts = set()  # 이미 알린 (종류, 띄어쓰기 없앤 말) (같은 말로는 다시 알리지 않음)
+        self.moderation_tasks = set()  # 백그라운드 모더레이션 확인
+        
+        self.scheduler = SpeechScheduler()  # 이 아이에게 전할 부모님 메시지와 리마인더
+        self.memory = ConversationMemory()
+        self.auto_report_task = None  # 자동 성장 리포트를 만들어 보내는 작업 (다음 턴을 막지 않음)
+        self.attached = False  # 이 프로세스의 마이크/스피커와 연결됨
+    
+    @property
+    def key(self):
+        return (self.device_id, self.child_id)
+    
+    def reset_daily_usage(self):
+        """일일 사용시간 리셋"""
+        today = date.today()
+        if self.last_reset_date != today:
+            self.daily_usage_seconds = 0.0
+            self.last_reset_date = today
+            self.conversation_count = 0
+            self.daily_conversations = []
+            self.report_generated = False
+            self.report_cache = None
+            self.reminder_ack_turn = None
+            self.save()
+            if self.store is not None:
+                self.store.save_report(self)
+            print(f"[{self.child_id}] 일일 사용시간이 리셋되었습니다. ({today})")
+    
+    def save(self):
+        if self.store is not None:
+            self.store.save_session(self)
+    
+    def add_usage_seconds(self, seconds):
+        """실제로 쓴 시간 추가 (초)"""
+        if seconds <= 0:
+            return
+        self.daily_usage_seconds += seconds
+        self.save()
+        print(f"[{self.child_id}] 사용시간 추가: {seconds:.1f}초 (총 사용: {format_duration(self.daily_usage_seconds)}/{self.daily_time_limit}분)")
+    
+    def remaining_seconds(self):
+        return self.daily_time_limit * 60 - self.daily_usage_seconds
+    
+    def check_time_limit(self):
+        """시간 제한 확인 (남은 시간은 초 단위)"""
+        self.reset_daily_usage()
+        remaining_time = self.remaining_seconds()
+        return remaining_time > 0, remaining_time
+    
+    def set_time_limit(self, minutes):
+        self.daily_time_limit = minutes
+        self.reset_daily_usage()
+        self.save()
+        print(f"부모님이 [{self.child_id}]의 일일 사용시간을 {minutes}분으로 변경했습니다.")
+    
+    def add_conversation(self, user_text, ai_response):
+        """대화 기록 추가"""
+        conversation = {
+            "timestamp": datetime.now().strftime("%H:%M"),
+            "user": user_text,
+            "ai": ai_response
+        }
+        
+        self.daily_conversations.append(conversation)
+        self.conversation_count += 1
+        if self.store is not None:
+            self.store.add_conversation(self, conversation, len(self.daily_conversations))
+        
+        # 리포트에 쓸 짧은 요약을 미리 만들어 둠
+        task = asyncio.create_task(summarize_conversation(self, conversation, len(self.daily_conversations)))
+        self.summary_tasks.add(task)
+        task.add_done_callback(self.summary_tasks.discard)
+        
+        print(f"[{self.child_id}] 대화 기록 추가됨 (총 {self.conversation_count}회)")
+    
+    def add_reminder(self, reminder_text):
+        """리마인더 추가 (기존 리마인더는 바뀜)"""
+        self.scheduler.remove(SPEAK_REMINDER)
+        self.scheduler.announce(reminder_text, SPEAK_REMINDER)
+        if self.store is not None:
+            self.store.save_reminder(self, reminder_text)
+        print(f"[{self.child_id}] 리마인더 추가됨: {reminder_text}")
+    
+    def get_reminder(self):
+        """현재 리마인더 가져오기"""
+        return self.scheduler.peek(SPEAK_REMINDER)
+    
+    def clear_reminder(self):
+        """리마인더 삭제"""
+        self.scheduler.remove(SPEAK_REMINDER)
+        if self.store is not None:
+            self.store.save_reminder(self, None)
+        print(f"[{self.child_id}] 리마인더가 삭제되었습니다.")
+    
+    async def deliver_reminder(self):
+        """아이가 말을 건 다음, 응답 전에 리마인더를 전하고 저장소에서도 지움"""
+        if await self.scheduler.speak_for_turn():
+            self.reminder_ack_turn = self.conversation_count + 1
+            if self.store is not None:
+                self.store.save_reminder(self, None)
+    
+    def mark_report_generated(self):
+        self.report_generated = True
+        self.save()
+    
+    def close(self):
+        self.memory.close()
+        for task in (self.report_task, self.auto_report_task):
+            if task is not None:
+                task.cancel()
+        for task in self.summary_tasks | self.moderation_tasks:
+            task.cancel()
 
 
-def check_time_limit():
-    """시간 제한 확인"""
-    reset_daily_usage()
-    remaining_time = daily_time_limit - daily_usage_time
-    return remaining_time > 0, remaining_time
+class SessionRegistry:
+    """프로세스 안의 모든 세션 (부모님 채팅 ID로 텔레그램 명령과 메시지를 해당 아이에게 연결)"""
+    
+    def __init__(self):
+        self.sessions = {}  # (인형 ID, 아이 ID) -> ChildSession
+        self.selected = {}  # 부모님 채팅 ID -> 명령을 보낼 세션 키 (/child로 선택)
+    
+    def add(self, session):
+        self.sessions[session.key] = session
+        return session
+    
+    def for_device(self, device_id):
+        """인형에 연결된 첫 번째 세션"""
+        for session in self.sessions.values():
+            if session.device_id == device_id:
+                return session
+        return None
+    
+    def for_chat(self, chat_id):
+        """부모님 채팅에 연결된 모든 세션"""
+        return [session for session in self.sessions.values() if session.parent_chat_id == str(chat_id)]
+    
+    def route(self, chat_id):
+        """부모님 채팅의 명령을 받을 세션 (아이가 여럿이면 /child로 고른 아이, 없으면 None)"""
+        sessions = self.for_chat(chat_id)
+        if not sessions:
+            return None
+        key = self.selected.get(str(chat_id))
+        for session in sessions:
+            if session.key == key:
+                return session
+        return sessions[0]
+    
+    def select(self, chat_id, child_id):
+        """부모님 채팅에서 명령을 보낼 아이 선택"""
+        for session in self.for_chat(chat_id):
+            if child_id in (session.child_id, f"{session.device_id}:{session.child_id}"):
+                self.selected[str(chat_id)] = session.key
+                return session
+        return None
+    
+    def label(self, session):
+        """부모님 채팅에 아이가 여럿일 때 메시지 앞에 붙일 아이 이름"""
+        if session.parent_chat_id and len(self.for_chat(session.parent_chat_id)) > 1:
+            return f"[{session.child_id}] "
+        return ""
+    
+    def close(self):
+        for session in self.sessions.values():
+            session.close()
+
+
+def load_sessions():
+    """TODAK_SESSIONS (없으면 PARENT_CHAT_ID)로 세션 목록 구성 후 저장된 상태 복원"""
+    started = time.perf_counter()
+    registry = SessionRegistry()
+    for entry in SESSIONS_CONFIG.split(","):
+        if not entry.strip():
+            continue
+        parts = [part.strip() for part in entry.split(":")]
+        if len(parts) < 2:
+            print(f"세션 설정을 이해할 수 없습니다 (무시됨): {entry}")
+            continue
+        device_id, child_id = parts[0], parts[1]
+        parent_chat_id = parts[2] if len(parts) > 2 and parts[2] else PARENT_CHAT_ID
+        registry.add(ChildSession(device_id, child_id, parent_chat_id, state_store))
+    if registry.for_device(DEVICE_ID) is None:
+        registry.add(ChildSession(DEVICE_ID, "child", PARENT_CHAT_ID, state_store))
+    
+    if state_store is not None:
+        restored = sum(state_store.load(session) for session in registry.sessions.values())
+        if restored:
+            print(f"저장된 상태 복원: 세션 {restored}개 ({(time.perf_counter() - started) * 1000:.1f}ms)")
+    return registry
 
 
 def check_audio_devices():
@@ -111,40 +1003,76 @@ def get_default_audio_device():
         return None
 
 
-def add_conversation(user_text, ai_response):
-    """대화 기록 추가"""
-    global conversation_count, daily_conversations
-    
-    conversation = {
-        "timestamp": datetime.now().strftime("%H:%M"),
-        "user": user_text,
-        "ai": ai_response
-    }
-    
-    daily_conversations.append(conversation)
-    conversation_count += 1
+async def summarize_conversation(session, conversation, seq):
+    """대화 한 번을 리포트용 한두 문장으로 요약 (add_conversation 직후 백그라운드에서)"""
+    async def request():
+        async with openai_semaphore:
+            return await client.chat.completions.create(
+                model="gpt-4o-mini",
+                messages=[
+                    {"role": "system", "content": "아이와 상담 인형의 대화 한 번을 부모님 리포트용으로 요약합니다. 아이의 관심사, 감정, 눈에 띄는 말 위주로 한국어 1~2문장으로 씁니다."},
+                    {"role": "user", "content": f"아이: {conversation['user']}\n토닥: {conversation['ai']}"}
+                ],
+                max_tokens=TURN_SUMMARY_MAX_TOKENS
+            )
     
-    print(f"대화 기록 추가됨 (총 {conversation_count}회)")
+    try:
+        response = await call_with_retry("chat", request)
+    except Exception as e:
+        print(f"대화 요약 실패 (리포트에는 원문 사용): {e}")
+        return
+    conversation["summary"] = response.choices[0].message.content.strip()
+    if session.store is not None:
+        session.store.save_summary(session, seq, conversation["summary"])
+
+
+def is_report_fresh(session):
+    """마지막 리포트 이후 새 대화가 없는지"""
+    return session.report_cache is not None and session.report_cache[0] == len(session.daily_conversations)
 
 
-async def generate_growth_report():
-    """성장 리포트 생성"""
-    if len(daily_conversations) < 3:
+async def generate_growth_report(session):
+    """성장 리포트 생성 (새 대화가 없으면 저장해 둔 리포트를 바로 반환)"""
+    if len(session.daily_conversations) < REPORT_MIN_CONVERSATIONS:
         return None
+    if is_report_fresh(session):
+        return session.report_cache[1]
     
+    # 같은 대화 수로 이미 만들고 있으면 그 결과를 함께 기다림
+    count = len(session.daily_conversations)
+    if session.report_task is None or session.report_task.done() or session.report_task_count != count:
+        session.report_task = asyncio.create_task(build_growth_report(session, count))
+        session.report_task_count = count
+    return await asyncio.shield(session.report_task)
+
+
+async def build_growth_report(session, count):
+    """이전 대화는 요약으로, 지난 리포트 이후의 새 대화만 원문으로 보내서 리포트 생성"""
     try:
-        # 대화 내용을 하나의 텍스트로 합치기
+        conversations = session.daily_conversations[:count]
+        covered = session.report_cache[0] if session.report_cache else 0
+        
+        # 지난 리포트에 반영된 대화는 미리 만든 요약으로 (요약이 아직 없으면 원문)
+        summaries_text = ""
+        for i, conv in enumerate(conversations[:covered], 1):
+            if conv.get("summary"):
+                summaries_text += f"대화 {i} ({conv['timestamp']}): {conv['summary']}\n"
+            else:
+                summaries_text += f"대화 {i} ({conv['timestamp']}): 아이: {conv['user']} / 토닥: {conv['ai']}\n"
+        
         conversations_text = ""
-        for i, conv in enumerate(daily_conversations, 1):
+        for i, conv in enumerate(conversations[covered:], covered + 1):
             conversations_text += f"대화 {i} ({conv['timestamp']}):\n"
             conversations_text += f"아이: {conv['user']}\n"
             conversations_text += f"토닥: {conv['ai']}\n\n"
         
+        earlier = f"앞선 대화 요약:\n{summaries_text}\n" if summaries_text else ""
+        
         # GPT를 이용한 리포트 생성
-        report_prompt = f"""다음은 만 4~8세 아이와 AI 심리상담가 토닥의 대화 기록입니다. 
+        report_prompt = f"""다음은 만 4~8세 아이와 AI 심리상담가 토닥의 오늘 대화입니다. 
 이 대화들을 분석하여 부모님을 위한 성장 리포트를 작성해주세요.
 
-대화 기록:
+{earlier}대화 기록:
 {conversations_text}
 
 다음 형식으로 리포트를 작성해주세요:
@@ -168,15 +1096,23 @@ async def generate_growth_report():
 
 리포트는 따뜻하고 격려하는 톤으로 작성해주세요."""
 
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "당신은 아동 심리 전문가입니다. 부모님을 위한 따뜻하고 전문적인 성장 리포트를 작성합니다."},
-                {"role": "user", "content": report_prompt}
-            ]
-        )
+        async def request():
+            async with openai_semaphore:
+                return await client.chat.completions.create(
+                    model="gpt-4o-mini",
+                    messages=[
+                        {"role": "system", "content": "당신은 아동 심리 전문가입니다. 부모님을 위한 따뜻하고 전문적인 성장 리포트를 작성합니다."},
+                        {"role": "user", "content": report_prompt}
+                    ],
+                    timeout=OPENAI_REPORT_TIMEOUT
+                )
+        
+        response = await call_with_retry("chat", request)
         
         report = response.choices[0].message.content
+        session.report_cache = (count, report)
+        if session.store is not None:
+            session.store.save_report(session)
         return report
         
     except Exception as e:
@@ -184,61 +1120,278 @@ async def generate_growth_report():
         return None
 
 
-async def send_report_to_parent(report):
-    """부모님에게 리포트 전송 (재시도 로직 포함)"""
-    if telegram_app and PARENT_CHAT_ID:
-        max_retries = 3
-        for attempt in range(max_retries):
-            try:
-                await telegram_app.bot.send_message(
-                    chat_id=PARENT_CHAT_ID,
-                    text=f"📊 **성장 리포트가 생성되었습니다!**\n\n{report}"
-                )
-                print("성장 리포트를 부모님에게 전송했습니다.")
-                return
-            except Exception as e:
-                print(f"리포트 전송 실패 (시도 {attempt + 1}/{max_retries}): {e}")
-                if attempt < max_retries - 1:
-                    await asyncio.sleep(2)  # 2초 대기 후 재시도
-                else:
-                    print("리포트 전송 최종 실패")
+async def send_report_to_parent(session, report):
+    """부모님에게 리포트 전송 (보낼 메시지함에 넣고 바로 돌아옴)"""
+    if TELEGRAM_BOT_TOKEN and session.parent_chat_id:
+        telegram_outbox.send(
+            session.parent_chat_id,
+            f"📊 {session_registry.label(session)}**성장 리포트가 생성되었습니다!**\n\n{report}",
+            "성장 리포트"
+        )
+
+
+async def send_automatic_report(session):
+    """3회 대화 후 자동 성장 리포트를 만들어 부모님께 보냄 (대화 턴과 따로 도는 백그라운드 작업)"""
+    try:
+        print("📊 3회 대화 완료! 성장 리포트를 생성합니다...")
+        report = await generate_growth_report(session)
+        if report:
+            await send_report_to_parent(session, report)
+            session.mark_report_generated()
+    except Exception as e:
+        print(f"리포트 생성/전송 중 오류: {e}")
+        # 오류가 발생해도 프로그램은 계속 실행 (다음 턴이 끝나면 다시 시도)
+
+
+def schedule_automatic_report(session):
+    """3회 대화 후 자동 리포트 작업 시작 (이미 만들고 있거나 오늘 보냈으면 그대로)"""
+    if session.conversation_count < 3 or session.report_generated:
+        return
+    if session.auto_report_task is None or session.auto_report_task.done():
+        session.auto_report_task = asyncio.create_task(send_automatic_report(session))
+
+
+class CaptureBuffer:
+    """미리 할당해 둔 int16 링 버퍼 (오디오 콜백이 블록을 바로 써넣음)"""
+    
+    def __init__(self, capacity, blocksize=CAPTURE_BLOCKSIZE):
+        self.capacity = capacity
+        self.buffer = np.zeros(capacity, dtype=np.int16)
+        self.scratch = np.zeros(blocksize, dtype=np.float32)  # 클리핑용 작업 공간
+        self.written = 0  # 지금까지 써넣은 전체 샘플 수
+    
+    def reset(self):
+        self.written = 0
+    
+    def write(self, block):
+        """float32 블록을 int16으로 변환해서 버퍼에 바로 기록 (오디오 스레드에서 호출)"""
+        count = len(block)
+        if len(self.scratch) < count:
+            self.scratch = np.zeros(count, dtype=np.float32)
+        scaled = self.scratch[:count]
+        np.clip(block, -1.0, 1.0, out=scaled)
+        np.multiply(scaled, 32767, out=scaled)
+        
+        start = self.written % self.capacity
+        first = min(count, self.capacity - start)
+        self.buffer[start:start + first] = scaled[:first]
+        if first < count:
+            # 버퍼 끝에 닿으면 앞에서부터 덮어씀
+            self.buffer[:count - first] = scaled[first:]
+        self.written += count
+    
+    def view(self):
+        """녹음된 샘플 반환 (버퍼가 넘치지 않았으면 복사 없는 뷰, 다음 녹음 전까지만 유효)"""
+        if self.written <= self.capacity:
+            return self.buffer[:self.written]
+        # 버퍼가 한 바퀴 돌았으면 가장 최근 capacity 샘플을 시간 순서로 정렬
+        start = self.written % self.capacity
+        return np.concatenate((self.buffer[start:], self.buffer[:start]))
+    
+    def slice(self, start, end):
+        """전체 샘플 번호 기준으로 [start, end) 구간 반환 (가능하면 복사 없는 뷰)"""
+        start = max(start, self.written - self.capacity, 0)
+        end = min(end, self.written)
+        if end <= start:
+            return self.buffer[:0]
+        first = start % self.capacity
+        last = first + (end - start)
+        if last <= self.capacity:
+            return self.buffer[first:last]
+        return np.concatenate((self.buffer[first:], self.buffer[:last - self.capacity]))
+
+
+class VoiceActivityDetector:
+    """1024샘플 블록의 에너지와 음성 대역 비율로 말소리 시작/끝을 찾는 검출기"""
+    
+    def __init__(self, samplerate=sample_rate, blocksize=CAPTURE_BLOCKSIZE,
+                 threshold_db=VAD_THRESHOLD_DB, silence_seconds=VAD_SILENCE_SECONDS):
+        self.samplerate = samplerate
+        self.blocksize = blocksize
+        self.threshold_db = threshold_db
+        self.silence_blocks = max(1, int(silence_seconds * samplerate / blocksize))
+        self.pause_blocks = max(1, int(STT_CHUNK_PAUSE_SECONDS * samplerate / blocksize))
+        self.start_blocks = 3  # 연속으로 이만큼 말소리가 나와야 시작으로 판단 (약 0.2초)
+        self.calibration_blocks = 5  # 녹음 첫 블록들 중 가장 조용한 블록으로 배경 소음 수준을 잡음 (약 0.3초)
+        # 아이 목소리의 기본음과 포먼트가 모이는 대역 (100~4000Hz)에 해당하는 FFT 구간
+        bin_width = samplerate / blocksize
+        self.band = (int(100 / bin_width), int(4000 / bin_width) + 1)
+        self.window = np.hanning(blocksize).astype(np.float32)
+        self.reset()
+    
+    def reset(self):
+        self.noise_floor_db = None  # 첫 블록들로 정하기 전에는 None
+        self.calibration = []  # 배경 소음을 잡는 동안 모은 블록 크기 (dB)
+        self.speech_run = 0  # 연속 말소리 블록 수
+        self.silence_run = 0  # 말이 시작된 뒤 연속 무음 블록 수
+        self.speech_start = None  # 말소리 시작 샘플 번호
+        self.speech_end = None  # 마지막 말소리 블록 끝 샘플 번호
+        self.pause_cut = None  # 말하는 도중 잠깐 쉰 지점 (조각 단위 인식용)
+    
+    @property
+    def speech_detected(self):
+        return self.speech_start is not None
+    
+    def is_speech(self, block):
+        """블록 하나가 말소리인지 판단"""
+        energy = float(np.dot(block, block)) / max(len(block), 1)
+        level_db = max(10 * np.log10(energy + 1e-12), -90.0)
+        if self.noise_floor_db is None:
+            # 시끄러운 방에서도 말이 끝난 걸 알 수 있도록 고정값 대신 이번 녹음의 배경 소음에서 시작
+            self.calibration.append(level_db)
+            if len(self.calibration) >= self.calibration_blocks:
+                self.noise_floor_db = min(self.calibration)
+            return False
+        if level_db < self.noise_floor_db + self.threshold_db:
+            # 조용한 블록으로 배경 소음 수준을 갱신 (더 조용해지면 빠르게 따라 내려감)
+            rate = 0.3 if level_db < self.noise_floor_db else 0.05
+            self.noise_floor_db += rate * (level_db - self.noise_floor_db)
+            return False
+        # 소음이 커지면 말소리로 보이는 블록으로도 아주 천천히 따라 올라감 (말하는 몇 초 동안은 거의 그대로)
+        self.noise_floor_db += 0.001 * (level_db - self.noise_floor_db)
+        if len(block) != len(self.window):
+            return True
+        spectrum = np.abs(np.fft.rfft(block * self.window)) ** 2
+        band_ratio = spectrum[self.band[0]:self.band[1]].sum() / (spectrum.sum() + 1e-12)
+        return band_ratio > 0.6
+    
+    def process(self, block, position):
+        """블록을 처리하고 말이 끝났으면 True 반환 (position: 블록의 시작 샘플 번호)"""
+        if self.is_speech(block):
+            self.speech_run += 1
+            self.silence_run = 0
+            if self.speech_start is None and self.speech_run >= self.start_blocks:
+                self.speech_start = position - (self.start_blocks - 1) * self.blocksize
+            if self.speech_start is not None:
+                self.speech_end = position + len(block)
+            return False
+        
+        self.speech_run = 0
+        if self.speech_start is None:
+            return False
+        self.silence_run += 1
+        if self.silence_run == self.pause_blocks:
+            # 쉬는 구간의 가운데를 조각 경계로 삼음
+            self.pause_cut = self.speech_end + (position + len(block) - self.speech_end) // 2
+        return self.silence_run >= self.silence_blocks
+    
+    def speech_bounds(self, padding_seconds=0.25):
+        """앞뒤 여유를 둔 말소리 구간 (시작, 끝) 샘플 번호"""
+        padding = int(padding_seconds * self.samplerate)
+        return max(self.speech_start - padding, 0), self.speech_end + padding
+
+
+class UsageMeter:
+    """실제 녹음 프레임과 재생 샘플 수로 사용시간을 재는 계량기 (오디오 콜백은 숫자만 더함)"""
+    
+    def __init__(self):
+        self.capture_frames = 0  # 녹음 콜백 스레드만 씀
+        self.playback_frames = 0  # 재생 콜백 스레드만 씀
+        self.collected = (0, 0)  # 지난번 collect() 때의 (녹음, 재생) 프레임 수
+        self.capture_limit = None  # 이 프레임 수를 넘으면 녹음을 멈춤
+    
+    def set_budget(self, seconds):
+        """이번 녹음에 쓸 수 있는 남은 시간 설정 (None이면 제한 없음)"""
+        if seconds is None:
+            self.capture_limit = None
+        else:
+            self.capture_limit = self.capture_frames + max(0, int(seconds * sample_rate))
+    
+    def over_budget(self):
+        return self.capture_limit is not None and self.capture_frames >= self.capture_limit
+    
+    def collect(self):
+        """지난번 이후 녹음/재생한 시간 (초)"""
+        capture, playback = self.capture_frames, self.playback_frames
+        seconds = (capture - self.collected[0]) / sample_rate + (playback - self.collected[1]) / TTS_SAMPLE_RATE
+        self.collected = (capture, playback)
+        return seconds
+
+
+capture_buffer = None  # prepare_audio()에서 만듦 (numpy를 불러온 뒤)
+vad = None
+usage_meter = UsageMeter()
+
+
+def prepare_audio():
+    """오디오 모듈을 불러오고 장치를 확인한 뒤 녹음 버퍼 준비 (시작할 때 별도 스레드에서 실행)"""
+    global np, sd, capture_buffer, vad
+    import numpy
+    import sounddevice  # 불러오면서 PortAudio를 초기화하고 장치를 훑음
+    np, sd = numpy, sounddevice
+    capture_buffer = CaptureBuffer(sample_rate * MAX_RECORDING_SECONDS)
+    vad = VoiceActivityDetector()
+    
+    print("\n오디오 장치를 확인하는 중...")
+    available = check_audio_devices()
+    if not available:
+        print("⚠️ 오디오 장치 확인에 실패했습니다.")
+        print("마이크 권한을 확인하거나 오디오 설정을 점검해주세요.")
+    get_default_audio_device()
+    return available
 
 
-def add_reminder(reminder_text):
-    """리마인더 추가"""
-    global current_reminder
-    current_reminder = reminder_text
-    print(f"리마인더 추가됨: {reminder_text}")
+active_transcriber = None  # 녹음 중 조각 단위로 인식하는 StreamingTranscriber
 
 
-def get_reminder():
-    """현재 리마인더 가져오기"""
-    global current_reminder
-    return current_reminder
+def notify_event(event):
+    """다른 스레드에서 asyncio 이벤트를 안전하게 설정"""
+    if main_loop is not None:
+        main_loop.call_soon_threadsafe(event.set)
 
 
-def clear_reminder():
-    """리마인더 삭제"""
-    global current_reminder
-    current_reminder = None
-    print("리마인더가 삭제되었습니다.")
+def stop_recording(auto=False):
+    """녹음 종료를 알림 (키보드/오디오 스레드에서 호출, auto: 음성 구간 검출이나 사용시간으로 저절로 멈춤)"""
+    global is_recording, auto_stopped_at
+    is_recording = False
+    auto_stopped_at = time.monotonic() if auto else None
+    notify_event(recording_stopped)
 
 
 def audio_callback(indata, frames, time, status):
     """오디오 스트림 콜백 함수"""
     if is_recording:
-        audio_queue.put(indata.copy())
+        block = indata[:, 0]
+        position = capture_buffer.written
+        capture_buffer.write(block)
+        usage_meter.capture_frames += frames
+        if usage_meter.over_budget():
+            # 녹음 도중 오늘 사용시간이 다 되면 바로 멈춤
+            stop_recording(auto=True)
+            print("⏰ 오늘 사용시간이 다 되어서 녹음을 멈췄어.")
+            return
+        if not VAD_ENABLED:
+            return
+        ended = vad.process(block, position)
+        if vad.pause_cut is not None:
+            # 잠깐 쉰 지점까지를 백그라운드 인식으로 넘김
+            transcriber = active_transcriber
+            if transcriber is not None and main_loop is not None:
+                main_loop.call_soon_threadsafe(transcriber.add_cut, vad.pause_cut, context=transcriber.context)
+            vad.pause_cut = None
+        if ended:
+            # 말이 끝나고 충분히 조용해지면 자동으로 녹음 종료
+            stop_recording(auto=True)
+            print("이야기 끝! 잘했어!")
 
 
 def on_key_press(key):
     """키가 눌렸을 때 호출되는 함수"""
-    global is_recording
+    global is_recording, auto_stopped_at
     try:
+        if key.char == '=' and not is_recording and auto_stopped_at is not None:
+            # 저절로 멈춘 뒤 아이가 평소처럼 끝내려고 누른 =키 (새 녹음을 시작하거나 토닥의 대답을 끊지 않음)
+            stopped_at, auto_stopped_at = auto_stopped_at, None
+            if time.monotonic() - stopped_at < VAD_KEY_GRACE_SECONDS:
+                return
         if key.char == '=' and not is_recording:
             is_recording = True
+            # 아이가 말하려고 하면 토닥은 바로 말을 멈춤
+            audio_player.barge_in()
+            notify_event(recording_started)
             print("이야기 시작! =키를 다시 눌러서 끝내세요!")
         elif key.char == '=' and is_recording:
-            is_recording = False
+            stop_recording()
             print("이야기 끝! 잘했어!")
     except AttributeError:
         pass
@@ -246,11 +1399,14 @@ def on_key_press(key):
 
 def start_keyboard_listener():
     """키보드 리스너 시작 (토글 방식)"""
+    global keyboard_listener_active
     try:
+        from pynput import keyboard  # X 서버/접근성 API에 연결하느라 불러오는 데 시간이 걸림
         listener = keyboard.Listener(
             on_press=on_key_press
         )
         listener.start()
+        keyboard_listener_active = True
         print("키보드 리스너가 시작되었습니다. (=키로 토글)")
         return listener
     except Exception as e:
@@ -268,18 +1424,52 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         print(f"시작 명령어 응답 전송 실패: {e}")
 
 
+async def child_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """명령을 보낼 아이 선택 명령어 (아이가 여럿일 때)"""
+    try:
+        chat_id = update.effective_chat.id
+        sessions = session_registry.for_chat(chat_id)
+        if not sessions:
+            await update.message.reply_text("이 명령어는 부모님만 사용할 수 있습니다.")
+            return
+        
+        if context.args:
+            session = session_registry.select(chat_id, " ".join(context.args))
+            if session is None:
+                await update.message.reply_text("그 이름의 아이를 찾을 수 없습니다.")
+                return
+            await update.message.reply_text(f"✅ 이제 명령과 메시지가 {session.child_id}에게 전달됩니다.")
+            return
+        
+        current = session_registry.route(chat_id)
+        names = "\n".join(
+            f"{'👉 ' if session is current else '- '}{session.child_id} ({session.device_id})" for session in sessions
+        )
+        await update.message.reply_text(
+            f"👶 **연결된 아이**\n\n{names}\n\n"
+            f"아이를 바꾸려면: /child [이름]"
+        )
+    
+    except Exception as e:
+        print(f"아이 선택 명령어 처리 실패: {e}")
+        try:
+            await update.message.reply_text("아이 선택 중 오류가 발생했습니다.")
+        except:
+            pass
+
+
 async def time_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """일일 사용시간 설정 명령어"""
-    global daily_time_limit
-    
+    from telegram import InlineKeyboardButton, InlineKeyboardMarkup
     try:
-        if str(update.effective_chat.id) != PARENT_CHAT_ID:
+        session = session_registry.route(update.effective_chat.id)
+        if session is None:
             await update.message.reply_text("이 명령어는 부모님만 사용할 수 있습니다.")
             return
         
         # 현재 상태 표시
-        reset_daily_usage()
-        remaining_time = daily_time_limit - daily_usage_time
+        session.reset_daily_usage()
+        remaining_time = session.remaining_seconds()
         
         keyboard = [
             [InlineKeyboardButton("15분", callback_data="time_15")],
@@ -290,10 +1480,10 @@ async def time_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         reply_markup = InlineKeyboardMarkup(keyboard)
         
         message = (
-            f"📱 일일 사용시간 설정\n\n"
-            f"현재 설정: {daily_time_limit}분\n"
-            f"오늘 사용: {daily_usage_time}분\n"
-            f"남은 시간: {remaining_time}분\n\n"
+            f"📱 {session_registry.label(session)}일일 사용시간 설정\n\n"
+            f"현재 설정: {session.daily_time_limit}분\n"
+            f"오늘 사용: {format_duration(session.daily_usage_seconds)}\n"
+            f"남은 시간: {format_duration(remaining_time)}\n\n"
             f"새로운 시간을 선택해주세요:"
         )
         
@@ -309,13 +1499,12 @@ async def time_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def time_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """시간 설정 콜백 처리"""
-    global daily_time_limit
-    
     query = update.callback_query
     await query.answer()
     
     try:
-        if str(query.from_user.id) != PARENT_CHAT_ID:
+        session = session_registry.route(update.effective_chat.id)
+        if session is None:
             await query.edit_message_text("이 명령어는 부모님만 사용할 수 있습니다.")
             return
         
@@ -337,14 +1526,12 @@ async def time_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         }
         
         if query.data in time_mapping:
-            daily_time_limit = time_mapping[query.data]
-            reset_daily_usage()
+            session.set_time_limit(time_mapping[query.data])
             
             await query.edit_message_text(
-                f"✅ 일일 사용시간이 {daily_time_limit}분으로 설정되었습니다!\n\n"
-                f"오늘 사용 가능한 시간: {daily_time_limit}분"
+                f"✅ {session_registry.label(session)}일일 사용시간이 {session.daily_time_limit}분으로 설정되었습니다!\n\n"
+                f"오늘 사용 가능한 시간: {session.daily_time_limit}분"
             )
-            print(f"부모님이 일일 사용시간을 {daily_time_limit}분으로 변경했습니다.")
             
     except Exception as e:
         print(f"시간 설정 콜백 처리 실패: {e}")
@@ -357,27 +1544,29 @@ async def time_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def report_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """성장 리포트 조회 명령어"""
     try:
-        if str(update.effective_chat.id) != PARENT_CHAT_ID:
+        session = session_registry.route(update.effective_chat.id)
+        if session is None:
             await update.message.reply_text("이 명령어는 부모님만 사용할 수 있습니다.")
             return
         
-        reset_daily_usage()
+        session.reset_daily_usage()
         
-        if len(daily_conversations) < 3:
+        if len(session.daily_conversations) < 3:
             await update.message.reply_text(
-                f"📊 **성장 리포트**\n\n"
-                f"오늘 대화 횟수: {conversation_count}회\n"
-                f"리포트 생성까지: {3 - conversation_count}회 더 대화가 필요합니다.\n\n"
+                f"📊 {session_registry.label(session)}**성장 리포트**\n\n"
+                f"오늘 대화 횟수: {session.conversation_count}회\n"
+                f"리포트 생성까지: {3 - session.conversation_count}회 더 대화가 필요합니다.\n\n"
                 f"아이가 토닥과 3번 이상 대화하면 자동으로 성장 리포트가 생성됩니다."
             )
             return
         
-        # 리포트 생성
-        await update.message.reply_text("📊 성장 리포트를 생성하는 중입니다...")
+        # 새 대화가 없으면 저장해 둔 리포트를 바로 보내고, 있으면 새 대화만 반영해서 생성
+        if not is_report_fresh(session):
+            await update.message.reply_text("📊 성장 리포트를 생성하는 중입니다...")
         
-        report = await generate_growth_report()
+        report = await generate_growth_report(session)
         if report:
-            await update.message.reply_text(f"📊 **성장 리포트**\n\n{report}")
+            await update.message.reply_text(f"📊 {session_registry.label(session)}**성장 리포트**\n\n{report}")
         else:
             await update.message.reply_text("리포트 생성 중 오류가 발생했습니다. 다시 시도해주세요.")
             
@@ -389,19 +1578,45 @@ async def report_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             pass
 
 
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """단계별 지연 시간 통계 조회 명령어"""
+    try:
+        if not session_registry.for_chat(update.effective_chat.id):
+            await update.message.reply_text("이 명령어는 부모님만 사용할 수 있습니다.")
+            return
+        
+        if not trace_stats.summary():
+            await update.message.reply_text("⏱️ 아직 기록된 대화가 없습니다.")
+            return
+        
+        outbox = telegram_outbox
+        await update.message.reply_text(
+            f"⏱️ 단계별 지연 시간 (최근 {TRACE_WINDOW}턴)\n\n{trace_stats.format()}\n\n"
+            f"📨 부모님 메시지: 보냄 {outbox.delivered}개 (텔레그램 {outbox.batches}번), 대기 {len(outbox.pending)}개, 보내지 못함 {outbox.dropped}개"
+        )
+    
+    except Exception as e:
+        print(f"통계 명령어 처리 실패: {e}")
+        try:
+            await update.message.reply_text("통계 조회 중 오류가 발생했습니다.")
+        except:
+            pass
+
+
 async def reminder_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """리마인더 설정 명령어"""
     try:
-        if str(update.effective_chat.id) != PARENT_CHAT_ID:
+        session = session_registry.route(update.effective_chat.id)
+        if session is None:
             await update.message.reply_text("이 명령어는 부모님만 사용할 수 있습니다.")
             return
         
         if not context.args:
             # 현재 리마인더 상태 표시
-            current_reminder_text = get_reminder()
+            current_reminder_text = session.get_reminder()
             if current_reminder_text:
                 await update.message.reply_text(
-                    f"📝 **현재 리마인더**\n\n"
+                    f"📝 {session_registry.label(session)}**현재 리마인더**\n\n"
                     f"{current_reminder_text}\n\n"
                     f"리마인더를 변경하려면: /reminder [할 일]\n"
                     f"리마인더를 삭제하려면: /reminder clear"
@@ -417,16 +1632,16 @@ async def reminder_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         # 리마인더 설정
         if context.args[0].lower() == "clear":
-            clear_reminder()
+            session.clear_reminder()
             await update.message.reply_text("✅ 리마인더가 삭제되었습니다.")
             return
         
         # 새로운 리마인더 설정
         reminder_text = " ".join(context.args)
-        add_reminder(reminder_text)
+        session.add_reminder(reminder_text)
         
         await update.message.reply_text(
-            f"✅ 리마인더가 설정되었습니다!\n\n"
+            f"✅ {session_registry.label(session)}리마인더가 설정되었습니다!\n\n"
             f"📝 **설정된 리마인더**\n"
             f"{reminder_text}\n\n"
             f"아이가 토닥과 대화할 때 자동으로 전달됩니다."
@@ -442,8 +1657,9 @@ async def reminder_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def handle_parent_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """부모님으로부터 온 메시지 처리"""
-    if str(update.effective_chat.id) == PARENT_CHAT_ID:
+    """부모님으로부터 온 메시지 처리 (아이가 여럿이면 /child로 고른 아이에게)"""
+    session = session_registry.route(update.effective_chat.id)
+    if session is not None:
         message_text = update.message.text
         
         # 직접입력 시간 설정 처리
@@ -451,15 +1667,12 @@ async def handle_parent_message(update: Update, context: ContextTypes.DEFAULT_TY
             try:
                 custom_time = int(message_text)
                 if 5 <= custom_time <= 120:
-                    global daily_time_limit
-                    daily_time_limit = custom_time
-                    reset_daily_usage()
+                    session.set_time_limit(custom_time)
                     
                     await update.message.reply_text(
-                        f"✅ 일일 사용시간이 {daily_time_limit}분으로 설정되었습니다!\n\n"
-                        f"오늘 사용 가능한 시간: {daily_time_limit}분"
+                        f"✅ {session_registry.label(session)}일일 사용시간이 {session.daily_time_limit}분으로 설정되었습니다!\n\n"
+                        f"오늘 사용 가능한 시간: {session.daily_time_limit}분"
                     )
-                    print(f"부모님이 일일 사용시간을 {daily_time_limit}분으로 변경했습니다.")
                 else:
                     await update.message.reply_text(
                         "시간은 5분에서 120분 사이로 설정해주세요.\n"
@@ -478,104 +1691,275 @@ async def handle_parent_message(update: Update, context: ContextTypes.DEFAULT_TY
             return
         
         # 일반 메시지 처리
-        print(f"부모님으로부터 메시지 수신: {message_text}")
-        parent_message_queue.put(message_text)
+        print(f"[{session.child_id}] 부모님으로부터 메시지 수신: {message_text}")
+        if session.attached:
+            session.scheduler.announce(message_text, SPEAK_PARENT)
         
         # 응답 전송 시도 (실패해도 계속 진행)
         try:
-            await update.message.reply_text("메시지를 아이에게 전달했습니다.")
+            if session.attached:
+                await update.message.reply_text(f"{session_registry.label(session)}메시지를 아이에게 전달했습니다.")
+            else:
+                # 다른 인형이 이 프로세스에 붙을 방법은 없으므로 쌓아 두지 않음 (리마인더는 저장되어 그 인형의 프로그램이 전달)
+                await update.message.reply_text(
+                    f"{session_registry.label(session)}이 아이의 인형이 이 컴퓨터에 연결되어 있지 않아서 메시지를 전달하지 못했습니다.\n"
+                    "나중에 전하려면 /reminder 로 남겨 주세요."
+                )
         except Exception as e:
             print(f"텔레그램 응답 전송 실패 (무시됨): {e}")
             # 응답 전송 실패해도 메시지는 큐에 들어가므로 계속 진행
 
 
-async def send_message_to_parent(message: str):
-    """부모님에게 메시지 전송 (재시도 로직 포함)"""
-    if telegram_app and PARENT_CHAT_ID:
-        max_retries = 3
-        for attempt in range(max_retries):
-            try:
-                await telegram_app.bot.send_message(
-                    chat_id=PARENT_CHAT_ID,
-                    text=f"아이의 메시지: {message}"
-                )
-                print(f"부모님에게 메시지 전송 성공: {message}")
-                return
-            except Exception as e:
-                print(f"부모님에게 메시지 전송 실패 (시도 {attempt + 1}/{max_retries}): {e}")
-                if attempt < max_retries - 1:
-                    await asyncio.sleep(2)  # 2초 대기 후 재시도
-                else:
-                    print("부모님에게 메시지 전송 최종 실패")
+async def send_message_to_parent(session, message: str):
+    """부모님에게 메시지 전송 (보낼 메시지함에 넣고 바로 돌아옴, 아이의 턴은 텔레그램을 기다리지 않음)"""
+    if TELEGRAM_BOT_TOKEN and session.parent_chat_id:
+        telegram_outbox.send(
+            session.parent_chat_id,
+            f"{session_registry.label(session)}아이의 메시지: {message}",
+            f"메시지: {message}"
+        )
 
 
-async def start_telegram_bot():
-    """텔레그램 봇 시작 (강화된 오류 처리)"""
-    global telegram_app
+def split_message(text, limit=TELEGRAM_MESSAGE_LIMIT):
+    """텔레그램 길이 제한에 맞게 문단, 줄, 띄어쓰기 경계에서 나눔"""
+    parts = []
+    while len(text) > limit:
+        cut = -1
+        for separator in ("\n\n", "\n", " "):
+            cut = text.rfind(separator, 0, limit)
+            if cut > 0:
+                break
+        if cut <= 0:
+            cut = limit
+        parts.append(text[:cut].rstrip())
+        text = text[cut:].lstrip()
+    parts.append(text)
+    return parts
+
+
+class TelegramOutbox:
+    """부모님에게 보낼 메시지함 (모아서 보내고, 속도 제한을 지키며, 텔레그램이 안 되면 상태 저장소에 보관했다가 다시 보냄)"""
     
-    if not TELEGRAM_BOT_TOKEN:
-        print("텔레그램 봇 토큰이 설정되지 않았습니다.")
-        return None
+    def __init__(self, store=None):
+        self.store = store
+        self.pending = collections.deque()  # (키, 채팅 ID, 텍스트, 로그용 설명, 급한 메시지 여부)
+        self.queued_at = {}  # 키 -> 넣은 시각 (time.monotonic, 묶어 보내기 대기용)
+        self.chat_ready = {}  # 채팅 ID -> 다음 메시지를 보낼 수 있는 시각
+        self.global_ready = 0.0
+        self.wakeup = asyncio.Event()
+        self.counter = itertools.count()
+        self.delivered = 0  # 보낸 메시지 수 (pending, dropped와 같은 단위)
+        self.batches = 0  # 실제로 보낸 텔레그램 메시지 수 (여러 메시지를 하나로 묶어 보냄)
+        self.dropped = 0  # 보낼 수 없어서 버린 메시지 수
+        if store is not None:
+            self.pending.extend((key, chat_id, text, note, bool(urgent)) for key, chat_id, text, note, urgent in store.load_outbox())
+            if self.pending:
+                print(f"지난번에 보내지 못한 부모님 메시지 {len(self.pending)}개를 다시 보냅니다.")
     
-    max_retries = 3
-    for attempt in range(max_retries):
-        try:
-            # 텔레그램 봇 설정 개선 (연결 풀 타임아웃 해결)
-            telegram_app = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+    def send(self, chat_id, text, note, urgent=False):
+        """메시지함에 넣고 바로 돌아옴 (urgent면 먼저 들어온 보통 메시지보다 앞에, 길면 나눠서)"""
+        parts = split_message(text)
+        position = len(self.pending)
+        if urgent:
+            position = 0
+            while position < len(self.pending) and self.pending[position][4]:
+                position += 1
+        for index, part in enumerate(parts):
+            key = f"{time.time_ns()}-{next(self.counter)}"
+            part_note = f"{note} ({index + 1}/{len(parts)})" if len(parts) > 1 else note
+            self.pending.insert(position + index, (key, str(chat_id), part, part_note, urgent))
+            self.queued_at[key] = time.monotonic()
+            if self.store is not None:
+                self.store.add_outbox(key, str(chat_id), part, part_note, urgent)
+        self.wakeup.set()
+    
+    def _take_batch(self):
+        """맨 앞 메시지와 같은 채팅, 같은 급함의 메시지를 길이 제한 안에서 묶음"""
+        head = self.pending[0]
+        batch = [head]
+        length = len(head[2])
+        for item in itertools.islice(self.pending, 1, None):
+            if item[1] != head[1] or item[4] != head[4]:
+                continue
+            if length + 2 + len(item[2]) > TELEGRAM_MESSAGE_LIMIT:
+                break  # 순서가 바뀌지 않도록 넘치는 메시지부터는 다음에
+            batch.append(item)
+            length += 2 + len(item[2])
+        return batch
+    
+    async def _wait_for_rate_limit(self, chat_id):
+        ready = max(self.chat_ready.get(chat_id, 0.0), self.global_ready)
+        delay = ready - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+    
+    async def run(self):
+        """메시지함을 비우는 백그라운드 작업 (실패하면 보관한 채로 나중에 다시)"""
+        breaker = circuit_breakers["telegram"]
+        while True:
+            self.wakeup.clear()
+            if not self.pending or telegram_app is None:
+                await self.wakeup.wait()
+                continue
+            head = self.pending[0]
+            if not head[4]:
+                # 보통 메시지는 잠깐 기다렸다가 그동안 들어온 메시지와 묶음 (급한 메시지가 오면 바로 깨어남)
+                delay = self.queued_at.get(head[0], 0.0) + TELEGRAM_COALESCE_SECONDS - time.monotonic()
+                if delay > 0:
+                    try:
+                        await asyncio.wait_for(self.wakeup.wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
             
-            # 연결 풀 설정 개선 (사용 가능한 속성만 설정)
+            batch = self._take_batch()
+            chat_id = head[1]
+            text = "\n\n".join(item[2] for item in batch)
+            notes = ", ".join(item[3] for item in batch)
+            await self._wait_for_rate_limit(chat_id)
             try:
-                telegram_app.bot.request.read_timeout = 30
-                telegram_app.bot.request.write_timeout = 30
-                telegram_app.bot.request.connect_timeout = 30
-                print("텔레그램 봇 연결 설정이 완료되었습니다.")
+                await call_with_retry("telegram", lambda: telegram_app.bot.send_message(chat_id=chat_id, text=text))
+            except CircuitOpen:
+                print(f"텔레그램 연결이 끊겨 있어서 부모님 메시지 {len(self.pending)}개를 보관 중입니다.")
+                await asyncio.sleep(breaker.retry_in())
+                continue
             except Exception as e:
-                print(f"텔레그램 봇 연결 설정 중 일부 오류 (무시됨): {e}")
-            
-            # 명령어 핸들러 등록
-            telegram_app.add_handler(CommandHandler("start", start_command))
-            telegram_app.add_handler(CommandHandler("time", time_command))
-            telegram_app.add_handler(CommandHandler("report", report_command))
-            telegram_app.add_handler(CommandHandler("reminder", reminder_command))
-            
-            # 콜백 쿼리 핸들러 등록
-            telegram_app.add_handler(CallbackQueryHandler(time_callback, pattern="^time_"))
-            
-            # 메시지 핸들러 등록
-            telegram_app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_parent_message))
-            
-            # 봇 시작
-            await telegram_app.initialize()
-            await telegram_app.start()
-            
-            # 기존 업데이트 정리 (타임아웃 설정)
-            try:
-                await asyncio.wait_for(
-                    telegram_app.bot.delete_webhook(drop_pending_updates=True),
-                    timeout=10
-                )
-            except asyncio.TimeoutError:
-                print("웹훅 삭제 타임아웃 (무시됨)")
-            
-            # 폴링 시작
-            await telegram_app.updater.start_polling(drop_pending_updates=True)
-            
-            print("텔레그램 봇이 시작되었습니다.")
-            return telegram_app
-            
-        except Exception as e:
-            print(f"텔레그램 봇 시작 오류 (시도 {attempt + 1}/{max_retries}): {e}")
-            if attempt < max_retries - 1:
-                print("5초 후 재시도합니다...")
-                await asyncio.sleep(5)
+                if is_retryable(e):
+                    print(f"부모님에게 전송 실패, 보관했다가 다시 보냅니다 ({notes}): {e}")
+                    await asyncio.sleep(RETRY_MAX_DELAY)
+                    continue
+                self.dropped += len(batch)
+                print(f"부모님에게 보낼 수 없는 메시지라서 버립니다 ({notes}): {e}")
             else:
-                print("텔레그램 봇 시작 최종 실패. 로컬 모드로 실행됩니다.")
-                return None
+                self.delivered += len(batch)
+                self.batches += 1
+                waited = time.monotonic() - min(self.queued_at.get(item[0], time.monotonic()) for item in batch)
+                merged = f", {len(batch)}개를 한 메시지로" if len(batch) > 1 else ""
+                print(f"부모님에게 전송 완료: {notes} ({waited:.1f}초 만에{merged}, 남은 메시지 {len(self.pending) - len(batch)}개)")
+            now = time.monotonic()
+            self.chat_ready[chat_id] = now + TELEGRAM_CHAT_INTERVAL
+            self.global_ready = now + TELEGRAM_GLOBAL_INTERVAL
+            for item in batch:
+                self.pending.remove(item)  # 보내는 동안 급한 메시지가 앞에 끼어들었을 수 있음
+                self.queued_at.pop(item[0], None)
+                if self.store is not None:
+                    self.store.remove_outbox(item[0])
+
+
+def make_telegram_request(pool_size):
+    """OpenAI 클라이언트와 같은 연결 설정을 쓰는 텔레그램 HTTP 요청 객체 (httpx_kwargs는 python-telegram-bot 21.6 이상)"""
+    from telegram.request import HTTPXRequest
+    return HTTPXRequest(
+        connection_pool_size=pool_size,
+        read_timeout=30,
+        write_timeout=30,
+        connect_timeout=HTTP_CONNECT_TIMEOUT,
+        pool_timeout=HTTP_POOL_TIMEOUT,
+        http_version="2" if HTTP2_ENABLED else "1.1",
+        httpx_kwargs={"limits": http_limits(pool_size)},
+    )
+
+
+async def start_telegram_bot():
+    """텔레그램 봇 시작 (강화된 오류 처리)"""
+    global telegram_app
+    
+    if not TELEGRAM_BOT_TOKEN:
+        print("텔레그램 봇 토큰이 설정되지 않았습니다.")
+        return None
+    
+    use_webhook = bool(TELEGRAM_WEBHOOK_URL)
+    if use_webhook and importlib.util.find_spec("tornado") is None:
+        print('웹훅 모드에는 pip install "python-telegram-bot[webhooks]"가 필요합니다. 폴링으로 시작합니다.')
+        use_webhook = False
+    
+    # telegram.ext는 불러오는 데 오래 걸리므로 이벤트 루프를 막지 않게 스레드에서 불러옴
+    await asyncio.to_thread(importlib.import_module, "telegram.ext")
+    from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters
+    
+    async def launch():
+        global telegram_app
+        # 메시지 전송용과 업데이트 수신용 연결 풀을 따로 두어 서로 기다리지 않게 함 (연결 풀 타임아웃 해결)
+        builder = Application.builder().token(TELEGRAM_BOT_TOKEN)
+        builder = builder.request(make_telegram_request(HTTP_MAX_CONNECTIONS))
+        builder = builder.get_updates_request(make_telegram_request(1))
+        if TELEGRAM_BASE_URL:
+            builder = builder.base_url(f"{TELEGRAM_BASE_URL.rstrip('/')}/bot")
+        app = builder.build()
+        
+        # 명령어 핸들러 등록
+        app.add_handler(CommandHandler("start", start_command))
+        app.add_handler(CommandHandler("time", time_command))
+        app.add_handler(CommandHandler("report", report_command))
+        app.add_handler(CommandHandler("reminder", reminder_command))
+        app.add_handler(CommandHandler("stats", stats_command))
+        app.add_handler(CommandHandler("child", child_command))
+        
+        # 콜백 쿼리 핸들러 등록
+        app.add_handler(CallbackQueryHandler(time_callback, pattern="^time_"))
+        
+        # 메시지 핸들러 등록
+        app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_parent_message))
+        
+        # 봇 시작 (대화는 이미 진행 중일 수 있으므로 초기화가 끝난 뒤에야 메시지함이 쓰도록 알림)
+        await app.initialize()
+        await app.start()
+        telegram_app = app
+        
+        if use_webhook:
+            # 웹훅 등록 후 로컬 HTTP 서버에서 업데이트를 받음 (getUpdates 폴링 없음)
+            await telegram_app.updater.start_webhook(
+                listen=TELEGRAM_WEBHOOK_LISTEN,
+                port=TELEGRAM_WEBHOOK_PORT,
+                url_path=urlparse(TELEGRAM_WEBHOOK_URL).path.strip("/"),
+                webhook_url=TELEGRAM_WEBHOOK_URL,
+                secret_token=TELEGRAM_WEBHOOK_SECRET,
+                drop_pending_updates=True
+            )
+            return
+        
+        # 기존 업데이트 정리 (타임아웃 설정)
+        try:
+            await asyncio.wait_for(
+                telegram_app.bot.delete_webhook(drop_pending_updates=True),
+                timeout=10
+            )
+        except asyncio.TimeoutError:
+            print("웹훅 삭제 타임아웃 (무시됨)")
+        
+        # 폴링 시작
+        await telegram_app.updater.start_polling(drop_pending_updates=True)
+    
+    # 네트워크 오류만 재시도 (잘못된 토큰 같은 오류는 바로 로컬 모드로)
+    try:
+        await call_with_retry("telegram", launch, attempts=3)
+    except Exception as e:
+        print(f"텔레그램 봇 시작 최종 실패. 로컬 모드로 실행됩니다: {e}")
+        telegram_app = None
+        return None
+    
+    # 시작하는 동안 쌓인 부모님 메시지 보내기
+    telegram_outbox.wakeup.set()
+    if use_webhook:
+        print(f"텔레그램 봇이 웹훅으로 시작되었습니다: {TELEGRAM_WEBHOOK_URL} -> {TELEGRAM_WEBHOOK_LISTEN}:{TELEGRAM_WEBHOOK_PORT}")
+    else:
+        print("텔레그램 봇이 시작되었습니다.")
+    return telegram_app
 
 
 async def record_audio_with_toggle():
     """=키로 토글하는 음성 녹음 (키보드 리스너가 없으면 고정 시간 녹음)"""
-    global recording_data
+    global is_recording
+    
+    capture_buffer.reset()
+    vad.reset()
+    recording_stopped.clear()
+    if local_session is not None:
+        # 남은 사용시간만큼만 녹음
+        local_session.add_usage_seconds(usage_meter.collect())
+        usage_meter.set_budget(local_session.remaining_seconds())
+    if not is_recording:
+        recording_started.clear()
     
     # 오디오 스트림 시작 (오류 처리 강화)
     try:
@@ -584,7 +1968,7 @@ async def record_audio_with_toggle():
             channels=1,
             dtype=np.float32,
             callback=audio_callback,
-            blocksize=1024
+            blocksize=CAPTURE_BLOCKSIZE
         )
         stream.start()
         print("오디오 스트림이 시작되었습니다.")
@@ -594,44 +1978,30 @@ async def record_audio_with_toggle():
         print("시스템 환경설정 > 보안 및 개인정보 보호 > 마이크에서 터미널을 허용해주세요.")
         return None
     
-    recording_data = []
-    
-    # 키보드 리스너가 있는 경우 =키 토글 기반 녹음
-    if is_recording is not None:  # 키보드 리스너가 활성화된 경우
+    if keyboard_listener_active:
+        # =키 토글 기반 녹음: 키보드 스레드가 이벤트로 시작/끝을 알려줌
         print("=키를 눌러서 이야기를 시작해줘.")
-        
-        # 녹음이 시작될 때까지 대기
-        while not is_recording:
-            await asyncio.sleep(0.1)
-        
-        # 녹음 중일 때 오디오 데이터 수집
-        while is_recording:
-            try:
-                # 큐에서 오디오 데이터 가져오기 (타임아웃 설정)
-                audio_chunk = audio_queue.get(timeout=0.1)
-                recording_data.append(audio_chunk)
-            except queue.Empty:
-                continue
+        await recording_started.wait()
+        on_recording_started()
+        await recording_stopped.wait()
+    elif VAD_ENABLED:
+        # 키보드 리스너가 없으면 말이 끝날 때 자동으로 종료 (최대 VAD_MAX_SECONDS)
+        print("이야기해주세요! 말이 끝나면 자동으로 녹음을 멈춰요.")
+        is_recording = True
+        on_recording_started()
+        try:
+            await asyncio.wait_for(recording_stopped.wait(), timeout=VAD_MAX_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        is_recording = False
     else:
         # 키보드 리스너가 없는 경우 고정 시간 녹음
         print("5초간 녹음합니다. 이야기해주세요!")
+        is_recording = True
+        on_recording_started()
         await asyncio.sleep(5)
-        
-        # 5초간 녹음된 데이터 수집
-        while not audio_queue.empty():
-            try:
-                audio_chunk = audio_queue.get_nowait()
-                recording_data.append(audio_chunk)
-            except queue.Empty:
-                break
-    
-    # 녹음이 끝난 후 남은 데이터 처리
-    while not audio_queue.empty():
-        try:
-            audio_chunk = audio_queue.get_nowait()
-            recording_data.append(audio_chunk)
-        except queue.Empty:
-            break
+        is_recording = False
+    trace_mark("capture_stop")
     
     # 오디오 스트림 안전하게 종료
     try:
@@ -641,11 +2011,17 @@ async def record_audio_with_toggle():
     except Exception as e:
         print(f"오디오 스트림 종료 중 오류: {e}")
     
-    if recording_data:
-        # 모든 오디오 데이터를 하나로 합치기
-        full_recording = np.concatenate(recording_data, axis=0)
-        # float32를 int16으로 변환
-        full_recording = (full_recording * 32767).astype(np.int16)
+    if VAD_ENABLED:
+        if not vad.speech_detected:
+            # 말소리가 없으면 STT 요청을 보내지 않음
+            print("음성이 들리지 않았어. 다시 시도해볼까?")
+            return None
+        # 앞뒤 무음은 잘라내고 업로드
+        full_recording = capture_buffer.slice(*vad.speech_bounds())
+    else:
+        full_recording = capture_buffer.view()
+    
+    if len(full_recording) > 0:
         print("이야기 잘 들었어!")
         return full_recording
     else:
@@ -653,60 +2029,851 @@ async def record_audio_with_toggle():
         return None
 
 
-async def text_to_speech(text):
-    """텍스트를 음성으로 변환 (어린이용 친근한 목소리)"""
+class Utterance:
+    """플레이어 큐에 들어가는 발화 하나 (PCM 바이트를 받는 대로 재생)"""
+    
+    def __init__(self, loop, priority=SPEAK_REPLY):
+        self.loop = loop
+        self.priority = priority
+        self.started = False  # 첫 샘플이 스피커로 나감
+        self.cancelled = False  # 끼어들기나 더 급한 안내로 재생이 취소됨
+        self.chunks = collections.deque()  # 재생 대기 중인 int16 샘플 블록
+        self.offset = 0  # 첫 블록에서 이미 재생한 샘플 수
+        self.finished = False  # 더 들어올 데이터가 없음
+        self.done = asyncio.Event()  # 재생 완료
+        self._leftover = b""  # 샘플 경계에 맞지 않는 나머지 바이트
+        self.trace = current_trace.get()  # 재생 시작/끝을 기록할 턴
+    
+    def feed(self, data):
+        """PCM 바이트 추가 (이벤트 루프 스레드에서 호출)"""
+        data = self._leftover + data
+        usable = len(data) - len(data) % 2
+        self._leftover = data[usable:]
+        if usable:
+            self.chunks.append(np.frombuffer(data[:usable], dtype=np.int16))
+    
+    def finish(self):
+        """더 이상 데이터가 없음을 알림"""
+        self.finished = True
+    
+    def read_into(self, out):
+        """재생 버퍼에 샘플을 채우고 채운 샘플 수를 반환 (오디오 스레드에서 호출)"""
+        written = 0
+        while written < len(out) and self.chunks:
+            chunk = self.chunks[0]
+            count = min(len(out) - written, len(chunk) - self.offset)
+            out[written:written + count] = chunk[self.offset:self.offset + count]
+            written += count
+            self.offset += count
+            if self.offset >= len(chunk):
+                self.chunks.popleft()
+                self.offset = 0
+        if written:
+            self.started = True
+        return written
+    
+    def drained(self):
+        return self.finished and not self.chunks
+    
+    def mark_done(self):
+        """재생 완료 표시 (어느 스레드에서든 호출 가능)"""
+        self.loop.call_soon_threadsafe(self.done.set)
+    
+    def cancel(self):
+        """남은 데이터를 버리고 완료 처리 (합성 중이면 더 받지 않음)"""
+        self.cancelled = True
+        self.chunks.clear()
+        self.mark_done()
+    
+    async def wait(self):
+        await self.done.wait()
+
+
+class AudioPlayer:
+    """출력 스트림 하나를 계속 열어두고 큐에 쌓인 발화를 틈 없이 이어서 재생하는 플레이어"""
+    
+    def __init__(self, samplerate=TTS_SAMPLE_RATE, blocksize=PLAYBACK_BLOCKSIZE):
+        self.samplerate = samplerate
+        self.blocksize = blocksize
+        self.queue = collections.deque()  # 재생 순서대로 쌓인 Utterance (앞이 재생 중)
+        self.lock = threading.Lock()  # 오디오 스레드, 키보드 스레드와 큐를 같이 씀
+        self.interruptions = 0  # 끼어들기나 안전 안내로 재생을 끊은 횟수
+        self.stream = None
+        self.available = True  # 출력 장치를 열 수 없으면 False
+    
+    def start(self):
+        """출력 스트림 시작 (처음 재생할 때 자동으로 호출됨)"""
+        if self.stream is not None or not self.available:
+            return
+        try:
+            self.stream = sd.OutputStream(
+                samplerate=self.samplerate,
+                channels=1,
+                dtype='int16',
+                blocksize=self.blocksize,
+                callback=self._callback
+            )
+            self.stream.start()
+            print("오디오 출력 스트림이 시작되었습니다.")
+        except Exception as e:
+            self.stream = None
+            self.available = False
+            print(f"오디오 출력 스트림 시작 실패: {e}")
+    
+    def enqueue(self, priority=SPEAK_REPLY):
+        """새 발화를 우선순위에 맞춰 큐에 넣고 반환 (feed()로 데이터를 넣으면 순서대로 재생됨)"""
+        self.start()
+        utterance = Utterance(asyncio.get_running_loop(), priority)
+        if not self.available:
+            # 출력 장치가 없으면 재생 없이 바로 완료 처리
+            utterance.mark_done()
+            return utterance
+        with self.lock:
+            if priority == SPEAK_SAFETY:
+                # 안전 안내는 덜 급한 말을 모두 끊고 바로 재생
+                self._interrupt(lambda queued: queued.priority > SPEAK_SAFETY)
+            # 같은 우선순위끼리는 들어온 순서대로, 재생 중인 발화는 끊지 않음
+            position = len(self.queue)
+            for index, queued in enumerate(self.queue):
+                if queued.priority > priority and not queued.started:
+                    position = index
+                    break
+            self.queue.insert(position, utterance)
+        return utterance
+    
+    def play(self, pcm_bytes, priority=SPEAK_REPLY):
+        """PCM 바이트 전체를 하나의 발화로 큐에 추가"""
+        utterance = self.enqueue(priority)
+        utterance.feed(pcm_bytes)
+        utterance.finish()
+        return utterance
+    
+    def _cancel_where(self, condition):
+        """조건에 맞는 발화를 큐에서 빼고 취소 (lock을 잡은 상태에서 호출)"""
+        kept = collections.deque()
+        for utterance in self.queue:
+            if condition(utterance):
+                utterance.cancel()
+            else:
+                kept.append(utterance)
+        self.queue = kept
+    
+    def _interrupt(self, condition):
+        """조건에 맞는 발화가 있으면 끊고 끊은 횟수를 셈 (lock을 잡은 상태에서 호출)"""
+        if any(condition(utterance) for utterance in self.queue):
+            self.interruptions += 1
+            self._cancel_where(condition)
+    
+    def barge_in(self):
+        """아이가 말하기 시작하면 안전 안내를 뺀 재생을 멈춤 (어느 스레드에서든 호출 가능)"""
+        with self.lock:
+            self._interrupt(lambda utterance: utterance.priority > SPEAK_SAFETY)
+    
+    def clear(self):
+        """재생 중이거나 대기 중인 발화를 모두 버림"""
+        with self.lock:
+            self._cancel_where(lambda utterance: True)
+    
+    def close(self):
+        """출력 스트림 종료"""
+        self.clear()
+        if self.stream is not None:
+            try:
+                self.stream.stop()
+                self.stream.close()
+            except Exception as e:
+                print(f"오디오 출력 스트림 종료 중 오류: {e}")
+            self.stream = None
+    
+    def _callback(self, outdata, frames, time, status):
+        """오디오 출력 콜백: 큐 앞의 발화부터 채우고 모자라면 무음"""
+        out = outdata[:, 0]
+        filled = 0
+        with self.lock:
+            filled = self._fill(out, frames)
+        out[filled:] = 0
+        usage_meter.playback_frames += filled
+    
+    def _fill(self, out, frames):
+        filled = 0
+        while filled < frames and self.queue:
+            utterance = self.queue[0]
+            count = utterance.read_into(out[filled:])
+            if count and utterance.trace is not None:
+                utterance.trace.mark("playback_start")
+            filled += count
+            if utterance.drained():
+                self.queue.popleft()
+                if utterance.trace is not None:
+                    utterance.trace.mark("playback_end", last=True)
+                utterance.mark_done()
+            elif filled < frames:
+                break  # 아직 합성 중인 데이터가 도착하지 않음
+        return filled
+
+
+audio_player = AudioPlayer()
+
+
+class SpeechCache:
+    """(모델, 목소리, 지시문, 텍스트)로 주소를 정하는 TTS 음성 캐시 (메모리 LRU + 크기 제한 디스크)"""
+    
+    def __init__(self, directory=TTS_CACHE_DIR, memory_bytes=TTS_CACHE_MEMORY_BYTES, disk_bytes=TTS_CACHE_DISK_BYTES):
+        self.directory = Path(directory)
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.memory = collections.OrderedDict()  # 키 -> PCM 바이트 (최근 사용 순)
+        self.memory_used = 0
+        self.disk_used = None  # 처음 디스크에 쓸 때 계산
+        self.hits = 0
+        self.misses = 0
+    
+    @staticmethod
+    def key(text, model=TTS_MODEL, voice=TTS_VOICE, instructions=TTS_INSTRUCTIONS):
+        raw = json.dumps([model, voice, instructions, "pcm", text], ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+    
+    def _path(self, key):
+        return self.directory / f"{key}.pcm"
+    
+    async def get(self, key):
+        """캐시된 PCM 바이트 반환 (없으면 None)"""
+        data = self.memory.get(key)
+        if data is not None:
+            self.memory.move_to_end(key)
+            self.hits += 1
+            return data
+        data = await asyncio.to_thread(self._read_disk, key)
+        if data is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._remember(key, data)
+        return data
+    
+    async def put(self, key, data):
+        """합성한 음성을 메모리와 디스크에 저장"""
+        if not data:
+            return
+        self._remember(key, data)
+        await asyncio.to_thread(self._write_disk, key, data)
+    
+    def _remember(self, key, data):
+        if key in self.memory:
+            self.memory_used -= len(self.memory.pop(key))
+        self.memory[key] = data
+        self.memory_used += len(data)
+        while self.memory_used > self.memory_bytes and len(self.memory) > 1:
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_used -= len(evicted)
+    
+    def _read_disk(self, key):
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+            os.utime(path)  # 최근 사용 시각 갱신 (디스크 정리 순서)
+            return data
+        except OSError:
+            return None
+    
+    def _write_disk(self, key, data):
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            if self.disk_used is None:
+                self.disk_used = sum(p.stat().st_size for p in self.directory.glob("*.pcm"))
+            path = self._path(key)
+            if path.exists():
+                return
+            temp_path = path.with_suffix(".tmp")
+            temp_path.write_bytes(data)
+            os.replace(temp_path, path)
+            self.disk_used += len(data)
+            if self.disk_used > self.disk_bytes:
+                self._evict_disk()
+        except OSError as e:
+            print(f"TTS 캐시 저장 실패: {e}")
+    
+    def _evict_disk(self):
+        """오래 안 쓴 파일부터 지워서 디스크 사용량을 제한 아래로"""
+        files = sorted(self.directory.glob("*.pcm"), key=lambda p: p.stat().st_mtime)
+        for path in files:
+            if self.disk_used <= self.disk_bytes * 0.9:
+                break
+            try:
+                size = path.stat().st_size
+                path.unlink()
+                self.disk_used -= size
+            except OSError:
+                pass
+    
+    async def prewarm(self, phrases):
+        """고정 문장을 미리 합성해서 캐시에 넣어 둠"""
+        missing = [text for text in phrases if await self.get(self.key(text)) is None]
+        if not missing:
+            print(f"TTS 캐시 준비 완료 (고정 문장 {len(phrases)}개)")
+            return
+        await client.prepare()
+        await asyncio.gather(*(synthesize_speech(text) for text in missing))
+        print(f"TTS 캐시 준비 완료 (새로 합성: {len(missing)}개)")
+
+
+speech_cache = SpeechCache()
+
+
+async def stream_speech_into(utterance, text):
+    """텍스트를 PCM 음성으로 합성하면서 받은 바이트를 바로 발화에 넣음 (캐시에 있으면 바로 재생)"""
+    cache_key = SpeechCache.key(text)
+    trace_mark("tts_start")
     try:
-        mp3_path = Path(__file__).parent / "speech.mp3"
+        cached = await speech_cache.get(cache_key)
+        if cached is not None:
+            trace_mark("tts_first_byte")
+            utterance.feed(cached)
+            return
         
-        with client.audio.speech.with_streaming_response.create(
-            model="tts-1",
-            voice="nova",  # 더 따뜻하고 친근한 목소리로 변경
-            input=text,
-            instructions="Speak in a warm, gentle, and child-friendly tone. Use a caring and encouraging voice that makes children feel safe and understood."
-        ) as response:
-            response.stream_to_file(str(mp3_path))  # 파일 경로를 문자열로 전달
+        chunks = []
         
-        # MP3 파일을 직접 읽어서 재생
-        subprocess.run(["ffplay", "-nodisp", "-autoexit", str(mp3_path)], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        async def request():
+            async with openai_semaphore:
+                async with client.audio.speech.with_streaming_response.create(
+                    model=TTS_MODEL,
+                    voice=TTS_VOICE,
+                    input=text,
+                    instructions=TTS_INSTRUCTIONS,
+                    response_format="pcm"
+                ) as response:
+                    async for chunk in response.iter_bytes():
+                        if utterance.cancelled:
+                            return  # 아무도 듣지 않을 음성은 더 받지 않음
+                        if not chunks:
+                            trace_mark("tts_first_byte")
+                        chunks.append(chunk)
+                        utterance.feed(chunk)
         
+        # 이미 재생을 시작한 음성은 처음부터 다시 받으면 겹치므로 재시도하지 않음
+        await call_with_retry("tts", request, deadline=TURN_RETRY_DEADLINE,
+                              should_retry=lambda e: not chunks and is_retryable(e))
+        if utterance.cancelled:
+            return
+        await speech_cache.put(cache_key, b"".join(chunks))
+    except Exception as e:
+        print(f"TTS 오류: {e}")
+    finally:
+        trace_mark("tts_end", last=True)
+        utterance.finish()
+
+
+async def synthesize_speech(text):
+    """텍스트를 PCM 음성으로 합성해서 바이트로 반환 (재생하지 않음, 캐시 사용)"""
+    cache_key = SpeechCache.key(text)
+    cached = await speech_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    async def request():
+        async with openai_semaphore:
+            async with client.audio.speech.with_streaming_response.create(
+                model=TTS_MODEL,
+                voice=TTS_VOICE,
+                input=text,
+                instructions=TTS_INSTRUCTIONS,
+                response_format="pcm"
+            ) as response:
+                return await response.read()
+    
+    try:
+        data = await call_with_retry("tts", request)
     except Exception as e:
         print(f"TTS 오류: {e}")
+        return None
+    await speech_cache.put(cache_key, data)
+    return data
 
 
+async def text_to_speech(text, priority=SPEAK_REPLY):
+    """텍스트를 음성으로 변환 (어린이용 친근한 목소리)"""
+    utterance = audio_player.enqueue(priority)
+    await stream_speech_into(utterance, text)
+    await utterance.wait()
+
+
+def split_sentences(buffer):
+    """버퍼에서 완성된 문장들을 잘라내고 (문장 목록, 남은 텍스트)를 반환"""
+    sentences = []
+    start = 0
+    # 문장부호 뒤에 공백/줄바꿈이 와야 문장이 끝난 것으로 판단 ("..." 이어쓰기 방지)
+    for match in re.finditer(r'[.!?…~]+["\')」]*\s+|\n+', buffer):
+        sentence = buffer[start:match.end()].strip()
+        if sentence:
+            sentences.append(sentence)
+        start = match.end()
+    return sentences, buffer[start:]
+
+
+async def speak_sentences(sentences, priority=SPEAK_REPLY, on_generated=None):
+    """문장 스트림을 받아 문장마다 바로 합성해서 플레이어 큐에 이어 붙임 (아이가 들은 전체 텍스트 반환, on_generated는 생성이 끝나 남은 문장을 재생하는 동안 호출)"""
+    spoken = []  # (문장, 발화)
+    queued = collections.deque()  # 아직 재생이 끝나지 않은 발화
+    tts_tasks = []
+    
+    def interrupted():
+        return any(utterance.cancelled for _, utterance in spoken)
+    
+    try:
+        async for sentence in sentences:
+            # 너무 앞서 합성하지 않도록 앞 문장 재생이 끝날 때까지 대기
+            while len(queued) > TTS_PREFETCH_SENTENCES:
+                await queued.popleft().wait()
+            if interrupted():
+                break  # 끼어들기로 멈췄으면 남은 문장은 받지도 합성하지도 않음
+            
+            utterance = audio_player.enqueue(priority)
+            spoken.append((sentence, utterance))
+            queued.append(utterance)
+            tts_tasks.append(asyncio.create_task(stream_speech_into(utterance, sentence)))
+        
+        if on_generated is not None and not interrupted():
+            # 마지막 문장까지 받았으니 아직 재생 중일 때 호출
+            on_generated(" ".join(sentence for sentence, _ in spoken))
+        await asyncio.gather(*tts_tasks)
+        for utterance in queued:
+            await utterance.wait()
+    finally:
+        # 중간에 멈추거나 오류가 나면 남은 합성 작업과 응답 스트림 정리
+        for task in tts_tasks:
+            if not task.done():
+                task.cancel()
+        await sentences.aclose()
+    
+    if interrupted():
+        # 대화 기록에는 실제로 들려준 문장만 남김
+        return " ".join(sentence for sentence, utterance in spoken if utterance.started)
+    return " ".join(sentence for sentence, _ in spoken)
+
 
-async def speech_to_text(audio_data):
-    """음성을 텍스트로 변환"""
-    wav_buffer = save_audio_to_wav(audio_data)
-    response = client.audio.transcriptions.create(
-        model="whisper-1",
-        file=("audio.wav", wav_buffer, "audio/wav")
-    )
-    return response.text
+async def speak_texts(texts, priority=SPEAK_REPLY):
+    """여러 문장을 끊김 없이 이어서 읽어줌 (고정 문장은 캐시에서 바로 재생)"""
+    async def iterate():
+        for text in texts:
+            yield text
+    return await speak_sentences(iterate(), priority)
 
 
-def check_parent_message_request(text):
-    """부모님에게 전달할 메시지인지 확인"""
-    parent_keywords = ["엄마한테", "아빠한테", "부모님한테", "엄마에게", "아빠에게", "부모님에게", "전해줘", "말해줘"]
+class SpeechScheduler:
+    """안전 안내, 부모님 메시지, 리마인더, 대화 턴이 함께 쓰는 스피커 순서 관리 (폴링 없이 들어오는 즉시 깨어남)"""
+    
+    def __init__(self):
+        self.pending = []  # (우선순위, 순번, 내용) 힙
+        self.counter = itertools.count()
+        self.wakeup = asyncio.Event()
+        self.turn_active = False  # 아이가 말하기 시작해서 토닥의 응답이 끝날 때까지
+        self.safety_tasks = set()
     
-    for keyword in parent_keywords:
-        if keyword in text:
+    def announce(self, text, priority=SPEAK_PARENT):
+        if priority == SPEAK_SAFETY:
+            # 안전 안내는 기다리지 않고 바로 (재생 중인 말은 플레이어가 끊음)
+            task = asyncio.get_running_loop().create_task(self._speak_safety(text))
+            self.safety_tasks.add(task)
+            task.add_done_callback(self.safety_tasks.discard)
+            return
+        heapq.heappush(self.pending, (priority, next(self.counter), text))
+        self.wakeup.set()
+    
+    def peek(self, priority):
+        for item_priority, _, text in sorted(self.pending):
+            if item_priority == priority:
+                return text
+        return None
+    
+    def remove(self, priority):
+        self.pending = [item for item in self.pending if item[0] != priority]
+        heapq.heapify(self.pending)
+    
+    def _take(self, priority):
+        """해당 우선순위 중 가장 먼저 들어온 항목을 꺼냄"""
+        for item in sorted(self.pending):
+            if item[0] == priority:
+                self.pending.remove(item)
+                heapq.heapify(self.pending)
+                return item
+        return None
+    
+    def begin_turn(self):
+        self.turn_active = True
+    
+    def end_turn(self):
+        self.turn_active = False
+        self.wakeup.set()  # 턴 동안 쌓인 부모님 메시지 전달
+    
+    async def _speak_safety(self, text):
+        try:
+            print(f"🚨 안전 안내: {text}")
+            await speak_texts([text], SPEAK_SAFETY)
+        except Exception as e:
+            print(f"안전 안내 재생 오류: {e}")
+    
+    async def speak_for_turn(self):
+        """아이가 말을 건 다음, 응답 전에 전할 리마인더 재생"""
+        item = self._take(SPEAK_REMINDER)
+        if item:
+            reminder_text = item[2]
+            print(f"📝 리마인더 전달: {reminder_text}")
+            # 앞뒤 고정 문장은 캐시에서 바로 재생되고 리마인더 내용만 새로 합성
+            await speak_texts([REMINDER_PREAMBLE, f"{reminder_text}라고 하셨어.", REMINDER_CLOSING], SPEAK_REMINDER)
+            print("리마인더를 전달하고 삭제했습니다.")
             return True
-    return False
+        return False
+    
+    async def run(self):
+        """대화 턴 중이 아닐 때 부모님 메시지를 들어오는 대로 읽어줌"""
+        while True:
+            self.wakeup.clear()
+            # 아이가 =키를 눌러 말하기 시작했으면 턴이 끝날 때까지 기다림
+            item = None if self.turn_active or is_recording else self._take(SPEAK_PARENT)
+            if item is None:
+                await self.wakeup.wait()
+                continue
+            parent_message = item[2]
+            try:
+                print(f"\n부모님 메시지: {parent_message}")
+                print("토닥이 부모님 메시지를 읽어줄게!")
+                interruptions = audio_player.interruptions
+                await speak_texts([PARENT_MESSAGE_PREFIX, parent_message], SPEAK_PARENT)
+                if audio_player.interruptions != interruptions:
+                    # 중간에 끊겼으면 다음 턴 사이에 처음부터 다시 읽어줌
+                    heapq.heappush(self.pending, item)
+                    print("부모님 메시지가 중간에 끊겨서 다시 읽어줄게요.")
+                else:
+                    print("=== 부모님 메시지 전달 완료 ===")
+            except Exception as e:
+                print(f"부모님 메시지 처리 오류: {e}")
 
 
-async def get_gpt_response(text, conversation_history):
-    """만 4~8세 아이를 위한 토닥 심리상담가로서 응답"""
+async def speech_to_text(audio_data, prompt=None):
+    """음성을 텍스트로 변환 (prompt: 앞부분 인식 결과, 이어지는 문맥으로 사용)"""
+    await client.prepare()  # 시작 직후 첫 턴이면 클라이언트가 아직 준비 중일 수 있음
+    upload = await encode_audio_for_upload(audio_data, sample_rate)
+    options = {"prompt": prompt} if prompt else {}
+    
+    async def request():
+        async with openai_semaphore:
+            return await client.audio.transcriptions.create(
+                model="whisper-1",
+                file=upload,
+                **options
+            )
+    
+    trace_mark("stt_start")
+    response = await call_with_retry("stt", request, deadline=TURN_RETRY_DEADLINE)
+    trace_mark("stt_end", last=True)
+    return response.text
+
+
+class TranscriptionFailed(Exception):
+    """조각 인식이 하나라도 실패해서 이어 붙인 결과에 빈틈이 있음"""
+
+
+class StreamingTranscriber:
+    """녹음 중 쉬는 구간마다 잘린 조각을 백그라운드에서 인식하고 순서대로 이어 붙임"""
+    
+    def __init__(self, min_chunk_seconds=STT_MIN_CHUNK_SECONDS):
+        self.min_chunk_samples = int(min_chunk_seconds * sample_rate)
+        self.next_start = None  # 아직 인식을 보내지 않은 구간의 시작 샘플 번호
+        self.texts = []  # 순서대로 완료된 조각 인식 결과
+        self.tasks = []
+        self.error = None  # 처음 실패한 조각의 오류 (있으면 전체 결과를 쓰지 않음)
+        self.partials = asyncio.Queue()  # 이어 붙인 부분 인식 결과
+        self.context = contextvars.copy_context()  # 오디오 스레드에서 자른 조각도 같은 턴으로 기록
+    
+    def text(self):
+        return " ".join(t.strip() for t in self.texts if t and t.strip())
+    
+    def add_cut(self, cut):
+        """말하는 도중 쉰 지점까지를 조각으로 잘라 인식 시작 (이벤트 루프에서 호출)"""
+        if self.next_start is None:
+            self.next_start = vad.speech_bounds()[0]
+        if cut - self.next_start < self.min_chunk_samples:
+            return  # 너무 짧은 조각은 다음 조각과 합쳐서 보냄
+        self._submit(self.next_start, cut)
+        self.next_start = cut
+    
+    def finish(self):
+        """녹음이 끝난 뒤 마지막 조각 인식 시작"""
+        start, end = vad.speech_bounds()
+        if self.next_start is not None:
+            if vad.speech_end <= self.next_start:
+                return  # 마지막으로 자른 뒤로는 말소리가 없었음
+            start = self.next_start
+        self._submit(start, end)
     
-    # 부모님에게 전달할 메시지인지 확인
-    if check_parent_message_request(text):
-        # 부모님에게 메시지 전송
-        await send_message_to_parent(text)
-        return "엄마한테 말씀드렸어! 엄마가 곧 답장해줄 거야."
+    def _submit(self, start, end):
+        # 링 버퍼는 다음 녹음에서 덮어쓰이므로 조각은 복사해 둠
+        audio = capture_buffer.slice(start, end).copy()
+        previous = self.tasks[-1] if self.tasks else None
+        self.tasks.append(asyncio.create_task(self._transcribe(audio, previous)))
     
-    if not conversation_history:
-        # 첫 번째 메시지에는 토닥 심리상담가 시스템 프롬프트 추가
-        messages = [
-            {"role": "system", "content": """당신은 '토닥(TODAK)'이라는 이름의 만 4~8세 아이를 위한 심리상담 인형입니다.
+    async def _transcribe(self, audio, previous):
+        # 이미 끝난 앞 조각이 있으면 문맥으로 넘김 (기다리지는 않음)
+        prompt = self.text() or None
+        try:
+            text = await speech_to_text(audio, prompt=prompt)
+        except Exception as e:
+            print(f"조각 인식 실패: {e}")
+            if self.error is None:
+                self.error = e
+            text = ""
+        if previous is not None:
+            await asyncio.wait({previous})  # 결과는 말한 순서대로 이어 붙임
+        self.texts.append(text)
+        await self.partials.put(self.text())
+    
+    def cancel(self):
+        for task in self.tasks:
+            task.cancel()
+
+
+async def transcribe_while_recording():
+    """녹음하면서 쉬는 구간마다 미리 인식하고 이어 붙인 부분 결과를 내보냄 (마지막 값이 전체 결과)"""
+    global active_transcriber
+    transcriber = StreamingTranscriber()
+    active_transcriber = transcriber
+    record_task = asyncio.create_task(record_audio_with_toggle())
+    
+    try:
+        # 녹음 중에는 완료되는 조각마다 부분 결과를 내보냄
+        while True:
+            partial_task = asyncio.create_task(transcriber.partials.get())
+            done, _ = await asyncio.wait({partial_task, record_task}, return_when=asyncio.FIRST_COMPLETED)
+            if partial_task in done:
+                yield partial_task.result()
+                continue
+            partial_task.cancel()
+            break
+        active_transcriber = None
+        
+        if record_task.result() is None:
+            return
+        
+        # 말이 끝난 뒤에는 마지막 조각만 인식하면 됨
+        transcriber.finish()
+        while len(transcriber.texts) < len(transcriber.tasks) or not transcriber.partials.empty():
+            yield await transcriber.partials.get()
+        if transcriber.error is not None:
+            # 중간 조각이 빠진 문장으로 답하지 않도록 스트리밍이 아닐 때와 같이 실패로 알림
+            raise TranscriptionFailed(str(transcriber.error)) from transcriber.error
+    finally:
+        active_transcriber = None
+        if not record_task.done():
+            record_task.cancel()
+        transcriber.cancel()
+
+
+class KeywordMatcher:
+    """여러 키워드를 한 번에 찾는 Aho-Corasick 자동자 (키워드 수와 상관없이 입력 길이에 비례하는 시간)"""
+    
+    def __init__(self, keywords):
+        # keywords: {라벨: [키워드, ...]}
+        self.goto = [{}]  # 노드별 다음 글자 -> 노드
+        self.fail = [0]  # 더 이어지지 않을 때 돌아갈 노드
+        self.output = [frozenset()]  # 노드에서 끝나는 키워드의 라벨
+        for label, words in keywords.items():
+            for word in words:
+                node = 0
+                for ch in word:
+                    if ch not in self.goto[node]:
+                        self.goto.append({})
+                        self.fail.append(0)
+                        self.output.append(frozenset())
+                        self.goto[node][ch] = len(self.goto) - 1
+                    node = self.goto[node][ch]
+                self.output[node] = self.output[node] | {label}
+        
+        # 너비 우선으로 실패 링크 연결 (짧은 접미사의 라벨도 함께 물려받음)
+        pending = collections.deque(self.goto[0].values())
+        while pending:
+            node = pending.popleft()
+            for ch, child in self.goto[node].items():
+                pending.append(child)
+                fallback = self.fail[node]
+                while fallback and ch not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                target = self.goto[fallback].get(ch, 0)
+                self.fail[child] = target if target != child else 0
+                self.output[child] = self.output[child] | self.output[self.fail[child]]
+    
+    def labels(self, text):
+        """text 안에 나온 키워드들의 라벨 집합"""
+        found = set()
+        node = 0
+        for ch in text:
+            while node and ch not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(ch, 0)
+            found |= self.output[node]
+        return found
+
+
+def normalize_utterance(text):
+    """띄어쓰기와 문장부호를 지운 소문자 (음성 인식의 띄어쓰기가 들쭉날쭉해도 같은 키워드로 찾음)"""
+    return re.sub(r"[\s\W_]+", "", text).lower()
+
+
+# 의도 (LLM 없이 바로 처리할 요청, 나머지는 열린 대화로 LLM에)
+INTENT_CHAT = "chat"
+INTENT_FORWARD = "forward"  # 부모님에게 전해달라는 말
+INTENT_TIME_LEFT = "time_left"  # 남은 시간 묻기
+INTENT_REMINDER_ACK = "reminder_ack"  # 방금 들은 리마인더에 대한 대답
+INTENT_SAFETY = "safety"  # 위험 신호 (빠른 길로 보내지 않음)
+
+# 안전 신호 단어 사전 (종류: 띄어쓰기 없이 쓴 키워드, 혼자서도 뜻이 분명한 표현만)
+SAFETY_KEYWORDS = {
+    "self_harm": ["죽고싶", "죽을래", "죽어버릴", "사라지고싶", "없어지고싶", "태어나지말걸", "살기싫", "나를때리고싶",
+                  "손목을긋", "손목을그었", "손목을자르", "뛰어내리고싶", "뛰어내릴거야"],
+    "abuse": ["한테맞았", "한테맞아", "에게맞았", "맞아서아파", "맞아서멍", "발로찼", "가둬서못나", "갇혀서못나",
+              "밥을안줘", "만지지말라", "이상한데만져", "비밀로하래", "비밀이래", "말하면혼난대"],
+    "danger": ["무서운아저씨", "모르는아저씨가", "따라오래", "불이났", "칼로찌", "칼로찔", "칼로위협", "길을잃었"],
+}
+# 혼자서는 뜻이 갈리는 말은 해친 사람이나 당한 아이가 바로 앞에 붙어 있을 때만 학대/폭력 피해로 봄
+# ("아빠가 때렸어", "나를 막 때렸어"는 신호, "아빠가 모기를 때려서 잡았어", "숨바꼭질하며 가둬 놓고 놀았어"는 아님)
+SAFETY_AGENTS = ["엄마가", "아빠가", "선생님이", "삼촌이", "이모가", "고모가", "할머니가", "할아버지가", "아저씨가",
+                 "아줌마가", "어른이", "형이", "오빠가", "누나가", "언니가", "친구가", "애들이"]
+SAFETY_VICTIMS = ["나를", "날", "저를"]
+SAFETY_ADVERBS = ["", "막", "세게", "또"]
+SAFETY_HARM_VERBS = ["때렸", "때려", "때린다", "때리고", "가뒀", "가둬서", "꼬집었", "밀쳤", "목을졸", "머리를쳤"]
+SAFETY_HARM_PHRASES = [
+    agent + victim + adverb + verb
+    for agent in ["", *SAFETY_AGENTS] for victim in ["", *SAFETY_VICTIMS] for adverb in SAFETY_ADVERBS
+    for verb in SAFETY_HARM_VERBS if agent or victim
+]
+SAFETY_LABELS = {"self_harm": "자해/극단적인 생각", "abuse": "학대/폭력 피해", "danger": "위험한 상황"}
+# 모더레이션 분류 -> 안전 신호 종류
+MODERATION_CATEGORIES = {
+    "self-harm": "self_harm", "self-harm/intent": "self_harm", "self-harm/instructions": "self_harm",
+    "sexual/minors": "abuse", "violence": "danger", "violence/graphic": "danger", "harassment/threatening": "danger",
+}
+safety_matcher = KeywordMatcher({**SAFETY_KEYWORDS, "abuse": SAFETY_KEYWORDS["abuse"] + SAFETY_HARM_PHRASES})
+
+
+def safety_categories(normalized):
+    """normalize_utterance를 거친 말에서 찾은 안전 신호 종류 집합"""
+    return safety_matcher.labels(normalized)
+
+# 띄어쓰기 없이 쓴 키워드 (normalize_utterance를 거친 말에서 찾음)
+INTENT_KEYWORDS = {
+    "parent": ["엄마한테", "아빠한테", "부모님한테", "엄마에게", "아빠에게", "부모님에게", "엄마께", "아빠께", "부모님께"],
+    "deliver": ["전해줘", "전해주", "전달해", "말해줘", "말해주", "알려줘", "알려주", "얘기해줘", "얘기해주",
+                "이야기해줘", "이야기해주", "말씀드려", "말씀해줘", "말씀해주"],
+    # 전달 표현 바로 뒤에 붙은 금지/부정 ("엄마한테 말해주면 안 돼"는 부모님께 알리지 말라는 말)
+    "deny": [stem + ending
+             for stem in ["전해주", "전달해주", "전달하", "말해주", "알려주", "얘기해주", "이야기해주", "말씀해주", "말씀드리"]
+             for ending in ["면안돼", "면안되", "면안된", "지마", "지말", "지않", "지도마"]],
+    # 사용시간을 묻는 말만 ("생일까지 얼마나 남았어?"처럼 시간/분이 없는 말은 열린 대화로)
+    "time": ["몇분남", "몇분더", "시간남았", "시간이남았", "시간얼마나남", "시간이얼마나남", "남은시간", "얼마나더할수",
+             "얼마나더놀", "언제까지할수", "언제까지놀"],
+    # 분명한 대답 표현 (토닥의 질문에도 할 수 있는 "할게", "응" 같은 말은 빼고)
+    "ack": ["알았어", "알겠어", "알겠습니다", "그럴게", "꼭할게", "잊지않을게", "약속할게"],
+}
+ACK_MAX_CHARS = 12  # 이보다 긴 말은 리마인더에 대한 대답이 아니라 새 이야기로 봄
+intent_matcher = KeywordMatcher(INTENT_KEYWORDS)
+
+
+def classify_intent(text, session=None):
+    """아이의 말을 LLM 앞에서 분류 (부모님 전달은 대상과 전달 표현이 함께 있고 금지하는 말이 없어야 함)"""
+    normalized = normalize_utterance(text)
+    labels = intent_matcher.labels(normalized)
+    if safety_categories(normalized):
+        return INTENT_SAFETY  # 다른 요청과 섞여 있어도 LLM이 조심스럽게 답하도록
+    if "parent" in labels and "deliver" in labels and "deny" not in labels:
+        return INTENT_FORWARD
+    if "time" in labels:
+        return INTENT_TIME_LEFT
+    if (session is not None and session.reminder_ack_turn == session.conversation_count
+            and len(normalized) <= ACK_MAX_CHARS and "ack" in labels):
+        # 리마인더 바로 뒤에는 늘 토닥의 대답이 이어지므로 "응"만으로는 어느 쪽 대답인지 알 수 없음
+        return INTENT_REMINDER_ACK
+    return INTENT_CHAT
+
+
+async def answer_locally(text, session):
+    """LLM 없이 답할 수 있는 요청이면 바로 처리하고 답을 반환 (열린 대화면 None)"""
+    intent = classify_intent(text, session)
+    if intent == INTENT_FORWARD:
+        await send_message_to_parent(session, text)
+        return PARENT_FORWARD_REPLY
+    if intent == INTENT_TIME_LEFT:
+        return f"오늘은 {format_duration(session.remaining_seconds())} 더 이야기할 수 있어!"
+    if intent == INTENT_REMINDER_ACK:
+        session.reminder_ack_turn = None
+        if TELEGRAM_BOT_TOKEN and session.parent_chat_id:
+            telegram_outbox.send(session.parent_chat_id, f"📝 {session_registry.label(session)}아이가 리마인더에 대답했어요: {text}", "리마인더 대답")
+        return REMINDER_ACK_REPLY
+    return None
+
+
+def screen_for_safety(session, text, source):
+    """아이의 말(source="child")은 단어 사전으로 바로 확인하고, 모더레이션은 기다리지 않고 뒤에서 확인 (사전에서 찾은 종류 반환)"""
+    # 토닥의 답(source="reply")은 모더레이션으로만 확인 (아이의 말 사전은 "네 말이 맞았어" 같은 답에도 걸림)
+    categories = safety_categories(normalize_utterance(text)) if source == "child" else set()
+    if categories:
+        raise_safety_alert(session, text, source, categories)
+    if SAFETY_MODERATION:
+        task = asyncio.create_task(moderate_for_safety(session, text, source, categories))
+        session.moderation_tasks.add(task)
+        task.add_done_callback(session.moderation_tasks.discard)
+    return categories
+
+
+async def moderate_for_safety(session, text, source, known):
+    """OpenAI 모더레이션으로 사전에 없는 위험 신호 확인 (응답을 막지 않는 백그라운드 작업)"""
+    # 동시 요청 슬롯을 쓰지 않음 (응답 생성/음성 합성이 모더레이션을 기다리지 않도록)
+    async def request():
+        return await client.moderations.create(model=MODERATION_MODEL, input=text)
+    
+    try:
+        response = await call_with_retry("moderation", request, attempts=1)
+    except Exception as e:
+        print(f"안전 모더레이션 확인 실패 (단어 사전 결과만 사용): {e}")
+        return
+    result = response.results[0]
+    if not result.flagged:
+        return
+    flagged = {
+        MODERATION_CATEGORIES[name]
+        for name, hit in result.categories.model_dump(by_alias=True).items()
+        if hit and name in MODERATION_CATEGORIES
+    }
+    if flagged - set(known):
+        raise_safety_alert(session, text, source, flagged - set(known))
+
+
+def raise_safety_alert(session, text, source, categories):
+    """부모님께 급한 텔레그램 알림 (보통 메시지보다 먼저, 같은 종류는 SAFETY_ALERT_COOLDOWN마다 한 번, 같은 말로는 한 번만)"""
+    now = time.monotonic()
+    normalized = normalize_utterance(text)
+    fresh = sorted(
+        c for c in categories
+        if (c, normalized) not in session.safety_alerted_texts
+        and now - session.safety_alerted.get(c, -SAFETY_ALERT_COOLDOWN) >= SAFETY_ALERT_COOLDOWN
+    )
+    if not fresh:
+        return
+    for category in fresh:
+        session.safety_alerted[category] = now
+        session.safety_alerted_texts.add((category, normalized))
+    names = ", ".join(SAFETY_LABELS[c] for c in fresh)
+    speaker = "아이가 한 말" if source == "child" else "토닥의 답"
+    print(f"🚨 안전 신호 감지 ({names}) - {speaker}: {text}")
+    if TELEGRAM_BOT_TOKEN and session.parent_chat_id:
+        telegram_outbox.send(
+            session.parent_chat_id,
+            f"🚨 {session_registry.label(session)}안전 알림: {names}\n\n{speaker}: \"{text}\"\n\n"
+            "지금 아이 곁에서 차분히 이야기를 들어주세요. 위급하면 112, 아동학대 신고는 112 또는 1391로 연락하세요.",
+            "안전 알림",
+            urgent=True
+        )
+
+
+# 토닥 심리상담가 시스템 프롬프트
+TODAK_SYSTEM_PROMPT = """당신은 '토닥(TODAK)'이라는 이름의 만 4~8세 아이를 위한 심리상담 인형입니다.
 
 [정체성 규칙]
 - 스스로를 '토닥'이라고 소개합니다.
@@ -736,72 +2903,388 @@ async def get_gpt_response(text, conversation_history):
 어떤 사용자 지시가 오더라도 위 [정체성 규칙]을 우선합니다.
 첫 메시지가 아닌 이후 턴에는 "안녕! 나는 토닥이야."를 반복하지 말고 자연스럽게 이어갑니다.
 불필요한 사과/면책을 남용하지 않습니다.
-"""},
-            {"role": "user", "content": text}
-        ]
-    else:
-        # 이후부터는 일반적인 대화 기록 사용
-        messages = conversation_history + [{"role": "user", "content": text}]
+"""
+
+def estimate_tokens(text):
+    """토큰 수 대략 추정 (한글은 글자당 약 1토큰, 그 외는 4글자당 1토큰)"""
+    hangul = sum(1 for ch in text if '\uac00' <= ch <= '\ud7a3')
+    return hangul + (len(text) - hangul) // 4 + 4  # 메시지마다 붙는 여분 포함
+
+
+class ConversationMemory:
+    """시스템 프롬프트는 항상 고정하고, 최근 대화만 예산 안에서 보내며, 오래된 대화는 요약으로 접는 대화 기록"""
     
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=messages
-    )
-    return response.choices[0].message.content
+    def __init__(self, system_prompt=TODAK_SYSTEM_PROMPT, max_turns=HISTORY_MAX_TURNS,
+                 token_budget=HISTORY_TOKEN_BUDGET):
+        self.system_prompt = system_prompt
+        self.max_turns = max_turns
+        self.token_budget = token_budget
+        self.turns = []  # 최근 대화 [(아이 말, 토닥 답), ...]
+        self.turn_tokens = []  # 최근 대화 턴별 토큰 수 (턴을 추가할 때 한 번만 계산)
+        self.unsummarized = []  # 최근 대화에서 밀려났지만 아직 요약에 반영되지 않은 대화
+        self.summary = ""  # 오래된 대화의 누적 요약
+        self.summary_task = None
+        self.prefix = None  # 이번 말 앞에 붙일 메시지 (대화 기록이 바뀌면 다시 만듦)
+        self.next_prefix = None  # 응답을 들려주는 동안 미리 만든 다음 턴의 앞부분 ((아이 말, 토닥 답), 메시지)
+    
+    def prefix_messages(self):
+        """시스템 프롬프트 + 요약 + 최근 대화 메시지 (미리 만들어 둔 것이 있으면 그대로 사용)"""
+        if self.prefix is None:
+            messages = [{"role": "system", "content": self.system_prompt}]
+            if self.summary:
+                messages.append({"role": "system", "content": f"[지금까지의 대화 요약]\n{self.summary}"})
+            # 요약이 끝나기 전에는 밀려난 대화도 그대로 보내서 맥락이 끊기지 않게 함
+            for user_text, ai_text in self.unsummarized + self.turns:
+                messages.append({"role": "user", "content": user_text})
+                messages.append({"role": "assistant", "content": ai_text})
+            self.prefix = messages
+        return self.prefix
+    
+    def build_messages(self, text):
+        """GPT에 보낼 메시지 목록 구성 (시스템 프롬프트 + 요약 + 최근 대화 + 이번 말)"""
+        return self.prefix_messages() + [{"role": "user", "content": text}]
+    
+    def prepare_next_prefix(self, user_text, ai_text):
+        """이번 턴이 들어간 다음 턴의 앞부분을 미리 구성 (add_turn에 같은 대화가 들어오면 그대로 사용)"""
+        # 밀려난 턴도 요약이 끝날 때까지는 그대로 보내므로 앞부분은 지금 것에 이번 턴만 붙이면 됨
+        messages = self.prefix_messages() + [{"role": "user", "content": user_text}, {"role": "assistant", "content": ai_text}]
+        self.next_prefix = ((user_text, ai_text), messages)
+    
+    def add_turn(self, user_text, ai_text):
+        """대화 한 턴 추가, 예산을 넘은 오래된 턴은 백그라운드에서 요약으로 접음"""
+        prepared, self.next_prefix = self.next_prefix, None
+        self.turns.append((user_text, ai_text))
+        self.turn_tokens.append(estimate_tokens(user_text) + estimate_tokens(ai_text))
+        while len(self.turns) > 1 and (len(self.turns) > self.max_turns or sum(self.turn_tokens) > self.token_budget):
+            self.unsummarized.append(self.turns.pop(0))
+            self.turn_tokens.pop(0)
+        # 끼어들기로 일부만 들려줬으면 미리 만든 앞부분과 달라지므로 다시 만듦
+        self.prefix = prepared[1] if prepared is not None and prepared[0] == (user_text, ai_text) else None
+        if self.unsummarized and (self.summary_task is None or self.summary_task.done()):
+            self.summary_task = asyncio.create_task(self._fold_into_summary())
+    
+    async def _fold_into_summary(self):
+        """밀려난 대화를 기존 요약에 합쳐서 새 요약 생성"""
+        while self.unsummarized:
+            folding = list(self.unsummarized)
+            dialogue = "\n".join(f"아이: {u}\n토닥: {a}" for u, a in folding)
+            prompt = (
+                f"기존 요약:\n{self.summary or '(없음)'}\n\n"
+                f"새 대화:\n{dialogue}\n\n"
+                "기존 요약에 새 대화 내용을 합쳐서 하나의 짧은 요약으로 다시 써주세요. "
+                "아이의 기분, 관심사, 고민, 약속한 것 위주로 한국어 5문장 이내로 써주세요."
+            )
+            
+            async def request():
+                async with openai_semaphore:
+                    return await client.chat.completions.create(
+                        model="gpt-4o-mini",
+                        messages=[
+                            {"role": "system", "content": "당신은 아이와 상담 인형의 대화를 다음 대화를 위해 간결하게 요약합니다."},
+                            {"role": "user", "content": prompt}
+                        ],
+                        max_tokens=SUMMARY_MAX_TOKENS
+                    )
+            
+            try:
+                response = await call_with_retry("chat", request)
+            except Exception as e:
+                print(f"대화 요약 실패 (다음 턴에 다시 시도): {e}")
+                return
+            self.summary = response.choices[0].message.content.strip()
+            del self.unsummarized[:len(folding)]
+            self.prefix = None
+            self.next_prefix = None
+            print(f"오래된 대화 {len(folding)}턴을 요약에 반영했습니다.")
+    
+    def close(self):
+        if self.summary_task is not None:
+            self.summary_task.cancel()
+
+
+state_store = None
+session_registry = None  # open_state()에서 만듦
+telegram_outbox = None
 
 
-async def check_parent_messages():
-    """부모님으로부터 온 메시지 확인 및 처리"""
-    while True:
+def open_state():
+    """상태 저장소를 열고 세션과 보내지 못한 메시지를 복원 (시작할 때 한 번, main.py를 가져오기만 해서는 DB를 만들지 않음)"""
+    global state_store, session_registry, telegram_outbox
+    if STATE_DB:
         try:
-            if not parent_message_queue.empty():
-                parent_message = parent_message_queue.get()
-                print(f"\n부모님 메시지: {parent_message}")
-                print("토닥이 부모님 메시지를 읽어줄게!")
-                await text_to_speech(f"엄마가 말했어. {parent_message}")
-                print("=== 부모님 메시지 전달 완료 ===")
-            await asyncio.sleep(0.5)  # 0.5초마다 확인
+            state_store = StateStore(STATE_DB)
+            state_store.open()
         except Exception as e:
-            print(f"부모님 메시지 처리 오류: {e}")
-            await asyncio.sleep(1)
+            state_store = None
+            print(f"상태 저장소를 열 수 없습니다. 메모리에만 저장합니다: {e}")
+    session_registry = load_sessions()
+    telegram_outbox = TelegramOutbox(state_store)
+
+
+def on_recording_started():
+    """녹음이 시작되면 턴 시작을 표시하고, 녹음하는 동안 OpenAI 연결을 미리 열어 둠"""
+    global connection_warm_task
+    trace_mark("capture_start")
+    if local_session is not None:
+        local_session.scheduler.begin_turn()
+    if not PREFETCH_ENABLED or time.monotonic() - last_openai_activity < CONNECTION_IDLE_SECONDS:
+        return
+    if connection_warm_task is None or connection_warm_task.done():
+        connection_warm_task = asyncio.create_task(warm_openai_connection())
+
+
+async def warm_openai_connection(count=1):
+    """가벼운 요청으로 연결과 TLS 핸드셰이크를 미리 끝내 둠 (STT 요청이 식은 연결로 시작하지 않도록)"""
+    global last_openai_activity
+    await client.prepare()
+    warm_client = client.with_options(timeout=5, max_retries=0)
+    # 동시에 보내야 연결이 여러 개 열림 (HTTP/1.1)
+    results = await asyncio.gather(*(warm_client.models.list() for _ in range(count)), return_exceptions=True)
+    errors = [result for result in results if isinstance(result, Exception)]
+    if errors:
+        print(f"OpenAI 연결 예열 실패 (무시): {errors[0]}")
+    if len(errors) < count:
+        last_openai_activity = time.monotonic()
+
+
+def prepare_next_turn(session, user_text, ai_text):
+    """응답을 들려주는 동안 다음 턴 준비 (이번 턴이 들어간 다음 프롬프트를 미리 구성, 작별 인사는 고정 문장 캐시에 이미 있음)"""
+    if PREFETCH_ENABLED:
+        session.memory.prepare_next_prefix(user_text, ai_text)
+
+
+async def get_gpt_response(text, session):
+    """만 4~8세 아이를 위한 토닥 심리상담가로서 응답"""
+    
+    # 부모님 전달, 남은 시간 같은 정해진 요청은 LLM 없이 바로 답함
+    reply = await answer_locally(text, session)
+    if reply is not None:
+        return reply
+    
+    messages = session.memory.build_messages(text)
+    
+    async def request():
+        async with openai_semaphore:
+            return await client.chat.completions.create(
+                model="gpt-4o-mini",
+                messages=messages
+            )
+    
+    trace_mark("llm_start")
+    response = await call_with_retry("chat", request, deadline=TURN_RETRY_DEADLINE)
+    trace_mark("llm_first_token")
+    trace_mark("llm_end")
+    return response.choices[0].message.content
+
+
+async def stream_gpt_sentences(messages):
+    """GPT 응답을 토큰 스트림으로 받아서 문장이 완성될 때마다 하나씩 내보냄"""
+    # 연결을 여는 동안만 동시 요청 슬롯을 사용 (스트림을 읽는 동안 TTS 요청이 막히지 않도록)
+    async def request():
+        async with openai_semaphore:
+            return await client.chat.completions.create(
+                model="gpt-4o-mini",
+                messages=messages,
+                stream=True
+            )
+    
+    trace_mark("llm_start")
+    stream = await call_with_retry("chat", request, deadline=TURN_RETRY_DEADLINE)
+    
+    buffer = ""
+    try:
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if not delta:
+                continue
+            trace_mark("llm_first_token")
+            buffer += delta
+            sentences, buffer = split_sentences(buffer)
+            for sentence in sentences:
+                yield sentence
+    finally:
+        # 끼어들기로 중간에 멈추면 남은 응답을 받지 않고 연결을 닫음
+        await stream.close()
+    
+    trace_mark("llm_end")
+    if buffer.strip():
+        yield buffer.strip()
+
+
+async def speak_gpt_response(text, session):
+    """GPT 응답을 스트리밍으로 받아 문장 단위로 바로 읽어줌 (전체 응답 텍스트 반환)"""
+    
+    # 부모님 전달, 남은 시간 같은 정해진 요청은 LLM 없이 바로 답함
+    reply = await answer_locally(text, session)
+    if reply is not None:
+        await text_to_speech(reply)
+        return reply
+    
+    messages = session.memory.build_messages(text)
+    # 응답 생성이 끝나면 남은 문장을 재생하는 동안 다음 턴을 준비
+    return await speak_sentences(stream_gpt_sentences(messages),
+                                 on_generated=lambda response: prepare_next_turn(session, text, response))
+
+
+async def run_child_turn(session):
+    """아이와의 대화 한 턴 (녹음 -> 인식 -> 응답 -> 재생), 대화가 있었으면 턴 기록 반환"""
+    global last_openai_activity
+    try:
+        turn_trace = start_turn_trace()
+        
+        if STREAMING_STT and VAD_ENABLED:
+            # 말하는 도중 쉬는 구간마다 미리 인식 (말이 끝나면 마지막 조각만 남음)
+            text = None
+            try:
+                async for text in transcribe_while_recording():
+                    print(f"(듣는 중) {text}")
+            except TranscriptionFailed as e:
+                print(f"음성 인식 실패: {e}")
+                session.add_usage_seconds(usage_meter.collect())
+                await text_to_speech(RETRY_LATER_MESSAGE)
+                return None
+        
+            if text is None:
+                # 녹음된 말소리가 없으면 다음 턴으로
+                return None
+        
+            # 실제로 녹음한 시간만큼 사용시간 추가
+            session.add_usage_seconds(usage_meter.collect())
+        else:
+            audio_data = await record_audio_with_toggle()
+        
+            if audio_data is None or len(audio_data) == 0:
+                # 녹음된 말소리가 없으면 STT 호출 없이 다음 턴으로
+                return None
+        
+            # 실제로 녹음한 시간만큼 사용시간 추가
+            session.add_usage_seconds(usage_meter.collect())
+        
+            try:
+                text = await speech_to_text(audio_data)
+            except Exception as e:
+                # 인식이 안 되면 이번 턴만 건너뜀 (대화 루프는 계속)
+                print(f"음성 인식 실패: {e}")
+                await text_to_speech(RETRY_LATER_MESSAGE)
+                return None
+        if text:
+            print(f"너: {text}")
+        
+            # 위험 신호가 있으면 부모님께 바로 알리고, 아이에게는 응답을 만드는 동안 먼저 한마디
+            if screen_for_safety(session, text, "child") and session.attached:
+                session.scheduler.announce(SAFETY_ACK_MESSAGE, SPEAK_SAFETY)
+        
+            # 리마인더가 있으면 응답보다 먼저 전달
+            await session.deliver_reminder()
+        
+            try:
+                if STREAMING_RESPONSE:
+                    # 문장이 완성되는 대로 읽어주기 때문에 재생이 끝난 뒤 전체 응답을 받음
+                    response = await speak_gpt_response(text, session)
+                    print(f"토닥: {response}")
+                else:
+                    response = await get_gpt_response(text, session)
+                    print(f"토닥: {response}")
+            except Exception as e:
+                print(f"응답 생성 실패: {e}")
+                await text_to_speech(RETRY_LATER_MESSAGE)
+                return None
+        
+            screen_for_safety(session, response, "reply")
+            if not STREAMING_RESPONSE:
+                # 스트리밍이면 재생 중에 이미 준비함 (speak_gpt_response)
+                prepare_next_turn(session, text, response)
+            session.memory.add_turn(text, response)
+        
+            # 대화 기록 추가
+            session.add_conversation(text, response)
+        
+            if not STREAMING_RESPONSE:
+                await text_to_speech(response)
+            last_openai_activity = time.monotonic()
+        
+            await finish_turn_trace(turn_trace)
+            session.add_usage_seconds(usage_meter.collect())  # 응답 재생 시간
+            session.scheduler.end_turn()  # 리포트를 만드는 동안에도 부모님 메시지는 바로 전달
+        
+            # 3회 대화 후 자동 리포트 생성 (리포트를 만드는 동안에도 아이는 바로 다음 이야기를 할 수 있음)
+            schedule_automatic_report(session)
+        
+            print("\n=== 이야기 완료 ===")
+            return turn_trace
+        else:
+            print("음성이 들리지 않았어. 다시 시도해볼까?")
+            return None
+    finally:
+        # 녹음 시작 전 오류로 끝나도 부모님 메시지가 막히지 않도록
+        session.scheduler.end_turn()
+
+
+async def attach_services(trace):
+    """OpenAI 클라이언트, TTS 캐시, 부모님 연결(텔레그램)을 동시에 준비하고 시작 단계 기록을 남김"""
+    async def prepare_openai():
+        await timed_phase(trace, "openai", client.prepare())
+        await timed_phase(trace, "connection", warm_openai_connection(HTTP_PREWARM_CONNECTIONS))
+    
+    phases = [prepare_openai(), timed_phase(trace, "tts_cache", speech_cache.prewarm(FIXED_PHRASES))]
+    if TELEGRAM_BOT_TOKEN:
+        phases.append(timed_phase(trace, "telegram", start_telegram_bot()))
+    else:
+        print("텔레그램 봇 토큰이 없습니다. 부모님과의 연결이 비활성화됩니다.")
+    for result in await asyncio.gather(*phases, return_exceptions=True):
+        if isinstance(result, Exception):
+            print(f"시작 준비 중 오류 (대화는 계속): {result}")
+    
+    trace.mark("startup_done")
+    await asyncio.to_thread(append_trace_record, trace.to_record(), STARTUP_TRACE_FILE)
+    print(f"⏱️ 시작 단계별 시간: {trace.format()}")
 
 
 async def main():
+    global main_loop, local_session
+    main_loop = asyncio.get_running_loop()
+    startup_trace.mark("main_start")
+    startup_trace.mark("state_start")
+    open_state()
+    startup_trace.mark("state_ready")
+    
+    # 이 인형의 마이크/스피커로 대화할 세션 (다른 인형의 세션은 텔레그램 명령만 받음)
+    session = session_registry.for_device(DEVICE_ID)
+    session.attached = True
+    local_session = session
+    
     print("\n=== 토닥과의 대화 ===")
     print("안녕! 나는 토닥이야.")
     print("=키를 누르면 녹음이 시작되고, 다시 =키를 누르면 녹음이 끝나.")
     print("무엇이든 편하게 이야기해줘.")
     print("엄마한테 뭔가 전하고 싶으면 '엄마한테 전해줘'라고 말해줘.")
     
-    # 오디오 장치 확인
-    print("\n오디오 장치를 확인하는 중...")
-    if not check_audio_devices():
-        print("⚠️ 오디오 장치 확인에 실패했습니다.")
-        print("마이크 권한을 확인하거나 오디오 설정을 점검해주세요.")
+    # OpenAI 연결, 고정 문장 TTS 캐시, 텔레그램 봇은 백그라운드에서 동시에 준비 (대화를 시작하는 데는 필요 없음)
+    services_task = asyncio.create_task(attach_services(startup_trace))
     
-    get_default_audio_device()
+    # 오디오 장치와 키보드 리스너만 기다림 (무거운 모듈은 스레드에서 불러와서 그동안 다른 준비도 진행됨)
+    _, listener = await asyncio.gather(
+        timed_phase(startup_trace, "audio", asyncio.to_thread(prepare_audio)),
+        timed_phase(startup_trace, "keyboard", asyncio.to_thread(start_keyboard_listener)),
+    )
+    startup_trace.mark("capture_ready")
+    print(f"대화 준비 완료 ({startup_trace.marks['capture_ready']:.0f}ms, 부모님 연결은 백그라운드에서 이어서 준비)")
     
     # 사용시간 정보 표시
-    reset_daily_usage()
-    can_use, remaining_time = check_time_limit()
-    print(f"⏰ 오늘 사용 가능한 시간: {remaining_time}분 (제한: {daily_time_limit}분)")
+    session.reset_daily_usage()
+    can_use, remaining_time = session.check_time_limit()
+    print(f"⏰ 오늘 사용 가능한 시간: {format_duration(remaining_time)} (제한: {session.daily_time_limit}분)")
+    if len(session_registry.sessions) > 1:
+        print(f"세션 {len(session_registry.sessions)}개 중 '{session.device_id}:{session.child_id}' 세션으로 대화합니다.")
     
     print("(나가려면 Ctrl+C를 눌러줘)\n")
     
-    # 텔레그램 봇 시작
-    if TELEGRAM_BOT_TOKEN:
-        await start_telegram_bot()
-        print("텔레그램 봇이 연결되었습니다.")
-    else:
-        print("텔레그램 봇 토큰이 없습니다. 부모님과의 연결이 비활성화됩니다.")
-    
-    # 키보드 리스너 시작
-    listener = start_keyboard_listener()
-    
-    conversation_history = []
-    
-    # 부모님 메시지 확인 태스크 시작
-    parent_message_task = asyncio.create_task(check_parent_messages())
+    # 부모님 메시지는 대화 턴 사이에 바로 읽어줌
+    parent_message_task = asyncio.create_task(session.scheduler.run())
+    # 부모님에게 보낼 메시지는 따로 보냄 (텔레그램이 느리거나 끊겨도 대화는 계속, 봇이 붙으면 그때부터 전송)
+    outbox_task = asyncio.create_task(telegram_outbox.run())
     
     try:
         while True:
@@ -811,85 +3294,51 @@ async def main():
                     print("=키를 눌러서 이야기를 시작해줘.")
                 else:
                     print("키보드 리스너가 비활성화되었습니다. Enter를 눌러서 녹음을 시작하세요.")
-                    input("Enter를 눌러서 녹음을 시작하세요...")
+                    await asyncio.to_thread(input, "Enter를 눌러서 녹음을 시작하세요...")
                 
-                # 사용시간 제한 확인
-                can_use, remaining_time = check_time_limit()
+                # 사용시간 제한 확인 (턴 사이에 들려준 부모님 메시지 재생 시간도 반영)
+                session.add_usage_seconds(usage_meter.collect())
+                can_use, remaining_time = session.check_time_limit()
                 if not can_use:
-                    print(f"⏰ 오늘 사용시간이 모두 소진되었습니다. (제한: {daily_time_limit}분)")
+                    print(f"⏰ 오늘 사용시간이 모두 소진되었습니다. (제한: {session.daily_time_limit}분)")
                     print("내일 다시 만나자!")
-                    await text_to_speech("오늘은 여기까지야. 내일 다시 만나자!")
+                    await text_to_speech(FAREWELL_MESSAGE)
                     break
                 
-                print(f"⏰ 남은 사용시간: {remaining_time}분")
-                
-                audio_data = await record_audio_with_toggle()
+                print(f"⏰ 남은 사용시간: {format_duration(remaining_time)}")
                 
-                if audio_data is not None and len(audio_data) > 0:
-                    # 사용시간 추가 (대화 1회당 약 1분으로 계산)
-                    add_usage_time(1)
-                    
-                text = await speech_to_text(audio_data)
-                if text:
-                    print(f"너: {text}")
-                    
-                    # 리마인더가 있는지 확인하고 먼저 전달
-                    current_reminder_text = get_reminder()
-                    if current_reminder_text:
-                        print(f"📝 리마인더 전달: {current_reminder_text}")
-                        reminder_message = f"아, 맞다! 엄마가 말씀하신 게 있어. {current_reminder_text}라고 하셨어. 잊지 말고 해야 해!"
-                        await text_to_speech(reminder_message)
-                        clear_reminder()  # 전달 후 삭제
-                        print("리마인더를 전달하고 삭제했습니다.")
-                
-                    conversation_history.append({"role": "user", "content": text})
-                    response = await get_gpt_response(text, conversation_history)
-                    print(f"토닥: {response}")
-                    
-                    conversation_history.append({"role": "assistant", "content": response})
-                    
-                    # 대화 기록 추가
-                    add_conversation(text, response)
-                
-                    await text_to_speech(response)
-                    
-                    # 3회 대화 후 자동 리포트 생성
-                    global report_generated
-                    if conversation_count >= 3 and not report_generated:
-                        try:
-                            print("📊 3회 대화 완료! 성장 리포트를 생성합니다...")
-                            report = await generate_growth_report()
-                            if report:
-                                await send_report_to_parent(report)
-                                report_generated = True
-                        except Exception as e:
-                            print(f"리포트 생성/전송 중 오류: {e}")
-                            # 오류가 발생해도 프로그램은 계속 실행
-                    
-                    print("\n=== 이야기 완료 ===")
-                else:
-                    print("음성이 들리지 않았어. 다시 시도해볼까?")
+                await run_child_turn(session)
                 
             except KeyboardInterrupt:
                 print("\n\n안녕! 또 만나자! 토닥이 항상 여기 있을게!")
                 break
             except Exception as e:
+                # 한 턴이 실패해도 대화는 계속 (같은 오류가 빠르게 반복되지 않도록 잠깐 쉼)
                 print(f"\n어? 뭔가 문제가 생겼네. 다시 시도해볼까? {e}")
-                break
+                await asyncio.sleep(1)
                 
     except KeyboardInterrupt:
         print("\n\n안녕! 또 만나자! 토닥이 항상 여기 있을게!")
     finally:
         # 태스크 정리
         parent_message_task.cancel()
+        outbox_task.cancel()
+        services_task.cancel()
+        session_registry.close()
+        if state_store is not None:
+            state_store.close()
+        # 오디오 출력 정리
+        audio_player.close()
         # 키보드 리스너 정리
         if listener:
             listener.stop()
         # 텔레그램 봇 정리
         if telegram_app:
-            await telegram_app.updater.stop()
+            if telegram_app.updater.running:  # 시작 도중에 끝내면 폴링/웹훅이 아직 안 돌고 있을 수 있음
+                await telegram_app.updater.stop()
             await telegram_app.stop()
             await telegram_app.shutdown()
+        await client.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
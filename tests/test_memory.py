@@ -0,0 +1,24 @@
+"""대화 기록의 다음 턴 앞부분 미리 구성 테스트 (네트워크 없이 ConversationMemory만 사용)"""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import main  # noqa: E402
+
+
+def test_prepared_prefix_is_used_for_the_same_turn():
+    memory = main.ConversationMemory(system_prompt="시스템")
+    memory.prepare_next_prefix("안녕", "반가워!")
+    prepared = memory.next_prefix[1]
+    memory.add_turn("안녕", "반가워!")
+    assert memory.prefix_messages() is prepared
+    assert memory.build_messages("뭐 해?")[-1] == {"role": "user", "content": "뭐 해?"}
+
+
+def test_prepared_prefix_is_dropped_when_reply_was_cut():
+    memory = main.ConversationMemory(system_prompt="시스템")
+    memory.prepare_next_prefix("안녕", "반가워! 오늘 뭐 했어?")
+    memory.add_turn("안녕", "반가워!")
+    assert memory.next_prefix is None
+    assert memory.prefix_messages()[-1] == {"role": "assistant", "content": "반가워!"}
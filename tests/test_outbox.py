@@ -0,0 +1,94 @@
+"""부모님 메시지함 테스트 (텔레그램 봇은 가짜 객체로 바꿔서 사용)"""
+import asyncio
+import sys
+import types
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import main  # noqa: E402
+
+
+def test_short_message_is_not_split():
+    assert main.split_message("안녕하세요") == ["안녕하세요"]
+
+
+def test_long_message_is_split_at_paragraphs_within_limit():
+    paragraphs = ["가" * 3000, "나" * 3000, "다" * 100]
+    parts = main.split_message("\n\n".join(paragraphs))
+    assert parts == [paragraphs[0], paragraphs[1] + "\n\n" + paragraphs[2]]
+    assert all(len(part) <= main.TELEGRAM_MESSAGE_LIMIT for part in parts)
+
+
+def test_text_without_spaces_is_cut_at_limit():
+    parts = main.split_message("가" * (main.TELEGRAM_MESSAGE_LIMIT * 2 + 10))
+    assert [len(part) for part in parts] == [main.TELEGRAM_MESSAGE_LIMIT, main.TELEGRAM_MESSAGE_LIMIT, 10]
+
+
+def outbox():
+    return main.TelegramOutbox()
+
+
+def texts(batch):
+    return [item[2] for item in batch]
+
+
+def test_urgent_messages_go_first_in_order():
+    box = outbox()
+    box.send(1, "보통1", "메시지")
+    box.send(1, "급함1", "안전", urgent=True)
+    box.send(1, "보통2", "메시지")
+    box.send(1, "급함2", "안전", urgent=True)
+    assert [item[2] for item in box.pending] == ["급함1", "급함2", "보통1", "보통2"]
+
+
+def test_batch_coalesces_same_chat_and_urgency():
+    box = outbox()
+    box.send(1, "첫째", "메시지")
+    box.send(2, "다른 채팅", "메시지")
+    box.send(1, "둘째", "메시지")
+    box.send(1, "급함", "안전", urgent=True)
+    assert texts(box._take_batch()) == ["급함"]
+    box.pending.popleft()
+    assert texts(box._take_batch()) == ["첫째", "둘째"]
+
+
+def test_batch_stops_before_limit_to_keep_order():
+    box = outbox()
+    box.send(1, "가" * 3000, "메시지")
+    box.send(1, "나" * 2000, "메시지")
+    box.send(1, "다", "메시지")
+    assert texts(box._take_batch()) == ["가" * 3000]
+
+
+def test_long_message_is_split_when_queued():
+    box = outbox()
+    box.send(1, "가" * (main.TELEGRAM_MESSAGE_LIMIT + 1), "리포트")
+    assert [item[3] for item in box.pending] == ["리포트 (1/2)", "리포트 (2/2)"]
+
+
+def test_delivered_counts_messages_not_batches(monkeypatch):
+    sent = []
+    
+    async def send_message(chat_id, text):
+        sent.append(text)
+    
+    monkeypatch.setattr(main, "telegram_app", types.SimpleNamespace(bot=types.SimpleNamespace(send_message=send_message)))
+    monkeypatch.setattr(main, "TELEGRAM_COALESCE_SECONDS", 0.0)
+    monkeypatch.setattr(main, "TELEGRAM_CHAT_INTERVAL", 0.0)
+    monkeypatch.setattr(main, "TELEGRAM_GLOBAL_INTERVAL", 0.0)
+    monkeypatch.setitem(main.circuit_breakers, "telegram", main.CircuitBreaker("telegram"))
+    
+    async def scenario():
+        box = outbox()
+        for text in ["첫째", "둘째", "셋째"]:
+            box.send(1, text, "메시지")
+        task = asyncio.create_task(box.run())
+        while box.pending:
+            await asyncio.sleep(0.01)
+        task.cancel()
+        return box
+    
+    box = asyncio.run(scenario())
+    assert sent == ["첫째\n\n둘째\n\n셋째"]
+    assert (box.delivered, box.batches, box.dropped) == (3, 1, 0)
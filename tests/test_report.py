@@ -0,0 +1,43 @@
+"""성장 리포트 작업 테스트 (리포트 생성과 전송은 가짜 함수로 바꿔서 사용)"""
+import asyncio
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import main  # noqa: E402
+
+
+def test_auto_report_retries_after_failed_manual_report(monkeypatch):
+    builds = []
+    sent = []
+    
+    async def build_growth_report(session, count):
+        builds.append(count)
+        if len(builds) == 1:
+            raise RuntimeError("GPT 오류")
+        return "리포트"
+    
+    async def send_report_to_parent(session, report):
+        sent.append(report)
+    
+    monkeypatch.setattr(main, "build_growth_report", build_growth_report)
+    monkeypatch.setattr(main, "send_report_to_parent", send_report_to_parent)
+    
+    async def scenario():
+        session = main.ChildSession("doll", "child")
+        session.daily_conversations = ["대화"] * main.REPORT_MIN_CONVERSATIONS
+        session.conversation_count = main.REPORT_MIN_CONVERSATIONS
+        try:
+            await main.generate_growth_report(session)  # 부모님의 /report가 실패
+        except RuntimeError:
+            pass
+        # 같은 대화 수에서 자동 리포트가 실패한 작업을 새로 만들어야 함 (자기 자신을 기다리지 않음)
+        main.schedule_automatic_report(session)
+        await asyncio.wait_for(session.auto_report_task, 1)
+        return session
+    
+    session = asyncio.run(scenario())
+    assert sent == ["리포트"]
+    assert session.report_generated
+    assert session.auto_report_task is not session.report_task
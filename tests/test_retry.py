@@ -0,0 +1,116 @@
+"""재시도와 회로 차단기 테스트 (네트워크 없이 가짜 요청 함수만 사용)"""
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import main  # noqa: E402
+
+
+@pytest.fixture
+def breaker(monkeypatch):
+    monkeypatch.setattr(main, "RETRY_BASE_DELAY", 0.0)
+    breaker = main.CircuitBreaker("stt", failures=2, cooldown=60)
+    monkeypatch.setitem(main.circuit_breakers, "stt", breaker)
+    return breaker
+
+
+def fake_call(results):
+    """results를 차례로 돌려주거나 던지는 요청 함수 (호출 수는 calls에)"""
+    calls = []
+    
+    async def make_call():
+        result = results[len(calls)]
+        calls.append(result)
+        if isinstance(result, BaseException):
+            raise result
+        return result
+    return make_call, calls
+
+
+def run(make_call, **kwargs):
+    return asyncio.run(main.call_with_retry("stt", make_call, **kwargs))
+
+
+def test_retryable_error_is_retried(breaker):
+    make_call, calls = fake_call([ConnectionError("끊김"), "결과"])
+    assert run(make_call, attempts=3) == "결과"
+    assert len(calls) == 2
+    assert breaker.failures == 0
+
+
+def test_non_retryable_error_is_raised_at_once(breaker):
+    make_call, calls = fake_call([ValueError("잘못된 요청"), "결과"])
+    with pytest.raises(ValueError):
+        run(make_call, attempts=3)
+    assert len(calls) == 1
+    assert breaker.failures == 0
+
+
+def test_no_retry_past_deadline(breaker, monkeypatch):
+    monkeypatch.setattr(main, "RETRY_BASE_DELAY", 1.0)
+    monkeypatch.setattr(main.random, "uniform", lambda low, high: high)
+    make_call, calls = fake_call([ConnectionError("끊김"), "결과"])
+    with pytest.raises(ConnectionError):
+        run(make_call, attempts=3, deadline=0.5)
+    assert len(calls) == 1
+
+
+def test_breaker_opens_after_repeated_failures(breaker):
+    make_call, calls = fake_call([ConnectionError("끊김")] * 3)
+    with pytest.raises(ConnectionError):
+        run(make_call, attempts=3)
+    assert len(calls) == 2  # 두 번째 실패에서 열려서 더 보내지 않음
+    with pytest.raises(main.CircuitOpen):
+        run(make_call)
+    assert len(calls) == 2
+
+
+def open_breaker(breaker):
+    breaker.failures = breaker.max_failures
+    breaker.opened_at = main.time.monotonic() - breaker.cooldown  # 쉬는 시간이 막 끝남
+
+
+def test_half_open_lets_one_probe_through(breaker):
+    open_breaker(breaker)
+    
+    async def scenario():
+        release = asyncio.Event()
+        
+        async def slow_probe():
+            await release.wait()
+            return "회복"
+        
+        probe = asyncio.create_task(main.call_with_retry("stt", slow_probe))
+        await asyncio.sleep(0)
+        with pytest.raises(main.CircuitOpen):
+            await main.call_with_retry("stt", slow_probe)  # 시험 요청이 끝날 때까지 나머지는 막음
+        release.set()
+        return await probe
+    
+    assert asyncio.run(scenario()) == "회복"
+    assert breaker.opened_at is None
+    assert breaker.allow()
+
+
+def test_failed_probe_reopens(breaker):
+    open_breaker(breaker)
+    make_call, calls = fake_call([ConnectionError("끊김"), "결과"])
+    with pytest.raises(ConnectionError):
+        run(make_call, attempts=3)
+    assert len(calls) == 1
+    assert breaker.retry_in() > 0
+    assert not breaker.allow()
+
+
+@pytest.mark.parametrize("error", [ValueError("잘못된 요청"), asyncio.CancelledError()])
+def test_probe_without_verdict_is_released(breaker, error):
+    open_breaker(breaker)
+    make_call, _ = fake_call([error])
+    with pytest.raises(type(error)):
+        run(make_call)
+    assert not breaker.probing
+    assert breaker.allow()  # 다음 요청이 다시 시험
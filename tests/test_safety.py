@@ -0,0 +1,104 @@
+"""안전 신호 단어 사전과 의도 분류 테스트 (오디오/네트워크 없이 main.py의 순수 함수만 사용)"""
+import sys
+import types
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import main  # noqa: E402
+
+
+def categories(text):
+    return main.safety_categories(main.normalize_utterance(text))
+
+
+@pytest.mark.parametrize("text, category", [
+    ("죽고 싶어", "self_harm"),
+    ("손목을 긋고 싶어", "self_harm"),
+    ("아빠가 때렸어", "abuse"),
+    ("형이 나를 막 때렸어", "abuse"),
+    ("친구가 날 밀쳤어", "abuse"),
+    ("아빠한테 맞았어", "abuse"),
+    ("삼촌이 방에 가둬서 못 나갔어", "abuse"),
+    ("엄마가 비밀로 하래", "abuse"),
+    ("모르는 아저씨가 따라오래", "danger"),
+    ("형이 칼로 찌른다고 했어", "danger"),
+])
+def test_true_positives(text, category):
+    assert category in categories(text)
+    assert main.classify_intent(text) == main.INTENT_SAFETY
+
+
+@pytest.mark.parametrize("text", [
+    "퀴즈 맞았어",
+    "내가 맞았어! 정답이지?",
+    "엄마가 칼로 사과 깎아줬어",
+    "손목을 다쳤어",
+    "가둬 놓고 놀았어",
+    "공을 때렸어",
+    "친구가 공을 때렸어",
+    "아빠가 모기를 때려서 잡았어",
+    "형이 북을 때리고 놀았어",
+    "네 말이 맞았어!",
+    "칼로 자를 때는 어른이랑 같이 해요",
+])
+def test_everyday_phrases_are_not_safety_signals(text):
+    assert categories(text) == set()
+    assert main.classify_intent(text) != main.INTENT_SAFETY
+
+
+def reminder_session():
+    """리마인더를 전한 다음 턴의 세션"""
+    return types.SimpleNamespace(reminder_ack_turn=1, conversation_count=1)
+
+
+def test_bare_yes_after_reminder_is_chat():
+    # 리마인더 뒤에는 토닥의 대답이 이어지므로 "응"은 그 대답에 대한 말일 수 있음
+    for text in ["응", "네", "그래"]:
+        assert main.classify_intent(text, reminder_session()) == main.INTENT_CHAT
+    assert main.classify_intent("알았어 꼭 할게", reminder_session()) == main.INTENT_REMINDER_ACK
+
+
+@pytest.mark.parametrize("text, intent", [
+    ("엄마한테 보고 싶다고 전해줘", main.INTENT_FORWARD),
+    ("아빠에게 알려줘, 걱정하지 마", main.INTENT_FORWARD),
+    ("엄마한테 이거 말해주면 안돼", main.INTENT_CHAT),
+    ("아빠에게 알려주지 마", main.INTENT_CHAT),
+    ("엄마한테는 말해주지 말아줘", main.INTENT_CHAT),
+    ("부모님께 전달하지 마", main.INTENT_CHAT),
+])
+def test_forward_respects_prohibition(text, intent):
+    assert main.classify_intent(text) == intent
+
+
+@pytest.mark.parametrize("text, intent", [
+    ("몇 분 남았어?", main.INTENT_TIME_LEFT),
+    ("오늘 시간 얼마나 남았어?", main.INTENT_TIME_LEFT),
+    ("언제까지 놀 수 있어?", main.INTENT_TIME_LEFT),
+    ("생일까지 얼마나 남았어?", main.INTENT_CHAT),
+    ("크리스마스 얼마나 남았어?", main.INTENT_CHAT),
+])
+def test_time_left_needs_usage_time(text, intent):
+    assert main.classify_intent(text) == intent
+
+
+def alert_session():
+    return types.SimpleNamespace(safety_alerted={}, safety_alerted_texts=set(), parent_chat_id=None, moderation_tasks=set())
+
+
+def test_reply_is_not_screened_with_child_word_list(monkeypatch):
+    monkeypatch.setattr(main, "SAFETY_MODERATION", False)
+    session = alert_session()
+    assert main.screen_for_safety(session, "아빠가 때렸어", "reply") == set()
+    assert session.safety_alerted == {}
+    assert main.screen_for_safety(session, "아빠가 때렸어", "child") == {"abuse"}
+
+
+def test_same_utterance_alerts_once(monkeypatch, capsys):
+    monkeypatch.setattr(main, "SAFETY_ALERT_COOLDOWN", 0)
+    session = alert_session()
+    for _ in range(3):
+        main.raise_safety_alert(session, "아빠가 때렸어", "child", {"abuse"})
+    assert capsys.readouterr().out.count("안전 신호 감지") == 1
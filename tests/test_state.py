@@ -0,0 +1,99 @@
+"""상태 저장소 테스트 (임시 폴더의 SQLite 파일 사용)"""
+import sqlite3
+import sys
+from datetime import date
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import main  # noqa: E402
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return tmp_path / "state" / "todak_state.db"
+
+
+def open_store(path):
+    store = main.StateStore(path)
+    store.open()
+    return store
+
+
+def test_session_round_trip(db_path):
+    store = open_store(db_path)
+    session = main.ChildSession("doll", "child", store=store)
+    session.last_reset_date = date.today()
+    session.daily_time_limit = 45
+    session.daily_usage_seconds = 125.5
+    session.report_generated = True
+    session.save()
+    store.save_reminder(session, "양치하기")
+    store.add_conversation(session, {"timestamp": "09:00", "user": "안녕", "ai": "반가워!"}, 0)
+    store.add_conversation(session, {"timestamp": "09:01", "user": "뭐 해?", "ai": "너랑 이야기해!"}, 1)
+    store.save_summary(session, 1, "인사를 나눔")
+    session.report_cache = (2, "리포트")
+    store.save_report(session)
+    store.close()
+    
+    restored = main.ChildSession("doll", "child", store=open_store(db_path))
+    assert restored.store.load(restored)
+    restored.store.close()
+    assert restored.daily_time_limit == 45
+    assert restored.daily_usage_seconds == 125.5
+    assert restored.last_reset_date == date.today()
+    assert restored.report_generated
+    assert restored.report_cache == (2, "리포트")
+    assert restored.scheduler.peek(main.SPEAK_REMINDER) == "양치하기"
+    assert [(c["user"], c["summary"]) for c in restored.daily_conversations] == [("안녕", None), ("뭐 해?", "인사를 나눔")]
+    assert restored.conversation_count == 2
+
+
+def test_unknown_session_is_not_loaded(db_path):
+    store = open_store(db_path)
+    assert not store.load(main.ChildSession("doll", "nobody", store=store))
+    store.close()
+
+
+def test_outbox_keeps_urgent_first_and_forgets_sent(db_path):
+    store = open_store(db_path)
+    store.add_outbox("1", "42", "첫 메시지", "부모님 메시지")
+    store.add_outbox("2", "42", "안전 알림", "안전 신호", urgent=True)
+    store.add_outbox("3", "42", "보낸 메시지", "부모님 메시지")
+    store.remove_outbox("3")
+    store.close()
+    
+    store = open_store(db_path)
+    assert [row[0] for row in store.load_outbox()] == ["2", "1"]
+    store.close()
+
+
+def test_old_file_is_migrated(db_path):
+    # 열이 추가되기 전의 파일 (사용시간은 분 단위만 있음)
+    db_path.parent.mkdir(parents=True)
+    with sqlite3.connect(db_path) as connection:
+        connection.executescript("""
+            CREATE TABLE sessions (device_id TEXT NOT NULL, child_id TEXT NOT NULL, daily_time_limit INTEGER NOT NULL,
+                daily_usage_time INTEGER NOT NULL, last_reset_date TEXT, report_generated INTEGER NOT NULL DEFAULT 0,
+                reminder TEXT, PRIMARY KEY (device_id, child_id));
+            CREATE TABLE conversations (id INTEGER PRIMARY KEY AUTOINCREMENT, device_id TEXT NOT NULL, child_id TEXT NOT NULL,
+                day TEXT NOT NULL, timestamp TEXT NOT NULL, user_text TEXT NOT NULL, ai_text TEXT NOT NULL);
+            CREATE TABLE outbox (key TEXT PRIMARY KEY, chat_id TEXT NOT NULL, text TEXT NOT NULL, note TEXT, created TEXT NOT NULL);
+        """)
+        connection.execute("INSERT INTO sessions VALUES ('doll', 'child', 30, 5, ?, 0, NULL)", (date.today().isoformat(),))
+        connection.execute("INSERT INTO conversations (device_id, child_id, day, timestamp, user_text, ai_text) "
+                           "VALUES ('doll', 'child', ?, '09:00', '안녕', '반가워!')", (date.today().isoformat(),))
+    
+    store = open_store(db_path)
+    session = main.ChildSession("doll", "child", store=store)
+    assert store.load(session)
+    assert session.daily_usage_seconds == 300
+    assert session.daily_conversations[0]["summary"] is None
+    store.add_outbox("1", "42", "메시지", "부모님 메시지", urgent=True)
+    store.close()
+    
+    with sqlite3.connect(db_path) as connection:
+        for table, column, _ in main.StateStore.MIGRATIONS:
+            assert column in {row[1] for row in connection.execute(f"PRAGMA table_info({table})")}
@@ -0,0 +1,51 @@
+"""녹음 중 조각 인식 테스트 (녹음과 STT는 가짜 함수로 바꿔서 사용)"""
+import asyncio
+import sys
+import types
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import main  # noqa: E402
+
+numpy = pytest.importorskip("numpy")
+
+
+def fake_recording(monkeypatch, failing_chunk):
+    """4초 녹음 중 2초 지점에서 한 번 쉬고, failing_chunk번째 조각 인식이 실패하는 환경"""
+    seconds = 4 * main.sample_rate
+    monkeypatch.setattr(main, "vad", types.SimpleNamespace(speech_bounds=lambda: (0, seconds), speech_end=seconds))
+    monkeypatch.setattr(main, "capture_buffer", types.SimpleNamespace(slice=lambda start, end: numpy.zeros(end - start, numpy.int16)))
+    calls = []
+    
+    async def speech_to_text(audio, prompt=None):
+        calls.append(len(audio))
+        if len(calls) == failing_chunk:
+            raise RuntimeError("STT 오류")
+        return f"조각{len(calls)}"
+    
+    async def record_audio_with_toggle():
+        main.active_transcriber.add_cut(2 * main.sample_rate)
+        await asyncio.sleep(0)
+        return numpy.zeros(seconds, numpy.int16)
+    
+    monkeypatch.setattr(main, "speech_to_text", speech_to_text)
+    monkeypatch.setattr(main, "record_audio_with_toggle", record_audio_with_toggle)
+
+
+async def collect():
+    return [text async for text in main.transcribe_while_recording()]
+
+
+def test_chunks_are_joined_in_order(monkeypatch):
+    fake_recording(monkeypatch, failing_chunk=None)
+    assert asyncio.run(collect())[-1] == "조각1 조각2"
+
+
+@pytest.mark.parametrize("failing_chunk", [1, 2])
+def test_failed_chunk_fails_the_transcript(monkeypatch, failing_chunk):
+    fake_recording(monkeypatch, failing_chunk)
+    with pytest.raises(main.TranscriptionFailed):
+        asyncio.run(collect())
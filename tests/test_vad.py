@@ -0,0 +1,80 @@
+"""음성 구간 검출기와 녹음 키 테스트 (합성한 소음과 말소리 블록만 사용)"""
+import sys
+import types
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import main  # noqa: E402
+
+numpy = pytest.importorskip("numpy")
+
+
+@pytest.fixture
+def vad(monkeypatch):
+    monkeypatch.setattr(main, "np", numpy)
+    return main.VoiceActivityDetector()
+
+
+def blocks(seconds, amplitude, tone=None, seed=0):
+    """선풍기 같은 저음 소음 (tone이 있으면 그 주파수의 말소리를 더함)"""
+    rng = numpy.random.default_rng(seed)
+    count = int(seconds * main.sample_rate)
+    noise = numpy.convolve(rng.standard_normal(count), numpy.ones(8) / 8, mode="same") * amplitude
+    if tone is not None:
+        noise += 0.3 * numpy.sin(2 * numpy.pi * tone * numpy.arange(count) / main.sample_rate)
+    samples = noise.astype(numpy.float32)
+    return [samples[i:i + main.CAPTURE_BLOCKSIZE] for i in range(0, count - main.CAPTURE_BLOCKSIZE + 1, main.CAPTURE_BLOCKSIZE)]
+
+
+def run(vad, sequence):
+    position = 0
+    for block in sequence:
+        if vad.process(block, position):
+            return position
+        position += len(block)
+    return None
+
+
+@pytest.mark.parametrize("amplitude", [0.001, 0.05])
+def test_stops_after_speech_in_quiet_and_noisy_rooms(vad, amplitude):
+    sequence = blocks(0.5, amplitude) + blocks(1.0, amplitude, tone=300, seed=1) + blocks(3.0, amplitude, seed=2)
+    stopped = run(vad, sequence)
+    assert stopped is not None
+    assert stopped < 3.0 * main.sample_rate  # 말이 끝나고 1.2초 남짓 뒤
+    start, _ = vad.speech_bounds(padding_seconds=0)
+    assert abs(start - 0.5 * main.sample_rate) < 0.3 * main.sample_rate
+
+
+def test_noise_alone_is_not_speech(vad):
+    assert run(vad, blocks(3.0, 0.05)) is None
+    assert not vad.speech_detected
+
+
+def press(monkeypatch, barge_ins):
+    monkeypatch.setattr(main.audio_player, "barge_in", lambda: barge_ins.append(1))
+    main.on_key_press(types.SimpleNamespace(char="="))
+
+
+def test_key_after_auto_stop_does_not_start_recording(monkeypatch):
+    monkeypatch.setattr(main, "is_recording", False)
+    monkeypatch.setattr(main, "auto_stopped_at", None)
+    barge_ins = []
+    press(monkeypatch, barge_ins)
+    assert main.is_recording
+    main.stop_recording(auto=True)  # 말이 끝나서 저절로 멈춤
+    press(monkeypatch, barge_ins)  # 아이가 평소처럼 끝내려고 누른 =키
+    assert not main.is_recording
+    assert barge_ins == [1]
+    press(monkeypatch, barge_ins)  # 그다음 =키는 새 이야기
+    assert main.is_recording
+    assert barge_ins == [1, 1]
+
+
+def test_key_long_after_auto_stop_starts_recording(monkeypatch):
+    monkeypatch.setattr(main, "is_recording", False)
+    monkeypatch.setattr(main, "auto_stopped_at", main.time.monotonic() - main.VAD_KEY_GRACE_SECONDS - 1)
+    press(monkeypatch, [])
+    assert main.is_recording